@@ -0,0 +1,81 @@
+"""
+Async access to the build history database for the FastAPI routers.
+BuildRepository mirrors the database_api functions, running each call on
+a small dedicated thread pool so a slow query never blocks the event loop.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from functools import partial
+from typing import Any, Callable
+from app.lib import database_api
+
+DEFAULT_WORKERS = database_api.POOL_SIZE
+
+
+class BuildRepository:
+    """Awaitable versions of the database_api query functions"""
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ci-db")
+
+    async def _run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    async def get_entries(self, **kwargs):
+        return await self._run(database_api.get_entries, **kwargs)
+
+    async def get_build_summaries(self, *args, **kwargs):
+        return await self._run(database_api.get_build_summaries, *args, **kwargs)
+
+    async def get_latest_build_id(self, **kwargs) -> int:
+        return await self._run(database_api.get_latest_build_id, **kwargs)
+
+    async def get_entry_by_commit(self, commit_hash: str, *args, **kwargs):
+        return await self._run(database_api.get_entry_by_commit, commit_hash, *args, **kwargs)
+
+    async def get_attempts(self, commit_hash: str, *args, **kwargs):
+        return await self._run(database_api.get_attempts, commit_hash, *args, **kwargs)
+
+    async def build_exists(self, build_id: int, **kwargs) -> bool:
+        return await self._run(database_api.build_exists, build_id, **kwargs)
+
+    async def get_build_logs(self, build_id: int, **kwargs):
+        return await self._run(database_api.get_build_logs, build_id, **kwargs)
+
+    async def get_stage_log(self, build_id: int, stage: str, **kwargs):
+        return await self._run(database_api.get_stage_log, build_id, stage, **kwargs)
+
+    async def get_stage_results(self, build_id: int, **kwargs):
+        return await self._run(database_api.get_stage_results, build_id, **kwargs)
+
+    async def get_entry_by_id(self, build_id: int, **kwargs):
+        return await self._run(database_api.get_entry_by_id, build_id, **kwargs)
+
+    async def get_entries_by_date(self, build_date: date | str, **kwargs):
+        return await self._run(database_api.get_entries_by_date, build_date, **kwargs)
+
+    async def get_builds_between(self, *args, **kwargs):
+        return await self._run(database_api.get_builds_between, *args, **kwargs)
+
+    async def get_branch_builds(self, branch: str, **kwargs):
+        return await self._run(database_api.get_branch_builds, branch, **kwargs)
+
+    async def get_latest_build(self, branch: str, **kwargs):
+        return await self._run(database_api.get_latest_build, branch, **kwargs)
+
+    async def get_stage_durations(self, **kwargs):
+        return await self._run(database_api.get_stage_durations, **kwargs)
+
+    async def get_test_timings(self, **kwargs):
+        return await self._run(database_api.get_test_timings, **kwargs)
+
+    async def create_new_entry(self, *args, **kwargs):
+        return await self._run(database_api.create_new_entry, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+build_repository = BuildRepository()
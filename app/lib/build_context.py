@@ -0,0 +1,111 @@
+"""
+Per-build context.
+Everything a build knows about itself (repository, commit, branch, job id,
+checkout and deadline) is kept on one BuildContext that run_build passes
+explicitly to the clone, the stages, the status updates and the database,
+so concurrent builds never share mutable state. build_scope() also makes
+the context current in a context variable, which stage and shard threads
+and asyncio tasks inherit, for code that only needs to log or check for
+cancellation.
+"""
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from app.lib.cancel import CancelToken, cancel_scope
+from app.lib.log import log_context
+
+DEFAULT_BUILD_TIMEOUT = 3600
+CHECKOUT_DIR = "./cloned_repo"
+
+
+class DeadlineExceeded(Exception):
+    """The build ran out of its time budget (CI_BUILD_TIMEOUT)"""
+
+
+def build_timeout() -> float:
+    """Time budget of a whole build in seconds (CI_BUILD_TIMEOUT)"""
+    try:
+        return max(1.0, float(os.getenv("CI_BUILD_TIMEOUT", DEFAULT_BUILD_TIMEOUT)))
+    except ValueError:
+        return DEFAULT_BUILD_TIMEOUT
+
+
+class BuildContext:
+    """The repository, commit and limits of one build"""
+
+    def __init__(self, build_key: str, repository: str, clone_url: str, commit_sha: str, branch: str,
+                 commits: Optional[List[Dict[str, Any]]] = None, use_cache: bool = True,
+                 timeout: Optional[float] = None, token: Optional[CancelToken] = None):
+        self.build_key = build_key
+        self.repository = repository
+        self.clone_url = clone_url
+        self.commit_sha = commit_sha
+        self.branch = branch
+        self.commits = commits or []
+        self.use_cache = use_cache
+        self.started = time.monotonic()
+        self.deadline = self.started + (timeout if timeout is not None else build_timeout())
+        self.token = token or CancelToken()
+        # Set once the results are stored
+        self.build_id: Optional[int] = None
+
+    @classmethod
+    def from_payload(cls, payload, build_key: str, use_cache: bool = True,
+                     token: Optional[CancelToken] = None) -> "BuildContext":
+        """Context for a build of a push event (a WebhookPayload)"""
+        return cls(
+            build_key=build_key,
+            repository=payload.repository["full_name"],
+            clone_url=payload.repository["clone_url"],
+            commit_sha=payload.head_commit["id"],
+            branch=payload.ref.replace("refs/heads/", ""),
+            commits=payload.commits,
+            use_cache=use_cache,
+            token=token
+        )
+
+    @property
+    def checkout_name(self) -> str:
+        """Directory name of the checkout, unique to this build"""
+        return f"{self.clone_url.split('/')[-1].split('.')[0]}-{self.build_key}"
+
+    @property
+    def repo_path(self) -> str:
+        return f"{CHECKOUT_DIR}/{self.checkout_name}"
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def timeout_for(self, timeout: float) -> float:
+        """timeout capped by what is left of the build's budget"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Build exceeded its time budget of {round(self.deadline - self.started)} seconds")
+        return min(timeout, remaining)
+
+    def cancelled_reason(self) -> Optional[str]:
+        """Why the build was cancelled, or None if it was not"""
+        return self.token.reason if self.token.cancelled else None
+
+    def log_fields(self) -> Dict[str, str]:
+        return {"build": self.build_key, "repository": self.repository, "commit": self.commit_sha}
+
+
+_current: contextvars.ContextVar[Optional[BuildContext]] = contextvars.ContextVar("ci_build", default=None)
+
+
+@contextmanager
+def build_scope(build: BuildContext) -> Iterator[BuildContext]:
+    """Make build current, with its log fields and cancel token, in this block"""
+    reset = _current.set(build)
+    try:
+        with cancel_scope(build.token), log_context(**build.log_fields()):
+            yield build
+    finally:
+        _current.reset(reset)
+
+
+def current_build() -> Optional[BuildContext]:
+    return _current.get()
@@ -0,0 +1,189 @@
+"""
+Background build queue for the CI server.
+Webhook deliveries are turned into jobs that a fixed size pool of worker
+threads runs, so the request handler can return right away. Jobs submitted
+with the same group (a repository's branch) supersede each other: a new job
+cancels the older ones that are still queued or running.
+"""
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Optional
+from app.lib.cancel import BuildCancelled, CancelToken, cancel_scope
+from app.lib.metrics import ACTIVE_BUILDS, QUEUE_DEPTH, SUPERSEDED_BUILDS
+
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+SUPERSEDED = "superseded"
+ACTIVE = (QUEUED, RUNNING)
+DONE = (FINISHED, FAILED, SUPERSEDED)
+
+DEFAULT_WORKERS = 2
+FINISHED_HISTORY = 100
+
+logger = logging.getLogger(__name__)
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+class BuildJob:
+    """A single build waiting in, or taken from, the queue"""
+
+    def __init__(self, job_id: str, info: Dict[str, Any], group: Optional[str] = None):
+        self.id = job_id
+        self.info = info
+        self.group = group
+        self.token = CancelToken()
+        self.status = QUEUED
+        self.queued_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.done = threading.Event()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "queued_at": self.queued_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "error": self.error,
+            **self.info,
+        }
+
+
+class BuildQueue:
+    """Runs build jobs on a pool of worker threads and keeps track of them"""
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS, history_size: int = FINISHED_HISTORY):
+        self.max_workers = max_workers
+        self.history_size = history_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ci-build")
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, BuildJob]" = OrderedDict()
+
+    def submit(self, fn: Callable[..., Any], *args, info: Optional[Dict[str, Any]] = None,
+               job_id: Optional[str] = None, group: Optional[str] = None) -> str:
+        """
+        Add a job to the queue and return its id. Older queued or running
+        jobs of the same group are superseded by it.
+        """
+        job = BuildJob(job_id or new_job_id(), info or {}, group)
+        with self._lock:
+            older = [other for other in self._jobs.values()
+                     if group is not None and other.group == group and other.status in ACTIVE]
+            self._jobs[job.id] = job
+        for other in older:
+            self.supersede(other.id, job.info.get("commit") or job.id)
+        self._executor.submit(self._run, job, fn, args)
+        return job.id
+
+    def supersede(self, job_id: str, by: str) -> bool:
+        """
+        Cancel a queued or running job in favour of by (a commit or job id). A queued job
+        never starts; a running one has its subprocesses killed and ends as
+        soon as the build notices. Returns False if the job is already done.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in ACTIVE:
+                return False
+            queued = job.status == QUEUED
+            if queued:
+                job.status = SUPERSEDED
+                job.error = f"Superseded by {by}"
+                job.finished_at = datetime.now()
+        logger.info("Build job %s superseded by %s", job_id, by)
+        SUPERSEDED_BUILDS.inc()
+        # Runs the kill callbacks of a running build
+        job.token.cancel(f"Superseded by {by}")
+        if queued:
+            job.done.set()
+        return True
+
+    def _run(self, job: BuildJob, fn: Callable[..., Any], args) -> None:
+        with self._lock:
+            if job.status != QUEUED:
+                # Superseded while it waited
+                return
+            job.status = RUNNING
+            job.started_at = datetime.now()
+        try:
+            with cancel_scope(job.token):
+                result = fn(*args)
+            if job.token.cancelled:
+                status, error = SUPERSEDED, job.token.reason
+            else:
+                status, error = FINISHED, None
+        except BuildCancelled as e:
+            result, status, error = None, SUPERSEDED, str(e)
+        except Exception as e:
+            logger.exception("Build job %s failed", job.id)
+            result, status, error = None, FAILED, str(e)
+        with self._lock:
+            job.result = result
+            job.status = status
+            job.error = error
+            job.finished_at = datetime.now()
+            self._prune()
+        job.done.set()
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs once the history is full"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at]
+        for job_id in finished[:max(0, len(finished) - self.history_size)]:
+            del self._jobs[job_id]
+
+    def get_job(self, job_id: str) -> Optional[BuildJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def find(self, statuses: Iterable[str] = ACTIVE + DONE, **info) -> Optional[BuildJob]:
+        """The newest job with one of statuses whose info has all the given values"""
+        statuses = set(statuses)
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job.status in statuses and all(job.info.get(key) == value for key, value in info.items()):
+                    return job
+        return None
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[BuildJob]:
+        """Block until the job is done (or the timeout expires) and return it"""
+        job = self.get_job(job_id)
+        if job is not None:
+            job.done.wait(timeout)
+        return job
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the queued, running and finished jobs, oldest first"""
+        with self._lock:
+            jobs = [job.to_dict() for job in self._jobs.values()]
+        return {
+            "workers": self.max_workers,
+            "queued": [job for job in jobs if job["status"] == QUEUED],
+            "running": [job for job in jobs if job["status"] == RUNNING],
+            "finished": [job for job in jobs if job["status"] in DONE],
+        }
+
+    def count(self, status: str) -> int:
+        """Number of jobs with status, cheap enough to call on every metrics scrape"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == status)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+build_queue = BuildQueue(int(os.getenv("CI_BUILD_WORKERS", DEFAULT_WORKERS)))
+QUEUE_DEPTH.set_function(lambda: build_queue.count(QUEUED))
+ACTIVE_BUILDS.set_function(lambda: build_queue.count(RUNNING))
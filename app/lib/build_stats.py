@@ -0,0 +1,59 @@
+"""
+Aggregates for the /builds/stats page.
+Turns the raw stage durations and per-test timings recorded with each build
+into percentiles per day and per test, and the slowest tests per branch.
+"""
+import math
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+SLOWEST_TESTS = 20
+SLOWEST_PER_BRANCH = 5
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of samples"""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(len(ordered) * pct / 100) - 1)]
+
+
+def _describe(samples: List[float]) -> Dict[str, Any]:
+    return {
+        "runs": len(samples),
+        "p50": round(percentile(samples, 50), 3),
+        "p95": round(percentile(samples, 95), 3),
+        "max": round(max(samples), 3),
+    }
+
+
+def stage_trends(rows: List[Tuple[str, str, float]]) -> List[Dict[str, Any]]:
+    """p50/p95 stage durations (seconds) per day, from (build_date, stage, seconds) rows"""
+    samples: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+    for build_date, stage, seconds in rows:
+        samples[(build_date, stage)].append(seconds)
+    return [dict(_describe(durations), date=build_date, stage=stage)
+            for (build_date, stage), durations in sorted(samples.items())]
+
+
+def slowest_tests(rows: List[Tuple[str, str, str, str, int]], limit: int = SLOWEST_TESTS) -> List[Dict[str, Any]]:
+    """Tests with the highest p95 duration (seconds), from (branch, repository, stage, node_id, ms) rows"""
+    samples: Dict[Tuple[str, str, str], List[float]] = defaultdict(list)
+    for _, repository, stage, node_id, duration_ms in rows:
+        samples[(repository, stage, node_id)].append(duration_ms / 1000)
+    tests = [dict(_describe(durations), repository=repository, stage=stage, test=node_id)
+             for (repository, stage, node_id), durations in samples.items()]
+    return sorted(tests, key=lambda test: (-test["p95"], test["test"]))[:limit]
+
+
+def slowest_by_branch(rows: List[Tuple[str, str, str, str, int]],
+                      per_branch: int = SLOWEST_PER_BRANCH) -> Dict[str, List[Dict[str, Any]]]:
+    """The tests with the highest p50 duration (seconds) on each branch"""
+    samples: Dict[str, Dict[Tuple[str, str, str], List[float]]] = defaultdict(lambda: defaultdict(list))
+    for branch, repository, stage, node_id, duration_ms in rows:
+        samples[branch][(repository, stage, node_id)].append(duration_ms / 1000)
+    result = {}
+    for branch in sorted(samples):
+        tests = [dict(_describe(durations), repository=repository, stage=stage, test=node_id)
+                 for (repository, stage, node_id), durations in samples[branch].items()]
+        result[branch] = sorted(tests, key=lambda test: (-test["p50"], test["test"]))[:per_branch]
+    return result
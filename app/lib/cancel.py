@@ -0,0 +1,102 @@
+"""
+Cancellation of running builds.
+The build queue runs each build inside cancel_scope() with the job's
+CancelToken. Code that starts a subprocess registers a way to kill it with
+on_cancel(), so cancelling the token stops the build's tests right away;
+the build itself checks check_cancelled() between steps. Outside a build
+(tests, scripts) there is no token and both are no-ops.
+"""
+import contextvars
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BuildCancelled(Exception):
+    """The build was cancelled, e.g. superseded by a newer push"""
+
+
+class CancelToken:
+    """Cancellation flag of one build plus the callbacks that stop its work"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self.cancelled = False
+        self.reason = ""
+
+    def cancel(self, reason: str = "Cancelled") -> bool:
+        """Cancel and run the registered callbacks. Returns False if already cancelled."""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.cancelled = True
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._call(callback)
+        return True
+
+    def _call(self, callback: Callable[[], None]) -> None:
+        try:
+            callback()
+        except Exception as e:
+            logger.warning("Cancel callback failed: %s", e)
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """Call callback on cancel, or right away if the token is already cancelled"""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        self._call(callback)
+
+    def remove_callback(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self) -> None:
+        if self.cancelled:
+            raise BuildCancelled(self.reason)
+
+
+_current: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar("ci_cancel_token", default=None)
+
+
+@contextmanager
+def cancel_scope(token: CancelToken) -> Iterator[CancelToken]:
+    """Make token the current build's token in this block"""
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+def current_token() -> Optional[CancelToken]:
+    return _current.get()
+
+
+@contextmanager
+def on_cancel(callback: Callable[[], None]) -> Iterator[None]:
+    """Call callback if the current build is cancelled while the block runs"""
+    token = _current.get()
+    if token is None:
+        yield
+        return
+    token.add_callback(callback)
+    try:
+        yield
+    finally:
+        token.remove_callback(callback)
+
+
+def check_cancelled() -> None:
+    """Raise BuildCancelled if the current build was cancelled"""
+    token = _current.get()
+    if token is not None:
+        token.raise_if_cancelled()
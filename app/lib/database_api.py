@@ -2,97 +2,523 @@
 Small library for querying the build history database.
 Uses SQLAlchemy ORM for database operations.
 """
-from datetime import datetime
-from sqlalchemy import create_engine, Column, String, Integer
+from contextlib import contextmanager
+from datetime import date, datetime, time as time_of_day, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from sqlalchemy import create_engine, event, func, insert, literal, select, Column, DateTime, Index, String, \
+    Integer, Float, LargeBinary, ForeignKey, UniqueConstraint
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker, Session
+from app.lib.migrations import migrate
+from app.lib.metrics import db_query
+import gzip
+import io
 import os
+import time
 
 # Database configuration
 SQLALCHEMY_DATABASE_URL = "sqlite:///database/CI.db"
+POOL_SIZE = 10
+MAX_OVERFLOW = 10
+BUSY_TIMEOUT_MS = 5000
+
+# WAL lets readers browse /builds while a build is being written, and
+# synchronous=NORMAL is safe with WAL while saving an fsync per commit
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA foreign_keys=ON",
+)
+
+def make_engine(url: str = SQLALCHEMY_DATABASE_URL) -> Engine:
+    """Create a pooled engine whose SQLite connections use the pragmas above"""
+    new_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": BUSY_TIMEOUT_MS / 1000},
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_pre_ping=True
+    )
+
+    @event.listens_for(new_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return new_engine
+
 Base = declarative_base()
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = make_engine()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 time_format = "%Y-%m-%d"
 
+def utcnow() -> datetime:
+    """The current UTC time as the naive datetime built_at is stored as"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def build_result(statuses: List[str]) -> str:
+    """Overall result of a build from the statuses of its stages"""
+    for result in ("error", "failure"):
+        if result in statuses:
+            return result
+    return "success"
+
 class BuildLog(Base):
-    """SQLAlchemy model for build_log table"""
+    """
+    SQLAlchemy model for build_log table. A commit of a repository can be
+    built several times; attempt numbers its builds from 1. built_at is the
+    UTC time the build was recorded; build_date is its day, kept for the
+    pages that show it.
+    """
     __tablename__ = "build_log"
+    __table_args__ = (
+        UniqueConstraint("commit_hash", "repository", "attempt"),
+        Index("ix_build_log_branch_built_at", "branch", "built_at"),
+        Index("ix_build_log_repository_branch_built_at", "repository", "branch", "built_at"),
+        Index("ix_build_log_branch_id", "branch", "id"),
+        Index("ix_build_log_result_built_at", "result", "built_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    commit_hash = Column(String, unique=True, nullable=False)
+    commit_hash = Column(String, nullable=False)
+    repository = Column(String, nullable=False, default="")
+    attempt = Column(Integer, nullable=False, default=1)
     branch = Column(String, nullable=False)
     build_date = Column(String, nullable=False)
-    test_syntax_result = Column(String, nullable=False)
-    test_notifier_result = Column(String, nullable=False)
-    test_CI_result = Column(String, nullable=False)
-    test_syntax_log = Column(String, nullable=False)
-    test_notifier_log = Column(String, nullable=False)
-    test_CI_log = Column(String, nullable=False)
+    built_at = Column(DateTime, nullable=False, default=utcnow, index=True)
+    result = Column(String, nullable=False, default="success")
+
+class BuildStageResult(Base):
+    """SQLAlchemy model for build_stage_result table, the outcome of one pipeline stage of a build"""
+    __tablename__ = "build_stage_result"
+
+    build_id = Column(Integer, ForeignKey("build_log.id"), primary_key=True)
+    stage = Column(String, primary_key=True)
+    position = Column(Integer, nullable=False)
+    status = Column(String, nullable=False)
+    description = Column(String, nullable=False, default="")
+    duration = Column(Float)
+
+class BuildLogOutput(Base):
+    """SQLAlchemy model for build_log_output table, the compressed test log of one stage"""
+    __tablename__ = "build_log_output"
+
+    build_id = Column(Integer, ForeignKey("build_log.id"), primary_key=True)
+    stage = Column(String, primary_key=True)
+    compression = Column(String, nullable=False, default="gzip")
+    content = Column(LargeBinary, nullable=False)
+
+class StageResultCache(Base):
+    """SQLAlchemy model for stage_result_cache table, reusable results of earlier stage runs"""
+    __tablename__ = "stage_result_cache"
+
+    cache_key = Column(String, primary_key=True)
+    stage = Column(String, nullable=False)
+    commit_hash = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    description = Column(String, nullable=False)
+    output = Column(LargeBinary, nullable=False)
+    error = Column(String, nullable=False)
+    last_used = Column(Float, nullable=False, index=True)
+
+class TestCase(Base):
+    """SQLAlchemy model for test_case table, one row per distinct test of a repository's stage"""
+    __tablename__ = "test_case"
+    __table_args__ = (UniqueConstraint("repository", "stage", "node_id"),)
+
+    id = Column(Integer, primary_key=True)
+    repository = Column(String, nullable=False, default="")
+    stage = Column(String, nullable=False)
+    node_id = Column(String, nullable=False)
+
+class TestTiming(Base):
+    """SQLAlchemy model for test_timing table, how long a test took in one build, in milliseconds"""
+    __tablename__ = "test_timing"
+
+    build_id = Column(Integer, ForeignKey("build_log.id"), primary_key=True)
+    test_id = Column(Integer, ForeignKey("test_case.id"), primary_key=True)
+    duration_ms = Column(Integer, nullable=False)
+
+# A test's expected duration is the mean of its last few timings
+DURATION_RUNS = 5
+
+def compress_log(log: str) -> bytes:
+    return gzip.compress(log.encode("utf-8"))
+
+def log_bytes(content: bytes, compression: str = "gzip") -> bytes:
+    return gzip.decompress(content) if compression == "gzip" else content
+
+def log_lines(content: bytes, compression: str = "gzip") -> Iterator[str]:
+    """The lines of a stored log, decompressed as they are read"""
+    stream = gzip.GzipFile(fileobj=io.BytesIO(content)) if compression == "gzip" else io.BytesIO(content)
+    with io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline="") as text:
+        for line in text:
+            yield line.rstrip("\n")
+
+def decompress_log(content: bytes, compression: str = "gzip") -> str:
+    return log_bytes(content, compression).decode("utf-8", errors="replace")
 
 def init_db():
-    """Create database and tables if they don't exist"""
+    """Create database and tables if they don't exist, and migrate older schemas"""
     os.makedirs("database", exist_ok=True)
     Base.metadata.create_all(bind=engine)
+    migrate(engine)
 
-def get_db():
-    """Get database session"""
+def get_db() -> Iterator[Session]:
+    """FastAPI dependency giving each request its own session, closed afterwards"""
     db = SessionLocal()
     try:
-        return db
+        yield db
     finally:
         db.close()
 
-def get_entries():
-    """Return a list of all existing build logs"""
-    db = get_db()
-    return [(entry.id, entry.commit_hash, entry.branch, entry.build_date, entry.test_syntax_result, entry.test_notifier_result, entry.test_CI_result, entry.test_syntax_log, entry.test_notifier_log, entry.test_CI_log) 
-            for entry in db.query(BuildLog).all()]
-
-def get_entry_by_commit(commit_hash: str):
-    """Queries database for entry with specified hashsum"""
-    db = get_db()
-    entry = db.query(BuildLog).filter(BuildLog.commit_hash == commit_hash).first()
-    return [(entry.id, entry.commit_hash, entry.branch, entry.build_date, entry.test_syntax_result, entry.test_notifier_result, entry.test_CI_result, entry.test_syntax_log, entry.test_notifier_log, entry.test_CI_log)] if entry else []
-
-def get_entry_by_id(build_id: int):
-    """Queries database for entry with specified id"""
-    db = get_db()
-    entry = db.query(BuildLog).filter(BuildLog.id == build_id).first()
-    return [(entry.id, entry.commit_hash, entry.branch, entry.build_date, entry.test_syntax_result, entry.test_notifier_result, entry.test_CI_result, entry.test_syntax_log, entry.test_notifier_log, entry.test_CI_log)] if entry else []
-
-def get_entries_by_date(build_date: str):
-    """Queries database for all entries made on specified date"""
-    db = get_db()
-    entries = db.query(BuildLog).filter(BuildLog.build_date == build_date).all()
-    return [(entry.id, entry.commit_hash, entry.branch, entry.build_date, entry.test_syntax_result, entry.test_notifier_result, entry.test_CI_result, entry.test_syntax_log, entry.test_notifier_log, entry.test_CI_log) for entry in entries]
-
-def create_new_entry(commit_hash: str, branch: str, test_syntax_result: str, test_notifier_result: str, test_CI_result: str,
-                    test_syntax_log: str, test_notifier_log: str, test_CI_log: str):
-    """Create a new entry with a given commit hashsum and build logs"""
-    db = get_db()
-    build_date = datetime.today().strftime(time_format)
-    
-    # Check if entry already exists
-    if db.query(BuildLog).filter(BuildLog.commit_hash == commit_hash).first():
-        raise IntegrityError("Entry already exists", None, None)
-    
-    new_entry = BuildLog(
-        commit_hash=commit_hash,
-        branch=branch,
-        build_date=build_date,
-        test_syntax_result=test_syntax_result,
-        test_notifier_result=test_notifier_result,
-        test_CI_result=test_CI_result,
-        test_syntax_log=test_syntax_log,
-        test_notifier_log=test_notifier_log,
-        test_CI_log=test_CI_log
-    )
-    db.add(new_entry)
-    db.commit()
-    return new_entry.id
+@contextmanager
+def session_scope(db: Optional[Session] = None) -> Iterator[Session]:
+    """
+    Use the caller's session if one is given, otherwise open a short-lived
+    one that is committed on success, rolled back on error and always closed.
+    """
+    if db is not None:
+        yield db
+        return
+    db = SessionLocal()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+# Called with the id of every build stored, once its transaction is committed
+_build_listeners: List[Callable[[int], None]] = []
+
+def on_build_written(listener: Callable[[int], None]) -> None:
+    """Call listener(build_id) whenever a build is recorded, e.g. to drop cached pages"""
+    _build_listeners.append(listener)
+
+def _day_start(day: date | str) -> datetime:
+    """Midnight UTC at the start of a day, given as a date or as YYYY-MM-DD"""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return datetime.combine(day, time_of_day())
+
+def _stage_statuses(db: Session, build_ids: List[int]) -> Dict[int, Dict[str, str]]:
+    """{build id: {stage: status}} for the given builds, stages in pipeline order"""
+    statuses: Dict[int, Dict[str, str]] = {build_id: {} for build_id in build_ids}
+    if not build_ids:
+        return statuses
+    rows = db.query(BuildStageResult.build_id, BuildStageResult.stage, BuildStageResult.status) \
+        .filter(BuildStageResult.build_id.in_(build_ids)) \
+        .order_by(BuildStageResult.build_id, BuildStageResult.position).all()
+    for build_id, stage, status in rows:
+        statuses[build_id][stage] = status
+    return statuses
+
+def _summaries(db: Session, entries):
+    """(id, commit_hash, branch, build_date, {stage: status}) for each entry"""
+    statuses = _stage_statuses(db, [entry.id for entry in entries])
+    return [(entry.id, entry.commit_hash, entry.branch, entry.build_date, statuses[entry.id]) for entry in entries]
+
+@db_query
+def get_entries(db: Optional[Session] = None):
+    """Return a list of all existing builds, without their logs"""
+    with session_scope(db) as db:
+        return _summaries(db, db.query(BuildLog).all())
+
+@db_query
+def get_build_summaries(limit: int = 50, after: int = None, branch: str = None, build_date: date | str = None,
+                        db: Optional[Session] = None):
+    """
+    Return one page of (id, commit_hash, branch, build_date) tuples, newest first.
+    after is the id of the last build on the previous page (keyset cursor),
+    so a page never scans past the builds it returns. Logs are not loaded.
+    """
+    with session_scope(db) as db:
+        query = db.query(BuildLog.id, BuildLog.commit_hash, BuildLog.branch, BuildLog.build_date)
+        if after is not None:
+            query = query.filter(BuildLog.id < after)
+        if branch:
+            query = query.filter(BuildLog.branch == branch)
+        if build_date:
+            start = _day_start(build_date)
+            query = query.filter(BuildLog.built_at >= start, BuildLog.built_at < start + timedelta(days=1))
+        return [tuple(row) for row in query.order_by(BuildLog.id.desc()).limit(limit).all()]
+
+@db_query
+def get_latest_build_id(db: Optional[Session] = None) -> int:
+    """Return the highest build id, or 0 if there are no builds yet"""
+    with session_scope(db) as db:
+        return db.query(func.max(BuildLog.id)).scalar() or 0
+
+@db_query
+def get_entry_by_commit(commit_hash: str, repository: str = None, db: Optional[Session] = None):
+    """Queries database for the latest build of specified hashsum (in repository, if given), without its logs"""
+    with session_scope(db) as db:
+        query = db.query(BuildLog).filter(BuildLog.commit_hash == commit_hash)
+        if repository is not None:
+            query = query.filter(BuildLog.repository == repository)
+        entry = query.order_by(BuildLog.id.desc()).first()
+        return _summaries(db, [entry]) if entry else []
+
+@db_query
+def get_attempts(commit_hash: str, repository: str = "", db: Optional[Session] = None):
+    """Return (id, attempt, result, built_at) of every build of a repository's commit, first attempt first"""
+    with session_scope(db) as db:
+        rows = db.query(BuildLog.id, BuildLog.attempt, BuildLog.result, BuildLog.built_at) \
+            .filter(BuildLog.commit_hash == commit_hash, BuildLog.repository == repository) \
+            .order_by(BuildLog.attempt).all()
+        return [tuple(row) for row in rows]
+
+@db_query
+def build_exists(build_id: int, db: Optional[Session] = None) -> bool:
+    """Check whether a build with the specified id has been recorded"""
+    with session_scope(db) as db:
+        return db.query(BuildLog.id).filter(BuildLog.id == build_id).first() is not None
+
+@db_query
+def get_build_logs(build_id: int, db: Optional[Session] = None):
+    """Return the decompressed test logs of a build, keyed by stage"""
+    with session_scope(db) as db:
+        outputs = db.query(BuildLogOutput).filter(BuildLogOutput.build_id == build_id).all()
+    return {output.stage: decompress_log(output.content, output.compression) for output in outputs}
+
+@db_query
+def get_stage_log(build_id: int, stage: str, db: Optional[Session] = None):
+    """Return (compression, content) of one stage's stored log as it is kept, or None"""
+    with session_scope(db) as db:
+        row = db.query(BuildLogOutput.compression, BuildLogOutput.content) \
+            .filter(BuildLogOutput.build_id == build_id, BuildLogOutput.stage == stage).first()
+        return tuple(row) if row else None
+
+@db_query
+def get_stage_results(build_id: int, db: Optional[Session] = None):
+    """Return the stage results of a build in pipeline order, without their logs"""
+    with session_scope(db) as db:
+        rows = db.query(BuildStageResult).filter(BuildStageResult.build_id == build_id) \
+            .order_by(BuildStageResult.position).all()
+        return [{"stage": row.stage, "status": row.status, "description": row.description} for row in rows]
+
+@db_query
+def get_entry_by_id(build_id: int, db: Optional[Session] = None):
+    """
+    Queries database for entry with specified id, including its logs.
+    Returns [(id, commit_hash, branch, build_date, stages, attempt)] where stages
+    is a list of {"stage", "status", "description", "log"} dicts in pipeline order.
+    """
+    with session_scope(db) as db:
+        entry = db.query(BuildLog).filter(BuildLog.id == build_id).first()
+        if not entry:
+            return []
+        logs = get_build_logs(build_id, db)
+        stages = [dict(result, log=logs.get(result["stage"], "")) for result in get_stage_results(build_id, db)]
+        return [(entry.id, entry.commit_hash, entry.branch, entry.build_date, stages, entry.attempt)]
+
+@db_query
+def get_entries_by_date(build_date: date | str, db: Optional[Session] = None):
+    """Queries database for all entries made on specified date (UTC), without their logs"""
+    start = _day_start(build_date)
+    return get_builds_between(start, start + timedelta(days=1), db=db)
+
+@db_query
+def get_builds_between(start: datetime, end: datetime, branch: str = None, result: str = None,
+                       limit: int = None, repository: str = None, db: Optional[Session] = None):
+    """
+    Builds recorded from start (inclusive) to end (exclusive), UTC, newest
+    first, optionally of one repository, of one branch or with one overall
+    result. Served by the built_at, (branch, built_at), (repository, branch,
+    built_at) and (result, built_at) indexes.
+    """
+    with session_scope(db) as db:
+        query = db.query(BuildLog).filter(BuildLog.built_at >= start, BuildLog.built_at < end)
+        if repository is not None:
+            query = query.filter(BuildLog.repository == repository)
+        if branch:
+            query = query.filter(BuildLog.branch == branch)
+        if result:
+            query = query.filter(BuildLog.result == result)
+        query = query.order_by(BuildLog.built_at.desc(), BuildLog.id.desc())
+        if limit is not None:
+            query = query.limit(limit)
+        return _summaries(db, query.all())
+
+@db_query
+def get_branch_builds(branch: str, limit: int = 50, before: datetime = None, repository: str = None,
+                      db: Optional[Session] = None):
+    """
+    A branch's builds (in repository, if given), newest first; before (UTC)
+    pages back through its history
+    """
+    with session_scope(db) as db:
+        query = db.query(BuildLog).filter(BuildLog.branch == branch)
+        if repository is not None:
+            query = query.filter(BuildLog.repository == repository)
+        if before is not None:
+            query = query.filter(BuildLog.built_at < before)
+        return _summaries(db, query.order_by(BuildLog.built_at.desc(), BuildLog.id.desc()).limit(limit).all())
+
+@db_query
+def get_latest_build(branch: str, result: str = None, repository: str = None, db: Optional[Session] = None):
+    """The newest build of a branch (in repository, if given), optionally the newest with a given result, or None"""
+    with session_scope(db) as db:
+        query = db.query(BuildLog).filter(BuildLog.branch == branch)
+        if repository is not None:
+            query = query.filter(BuildLog.repository == repository)
+        if result:
+            query = query.filter(BuildLog.result == result)
+        entry = query.order_by(BuildLog.built_at.desc(), BuildLog.id.desc()).first()
+        return _summaries(db, [entry])[0] if entry else None
+
+def _test_case_ids(db: Session, repository: str, stage: str, node_ids: List[str]) -> Dict[str, int]:
+    """Ids of the test_case rows of a repository's stage's tests, adding the missing ones"""
+    ids: Dict[str, int] = {}
+    for i in range(0, len(node_ids), 500):
+        rows = db.query(TestCase.node_id, TestCase.id) \
+            .filter(TestCase.repository == repository, TestCase.stage == stage,
+                    TestCase.node_id.in_(node_ids[i:i + 500])).all()
+        ids.update({node_id: test_id for node_id, test_id in rows})
+    for node_id in node_ids:
+        if node_id not in ids:
+            case = TestCase(repository=repository, stage=stage, node_id=node_id)
+            db.add(case)
+            db.flush()
+            ids[node_id] = case.id
+    return ids
+
+@db_query
+def create_new_entry(commit_hash: str, branch: str, stages: List[Dict[str, Any]], repository: str = ""):
+    """
+    Record a build of a commit hashsum with the results of its pipeline
+    stages and return its id. Each stage is a dict with "stage", "status",
+    "log" and optionally "description", "duration" (seconds) and "tests"
+    ({node id: seconds}), in pipeline order. A stage may give its log
+    already gzip-compressed as "compressed_log" instead. Builds and test timings are
+    kept per repository; building a commit again records its next attempt.
+    """
+    built_at = utcnow()
+    # Compress before opening the transaction to keep the write lock short
+    compressed = [stage.get("compressed_log") or compress_log(stage.get("log", "")) for stage in stages]
+    # One statement numbers and inserts the attempt, so there is no read before the write
+    next_attempt = select(
+        literal(commit_hash), literal(repository), literal(branch), literal(built_at.strftime(time_format)),
+        literal(built_at, DateTime), literal(build_result([stage["status"] for stage in stages])),
+        func.coalesce(func.max(BuildLog.attempt), 0) + 1
+    ).where(BuildLog.commit_hash == commit_hash, BuildLog.repository == repository)
+    statement = insert(BuildLog).from_select(
+        ["commit_hash", "repository", "branch", "build_date", "built_at", "result", "attempt"], next_attempt
+    ).returning(BuildLog.id)
+
+    with session_scope() as db:
+        build_id = db.execute(statement).scalar_one()
+        for position, (stage, content) in enumerate(zip(stages, compressed)):
+            db.add(BuildStageResult(build_id=build_id, stage=stage["stage"], position=position,
+                                    status=stage["status"], description=stage.get("description", "")[:500],
+                                    duration=stage.get("duration")))
+            db.add(BuildLogOutput(build_id=build_id, stage=stage["stage"], compression="gzip", content=content))
+            tests = stage.get("tests") or {}
+            test_ids = _test_case_ids(db, repository, stage["stage"], list(tests))
+            db.add_all([TestTiming(build_id=build_id, test_id=test_ids[node_id], duration_ms=round(seconds * 1000))
+                        for node_id, seconds in tests.items()])
+    for listener in _build_listeners:
+        listener(build_id)
+    return build_id
+
+@db_query
+def get_stage_durations(since: str = None, branch: str = None, db: Optional[Session] = None):
+    """Return (build_date, stage, seconds) for every timed stage run on or after since (YYYY-MM-DD)"""
+    with session_scope(db) as db:
+        query = db.query(BuildLog.build_date, BuildStageResult.stage, BuildStageResult.duration) \
+            .join(BuildStageResult, BuildStageResult.build_id == BuildLog.id) \
+            .filter(BuildStageResult.duration.isnot(None))
+        if since:
+            query = query.filter(BuildLog.built_at >= _day_start(since))
+        if branch:
+            query = query.filter(BuildLog.branch == branch)
+        return [tuple(row) for row in query.order_by(BuildLog.built_at).all()]
+
+@db_query
+def get_test_timings(since: str = None, branch: str = None, db: Optional[Session] = None):
+    """Return (branch, repository, stage, node_id, milliseconds) for every test run on or after since (YYYY-MM-DD)"""
+    with session_scope(db) as db:
+        query = db.query(BuildLog.branch, TestCase.repository, TestCase.stage, TestCase.node_id,
+                         TestTiming.duration_ms) \
+            .join(TestTiming, TestTiming.build_id == BuildLog.id) \
+            .join(TestCase, TestCase.id == TestTiming.test_id)
+        if since:
+            query = query.filter(BuildLog.built_at >= _day_start(since))
+        if branch:
+            query = query.filter(BuildLog.branch == branch)
+        return [tuple(row) for row in query.all()]
+
+@db_query
+def get_test_durations(repository: str, node_ids: List[str], db: Optional[Session] = None) -> Dict[str, float]:
+    """Return the mean of the last DURATION_RUNS timings of the given tests of a repository, in seconds"""
+    with session_scope(db) as db:
+        durations: Dict[str, float] = {}
+        # Stay below SQLite's limit on bound parameters
+        for i in range(0, len(node_ids), 500):
+            recent = db.query(
+                TestCase.node_id, TestTiming.duration_ms,
+                func.row_number().over(partition_by=TestTiming.test_id,
+                                       order_by=TestTiming.build_id.desc()).label("run")
+            ).join(TestTiming, TestTiming.test_id == TestCase.id) \
+                .filter(TestCase.repository == repository, TestCase.node_id.in_(node_ids[i:i + 500])).subquery()
+            rows = db.query(recent.c.node_id, func.avg(recent.c.duration_ms)) \
+                .filter(recent.c.run <= DURATION_RUNS).group_by(recent.c.node_id).all()
+            durations.update({node_id: duration_ms / 1000 for node_id, duration_ms in rows})
+        return durations
+
+@db_query
+def get_cached_stage_result(cache_key: str):
+    """
+    Return a cached stage result as a dict and mark it as recently used, or
+    None. Its log is left gzip-compressed under "compressed_log".
+    """
+    with session_scope() as db:
+        entry = db.query(StageResultCache).filter(StageResultCache.cache_key == cache_key).first()
+        if not entry:
+            return None
+        entry.last_used = time.time()
+        return {
+            "stage": entry.stage,
+            "commit_hash": entry.commit_hash,
+            "status": entry.status,
+            "description": entry.description,
+            "error": entry.error,
+            "compressed_log": entry.output
+        }
+
+@db_query
+def store_cached_stage_result(cache_key: str, stage: str, commit_hash: str, status: str, description: str,
+                              compressed: bytes, error: str, max_entries: int):
+    """Cache a stage result with its gzip-compressed log, evicting the least recently used entries beyond max_entries"""
+    with session_scope() as db:
+        db.merge(StageResultCache(
+            cache_key=cache_key,
+            stage=stage,
+            commit_hash=commit_hash,
+            status=status,
+            description=description,
+            output=compressed,
+            error=error,
+            last_used=time.time()
+        ))
+        db.flush()
+        keep = db.query(StageResultCache.cache_key).order_by(StageResultCache.last_used.desc()).limit(max_entries)
+        db.query(StageResultCache).filter(StageResultCache.cache_key.not_in(keep.scalar_subquery())) \
+            .delete(synchronize_session=False)
+
+@db_query
+def clear_stage_result_cache() -> int:
+    """Drop every cached stage result and return how many there were"""
+    with session_scope() as db:
+        return db.query(StageResultCache).delete()
 
 # Initialize database on module import
 init_db()
@@ -0,0 +1,125 @@
+"""
+Minimal local stand-in for the GitHub REST API commit status endpoints.
+Used to exercise the status client offline: point it (or GITHUB_API_URL)
+at FakeGitHub().url. Run "python -m app.lib.fake_github" to start one by hand.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+REPO_PATH = re.compile(r"^/repos/([^/]+)/([^/]+)$")
+COMMIT_PATH = re.compile(r"^/repos/([^/]+)/([^/]+)/commits/([^/]+)$")
+STATUS_PATH = re.compile(r"^/repos/([^/]+)/([^/]+)/statuses/([^/]+)$")
+
+
+class FakeGitHub:
+    """Threaded HTTP server that records every commit status it receives"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.latency = latency
+        self.statuses: List[Dict[str, Any]] = []
+        self.requests: List[str] = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    def start(self) -> "FakeGitHub":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "FakeGitHub":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def count(self, method: str, prefix: str = "") -> int:
+        """Number of requests made with method to paths starting with prefix"""
+        with self.lock:
+            return sum(1 for r in self.requests if r.startswith(f"{method} {prefix}"))
+
+    def latest(self, sha: str) -> Dict[str, Dict[str, Any]]:
+        """Latest status per context for a commit"""
+        with self.lock:
+            return {s["context"]: s for s in self.statuses if s["sha"] == sha}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code: int, body: Dict[str, Any]) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _record(self) -> None:
+                with fake.lock:
+                    fake.requests.append(f"{self.command} {self.path}")
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+            def do_GET(self):
+                self._record()
+                match = REPO_PATH.match(self.path)
+                if match:
+                    owner, name = match.groups()
+                    return self._reply(200, {
+                        "name": name,
+                        "full_name": f"{owner}/{name}",
+                        "owner": {"login": owner},
+                        "url": f"{fake.url}/repos/{owner}/{name}"
+                    })
+                match = COMMIT_PATH.match(self.path)
+                if match:
+                    owner, name, sha = match.groups()
+                    return self._reply(200, {
+                        "sha": sha,
+                        "url": f"{fake.url}/repos/{owner}/{name}/commits/{sha}"
+                    })
+                self._reply(404, {"message": "Not Found"})
+
+            def do_POST(self):
+                self._record()
+                match = STATUS_PATH.match(self.path)
+                if not match:
+                    return self._reply(404, {"message": "Not Found"})
+                owner, name, sha = match.groups()
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with fake.lock:
+                    status = {
+                        "id": len(fake.statuses) + 1,
+                        "repository": f"{owner}/{name}",
+                        "sha": sha,
+                        "state": body.get("state"),
+                        "description": body.get("description"),
+                        "context": body.get("context", "default"),
+                        "target_url": body.get("target_url"),
+                        "url": f"{fake.url}/repos/{owner}/{name}/statuses/{sha}"
+                    }
+                    fake.statuses.append(status)
+                self._reply(201, status)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    server = FakeGitHub(port=8023)
+    print(f"Fake GitHub API listening on {server.url}")
+    server.server.serve_forever()
@@ -0,0 +1,159 @@
+"""
+Bounded, per-build sinks for test output while a build is running.
+Each stage writes its output line by line into a LogSink, which keeps the
+first HEAD_BYTES and a rolling window of the last TAIL_BYTES of output, so
+memory stays constant however much a test prints. Readers follow a sink
+with a cursor to stream the output live. The complete output, which is
+stored with the build, goes to an OutputSpool that moves to a temporary
+file once it grows large and is compressed from there.
+"""
+import gzip
+import io
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+HEAD_BYTES = 64 * 1024
+TAIL_BYTES = 256 * 1024
+MAX_LINE_CHARS = 8 * 1024
+KEEP_BUILDS = 10
+SPOOL_MEMORY_BYTES = 1024 * 1024
+SPOOL_CHUNK_CHARS = 64 * 1024
+
+
+class LogSink:
+    """Output of one stage of one build"""
+
+    def __init__(self, head_bytes: int = HEAD_BYTES, tail_bytes: int = TAIL_BYTES):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self._lock = threading.Lock()
+        self._head: List[str] = []
+        self._head_size = 0
+        # (sequence number, line, size in bytes)
+        self._tail: "deque[Tuple[int, str, int]]" = deque()
+        self._tail_size = 0
+        self._next_seq = 0
+        self.total_lines = 0
+        self.total_bytes = 0
+        self.closed = False
+
+    def write(self, line: str) -> None:
+        """Add one line of output (without its trailing newline)"""
+        line = line.rstrip("\n")
+        if len(line) > MAX_LINE_CHARS:
+            line = line[:MAX_LINE_CHARS] + " [line truncated]"
+        size = len(line.encode("utf-8", errors="replace")) + 1
+        with self._lock:
+            self.total_lines += 1
+            self.total_bytes += size
+            if self._head_size + size <= self.head_bytes and self._next_seq == len(self._head):
+                self._head.append(line)
+                self._head_size += size
+            else:
+                self._tail.append((self._next_seq, line, size))
+                self._tail_size += size
+                while self._tail_size > self.tail_bytes and len(self._tail) > 1:
+                    self._tail_size -= self._tail.popleft()[2]
+            self._next_seq += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self.closed = True
+
+    def read(self, cursor: int = 0) -> Tuple[List[str], int, int]:
+        """
+        Return (lines, next_cursor, skipped) for the lines from cursor on.
+        skipped counts lines that were already dropped from the window.
+        """
+        with self._lock:
+            lines = []
+            if cursor < len(self._head):
+                lines = self._head[cursor:]
+                cursor = len(self._head)
+            first_tail = self._tail[0][0] if self._tail else self._next_seq
+            skipped = max(0, first_tail - cursor)
+            lines += [line for seq, line, _ in self._tail if seq >= cursor]
+            return lines, self._next_seq, skipped
+
+    def text(self) -> str:
+        """The retained output, with a marker where lines were dropped"""
+        with self._lock:
+            parts = list(self._head)
+            first_tail = self._tail[0][0] if self._tail else self._next_seq
+            omitted = first_tail - len(self._head)
+            if omitted > 0:
+                parts.append(f"[... {omitted} lines omitted ...]")
+            parts += [line for _, line, _ in self._tail]
+        return "\n".join(parts)
+
+
+class OutputSpool:
+    """
+    The complete output of a stage, kept to be stored with the build. Nothing
+    is dropped or cut; past max_memory bytes it is kept in a temporary file.
+    """
+
+    def __init__(self, max_memory: int = SPOOL_MEMORY_BYTES):
+        self._lock = threading.Lock()
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory, mode="w+", encoding="utf-8",
+                                                   errors="replace", newline="")
+        self.total_lines = 0
+
+    def write(self, line: str) -> None:
+        """Add one line of output (without its trailing newline)"""
+        with self._lock:
+            self._file.write(line.rstrip("\n") + "\n")
+            self.total_lines += 1
+
+    def text(self) -> str:
+        """All output written so far"""
+        with self._lock:
+            self._file.seek(0)
+            content = self._file.read()
+            self._file.seek(0, 2)
+        return content[:-1] if content.endswith("\n") else content
+
+    def compressed(self, trailer: str = "") -> bytes:
+        """
+        gzip of the output followed by a newline and trailer, compressed a
+        chunk at a time so the output is never held in memory as a whole
+        """
+        buffer = io.BytesIO()
+        with self._lock, gzip.GzipFile(fileobj=buffer, mode="wb") as archive:
+            self._file.seek(0)
+            # Every line ends in a newline, so only empty output needs one before the trailer
+            if self.total_lines == 0:
+                archive.write(b"\n")
+            for chunk in iter(lambda: self._file.read(SPOOL_CHUNK_CHARS), ""):
+                archive.write(chunk.encode("utf-8", errors="replace"))
+            archive.write(trailer.encode("utf-8", errors="replace"))
+            self._file.seek(0, 2)
+        return buffer.getvalue()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+_lock = threading.Lock()
+_builds: "OrderedDict[str, Dict[str, LogSink]]" = OrderedDict()
+
+
+def open_sink(build_key: str, stage: str) -> LogSink:
+    """Create the sink for a stage of a running build"""
+    sink = LogSink()
+    with _lock:
+        _builds.setdefault(build_key, {})[stage] = sink
+        _builds.move_to_end(build_key)
+        # Forget the oldest builds whose output is complete
+        for key in list(_builds)[:-KEEP_BUILDS]:
+            if all(s.closed for s in _builds[key].values()):
+                del _builds[key]
+    return sink
+
+
+def get_sink(build_key: str, stage: str) -> Optional[LogSink]:
+    with _lock:
+        return _builds.get(build_key, {}).get(stage)
@@ -0,0 +1,162 @@
+"""
+Structured logging for the CI server.
+Every module logs through logging.getLogger(__name__) under the "app"
+logger. Records are put on a queue by the thread that logs them and written
+as one JSON object per line by a background listener thread, so a slow disk
+or pipe never blocks a request or a build. The build and stage a record
+belongs to come from log_context(), which run_build and each stage enter.
+
+Test output is not logged; it goes to the build's log sink and database.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Iterator, Optional
+
+ROOT_LOGGER = "app"
+DEFAULT_LEVEL = "INFO"
+QUEUE_SIZE = 10000
+# Attributes every LogRecord has; anything else was passed with extra=
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName", "ci_context"}
+
+_context: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar("ci_log_context", default={})
+_listener: Optional[QueueListener] = None
+_lock = threading.Lock()
+
+
+@contextmanager
+def log_context(**fields) -> Iterator[None]:
+    """Add fields (like build and stage) to every record logged in this block"""
+    token = _context.set({**_context.get(), **{key: str(value) for key, value in fields.items()}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def current_context() -> Dict[str, str]:
+    return dict(_context.get())
+
+
+class ContextFilter(logging.Filter):
+    """Copy the logging thread's context onto the record before it is queued"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.ci_context = _context.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, context and extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "ci_context", {}))
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _ContextQueueHandler(QueueHandler):
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # Drop records rather than wait when the writer falls behind
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Format the exception here, the traceback cannot be sent to the listener
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """
+    Levels from CI_LOG_LEVEL: a default level, optionally followed by
+    logger=level overrides, e.g. "INFO,app.lib.sharding=DEBUG"
+    """
+    levels = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, level = part.rpartition("=")
+        value = logging.getLevelName(level.strip().upper())
+        if not isinstance(value, int):
+            raise ValueError(f"Unknown log level: {level}")
+        levels[name.strip() or ROOT_LOGGER] = value
+    return levels
+
+
+def configure_logging(level: Optional[str] = None, stream=None) -> None:
+    """
+    Send the "app" loggers through a queue to a JSON writer thread.
+    level defaults to CI_LOG_LEVEL, the output to CI_LOG_FILE or stderr.
+    Calling it again replaces the previous configuration.
+    """
+    global _listener
+    with _lock:
+        _stop_listener()
+        if stream is None:
+            path = os.getenv("CI_LOG_FILE")
+            target = logging.FileHandler(path) if path else logging.StreamHandler(sys.stderr)
+        else:
+            target = logging.StreamHandler(stream)
+        target.setFormatter(JsonFormatter())
+
+        records: "queue.Queue[logging.LogRecord]" = queue.Queue(QUEUE_SIZE)
+        handler = _ContextQueueHandler(records)
+        handler.addFilter(ContextFilter())
+        root = logging.getLogger(ROOT_LOGGER)
+        for old in list(root.handlers):
+            root.removeHandler(old)
+        root.addHandler(handler)
+        root.propagate = False
+        for name, value in parse_levels(level or os.getenv("CI_LOG_LEVEL", DEFAULT_LEVEL)).items():
+            logging.getLogger(name).setLevel(value)
+
+        _listener = QueueListener(records, target, respect_handler_level=True)
+        _listener.start()
+
+
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def shutdown_logging() -> None:
+    """Write out the queued records and stop the writer thread"""
+    with _lock:
+        _stop_listener()
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,82 @@
+"""
+Views of stored test logs for the build pages.
+The detail page only shows the first and last lines of each stage's log,
+with the lines in between folded away, so a noisy stage does not make the
+page slow to render and load. The full log is served on its own from the
+raw log endpoint, which answers HTTP Range requests for a part of it.
+"""
+import re
+from typing import Optional, Tuple
+
+HEAD_LINES = 50
+TAIL_LINES = 150
+# Longer lines are cut in excerpts, the raw log keeps them whole
+MAX_LINE_CHARS = 2000
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class LogExcerpt:
+    """The head and tail of a log and how much of it lies between them"""
+
+    def __init__(self, head: str, tail: str, omitted_lines: int, omitted_bytes: int, total_lines: int):
+        self.head = head
+        self.tail = tail
+        self.omitted_lines = omitted_lines
+        self.omitted_bytes = omitted_bytes
+        self.total_lines = total_lines
+
+    @property
+    def folded(self) -> bool:
+        return self.omitted_lines > 0
+
+
+def _clip(line: str) -> str:
+    if len(line) <= MAX_LINE_CHARS:
+        return line
+    return f"{line[:MAX_LINE_CHARS]} [... {len(line) - MAX_LINE_CHARS} more characters]"
+
+
+def excerpt(log: str, head_lines: int = HEAD_LINES, tail_lines: int = TAIL_LINES) -> LogExcerpt:
+    """The first head_lines and last tail_lines of log; all of it if it is that short"""
+    lines = log.splitlines()
+    if len(lines) <= head_lines + tail_lines:
+        return LogExcerpt("\n".join(_clip(line) for line in lines), "", 0, 0, len(lines))
+    middle = lines[head_lines:len(lines) - tail_lines]
+    return LogExcerpt(
+        head="\n".join(_clip(line) for line in lines[:head_lines]),
+        tail="\n".join(_clip(line) for line in lines[len(lines) - tail_lines:]),
+        omitted_lines=len(middle),
+        omitted_bytes=sum(len(line.encode("utf-8")) + 1 for line in middle),
+        total_lines=len(lines)
+    )
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested byte range lies outside the log"""
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    (first, last) byte, inclusive, of a single range "Range: bytes=..." header
+    for a body of size bytes. None means the whole body: no header, one that
+    cannot be parsed, or several ranges, which servers may ignore.
+    """
+    if not header:
+        return None
+    match = _RANGE.fullmatch(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # The last n bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    return start, min(int(last), size - 1) if last else size - 1
@@ -0,0 +1,321 @@
+"""
+Prometheus metrics for the CI server, served as text on /metrics.
+Counters, gauges and histograms are kept in process with one lock each, so
+recording a value costs a dictionary lookup and a few additions. The
+decorators at the end time the calls they wrap: clones, GitHub status
+requests and database queries.
+"""
+import contextvars
+import functools
+import logging
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds; database queries take milliseconds, clones and stages minutes
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+logger = logging.getLogger(__name__)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Registry:
+    """The metrics rendered together on one page"""
+
+    def __init__(self):
+        self._metrics: List["Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "Metric") -> None:
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        return "".join(metric.render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    """Base of the metric types: a family of children, one per label combination"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[LabelValues, Any] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """The child for these label values, created on first use"""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        """(suffix, label text, value) of every sample"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self._samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only go up")
+        with self._lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    """A count that only goes up, like webhook deliveries or errors"""
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        return [("_total", _label_text(self.labelnames, key), child.value) for key, child in children]
+
+
+class _GaugeChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    @property
+    def value(self) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Read the value from function whenever the metrics are collected"""
+        self._function = function
+
+
+class Gauge(Metric):
+    """A value that goes up and down, like the queue depth"""
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self.labels().dec(amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.labels().set_function(function)
+
+    def _samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for key, child in children:
+            try:
+                samples.append(("", _label_text(self.labelnames, key), child.value))
+            except Exception as e:
+                logger.warning("Could not collect %s: %s", self.name, e)
+        return samples
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        # counts[i] is the number of observations in (buckets[i-1], buckets[i]], the last one above all buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> "_Timer":
+        """Context manager observing how long its block takes"""
+        return _Timer(self)
+
+
+class _Timer:
+    def __init__(self, child: _HistogramChild):
+        self._child = child
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(perf_counter() - self._start)
+
+
+class Histogram(Metric):
+    """Observations like durations, counted into cumulative buckets"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional[Registry] = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def _samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        names = self.labelnames + ("le",)
+        for key, child in children:
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", _label_text(names, key + (_format_value(bound),)), cumulative))
+            labels = _label_text(self.labelnames, key)
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return samples
+
+
+WEBHOOKS = Counter("ci_webhooks", "Push deliveries received on /webhook", ["outcome"])
+QUEUE_DEPTH = Gauge("ci_build_queue_depth", "Builds waiting for a worker")
+ACTIVE_BUILDS = Gauge("ci_active_builds", "Builds running right now")
+CLONE_SECONDS = Histogram("ci_clone_duration_seconds", "Time to check out a pushed commit")
+CLONE_ERRORS = Counter("ci_clone_errors", "Checkouts that failed")
+SUPERSEDED_BUILDS = Counter("ci_superseded_builds", "Builds cancelled by a newer push to their branch")
+STAGE_SECONDS = Histogram("ci_stage_duration_seconds", "Time a pipeline stage ran for", ["stage", "status"])
+GITHUB_SECONDS = Histogram("ci_github_request_duration_seconds", "GitHub status API latency", ["operation"])
+GITHUB_ERRORS = Counter("ci_github_errors", "GitHub status API calls that failed", ["operation"])
+DB_QUERY_SECONDS = Histogram("ci_db_query_duration_seconds", "Build database call latency", ["query"])
+DB_ERRORS = Counter("ci_db_errors", "Build database calls that raised", ["query"])
+
+# Set while a database_api call is timed, so the calls it makes itself are not counted again
+_in_db_query = contextvars.ContextVar("in_db_query", default=False)
+
+
+def timed(histogram: Histogram, *label_values: str, errors: Optional[Counter] = None,
+          failed: Optional[Callable[[Any], bool]] = None):
+    """
+    Decorator observing how long each call takes in histogram. Calls that
+    raise, or whose result failed() accepts, also count in errors.
+    """
+    child = histogram.labels(*label_values)
+    error_child = errors.labels(*label_values) if errors is not None else None
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                if error_child is not None:
+                    error_child.inc()
+                raise
+            finally:
+                child.observe(perf_counter() - start)
+            if error_child is not None and failed is not None and failed(result):
+                error_child.inc()
+            return result
+        return wrapper
+    return decorator
+
+
+def db_query(fn):
+    """Time a database_api call under its function name, unless another one made it"""
+    timed_fn = timed(DB_QUERY_SECONDS, fn.__name__, errors=DB_ERRORS)(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _in_db_query.get():
+            return fn(*args, **kwargs)
+        token = _in_db_query.set(True)
+        try:
+            return timed_fn(*args, **kwargs)
+        finally:
+            _in_db_query.reset(token)
+    return wrapper
+
+
+def github_call(operation: str):
+    """Time a GitHub API call; they return a dict with an "error" key instead of raising"""
+    return timed(GITHUB_SECONDS, operation, errors=GITHUB_ERRORS,
+                 failed=lambda result: isinstance(result, dict) and "error" in result)
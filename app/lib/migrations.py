@@ -0,0 +1,287 @@
+"""
+Schema migrations for the build history database.
+Every step checks whether it still has work to do, so running them again is
+harmless. init_db() runs them on startup; to migrate a database by hand run
+"python -m app.lib.migrations [path/to/CI.db]".
+"""
+import gzip
+import sys
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Connection, Engine
+
+STAGE_LOG_COLUMNS = {
+    "test_syntax": "test_syntax_log",
+    "test_notifier": "test_notifier_log",
+    "test_CI": "test_CI_log",
+}
+BATCH_SIZE = 200
+
+
+def _columns(conn: Connection, table: str) -> set:
+    return {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+
+
+def move_logs_to_log_table(conn: Connection) -> bool:
+    """Move the three test log columns of build_log into gzip blobs in build_log_output"""
+    columns = _columns(conn, "build_log")
+    if not set(STAGE_LOG_COLUMNS.values()) & columns:
+        return False
+
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS build_log_output (
+            build_id INTEGER NOT NULL REFERENCES build_log (id),
+            stage VARCHAR NOT NULL,
+            compression VARCHAR NOT NULL,
+            content BLOB NOT NULL,
+            PRIMARY KEY (build_id, stage)
+        )
+    """))
+    select = ", ".join(["id"] + list(STAGE_LOG_COLUMNS.values()))
+    last_id = 0
+    while True:
+        rows = conn.execute(text(f"SELECT {select} FROM build_log WHERE id > :last ORDER BY id LIMIT :n"),
+                            {"last": last_id, "n": BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            for i, stage in enumerate(STAGE_LOG_COLUMNS):
+                conn.execute(text("""
+                    INSERT OR REPLACE INTO build_log_output (build_id, stage, compression, content)
+                    VALUES (:build_id, :stage, 'gzip', :content)
+                """), {"build_id": row[0], "stage": stage,
+                       "content": gzip.compress((row[i + 1] or "").encode("utf-8"))})
+        last_id = rows[-1][0]
+
+    for column in STAGE_LOG_COLUMNS.values():
+        conn.execute(text(f"ALTER TABLE build_log DROP COLUMN {column}"))
+    return True
+
+
+def move_results_to_stage_table(conn: Connection) -> bool:
+    """Move the three per-stage result columns of build_log into rows of build_stage_result"""
+    columns = _columns(conn, "build_log")
+    result_columns = {stage: f"{stage}_result" for stage in STAGE_LOG_COLUMNS}
+    if not set(result_columns.values()) & columns:
+        return False
+
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS build_stage_result (
+            build_id INTEGER NOT NULL REFERENCES build_log (id),
+            stage VARCHAR NOT NULL,
+            position INTEGER NOT NULL,
+            status VARCHAR NOT NULL,
+            description VARCHAR NOT NULL,
+            PRIMARY KEY (build_id, stage)
+        )
+    """))
+    for position, (stage, column) in enumerate(result_columns.items()):
+        conn.execute(text(f"""
+            INSERT OR IGNORE INTO build_stage_result (build_id, stage, position, status, description)
+            SELECT id, :stage, :position, {column}, '' FROM build_log
+        """), {"stage": stage, "position": position})
+
+    for column in result_columns.values():
+        conn.execute(text(f"ALTER TABLE build_log DROP COLUMN {column}"))
+    return True
+
+
+def add_stage_duration_column(conn: Connection) -> bool:
+    """Give build_stage_result the duration column stage timings are kept in"""
+    columns = _columns(conn, "build_stage_result")
+    if not columns or "duration" in columns:
+        return False
+    conn.execute(text("ALTER TABLE build_stage_result ADD COLUMN duration FLOAT"))
+    return True
+
+
+def add_build_timestamp_columns(conn: Connection) -> bool:
+    """
+    Give build_log the built_at timestamp and overall result columns. Old
+    builds only know their day, so they get midnight UTC of build_date.
+    """
+    columns = _columns(conn, "build_log")
+    if "built_at" in columns:
+        return False
+    conn.execute(text("ALTER TABLE build_log ADD COLUMN built_at DATETIME"))
+    conn.execute(text("ALTER TABLE build_log ADD COLUMN result VARCHAR NOT NULL DEFAULT 'success'"))
+    # The format SQLAlchemy stores DateTime values in, so they compare as text
+    conn.execute(text("UPDATE build_log SET built_at = build_date || ' 00:00:00.000000'"))
+    conn.execute(text("""
+        UPDATE build_log SET result = CASE
+            WHEN EXISTS (SELECT 1 FROM build_stage_result
+                         WHERE build_id = build_log.id AND status = 'error') THEN 'error'
+            WHEN EXISTS (SELECT 1 FROM build_stage_result
+                         WHERE build_id = build_log.id AND status = 'failure') THEN 'failure'
+            ELSE 'success' END
+    """))
+    return True
+
+
+BUILD_LOG_INDEXES = {
+    "ix_build_log_built_at": "built_at",
+    "ix_build_log_branch_built_at": "branch, built_at",
+    # A fork's branch is not the upstream branch of the same name
+    "ix_build_log_repository_branch_built_at": "repository, branch, built_at",
+    # The build list pages a branch by id, newest first
+    "ix_build_log_branch_id": "branch, id",
+    "ix_build_log_result_built_at": "result, built_at",
+}
+
+
+def add_build_history_indexes(conn: Connection) -> bool:
+    """Index build_log for date range, per-branch (of any or of one repository) and per-result queries and the branch build list"""
+    existing = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+    # An index on a column added by a later migration is created by that migration
+    columns = _columns(conn, "build_log")
+    missing = {name: indexed for name, indexed in BUILD_LOG_INDEXES.items()
+               if name not in existing and columns.issuperset(indexed.split(", "))}
+    for name, indexed in missing.items():
+        conn.execute(text(f"CREATE INDEX {name} ON build_log ({indexed})"))
+    if missing:
+        conn.execute(text("ANALYZE build_log"))
+    return bool(missing)
+
+
+def allow_build_attempts(conn: Connection) -> bool:
+    """
+    Let a commit be built more than once: replace the unique commit_hash of
+    build_log by a unique (commit_hash, attempt). SQLite cannot drop a
+    constraint, so the table is rebuilt; every existing build is attempt 1.
+    """
+    columns = _columns(conn, "build_log")
+    if "attempt" in columns:
+        return False
+    conn.execute(text("""
+        CREATE TABLE build_log_new (
+            id INTEGER NOT NULL PRIMARY KEY,
+            commit_hash VARCHAR NOT NULL,
+            attempt INTEGER NOT NULL DEFAULT 1,
+            branch VARCHAR NOT NULL,
+            build_date VARCHAR NOT NULL,
+            built_at DATETIME NOT NULL,
+            result VARCHAR NOT NULL,
+            UNIQUE (commit_hash, attempt)
+        )
+    """))
+    conn.execute(text("""
+        INSERT INTO build_log_new (id, commit_hash, attempt, branch, build_date, built_at, result)
+        SELECT id, commit_hash, 1, branch, build_date, built_at, result FROM build_log
+    """))
+    # The other tables keep referring to build_log by name
+    conn.execute(text("DROP TABLE build_log"))
+    conn.execute(text("ALTER TABLE build_log_new RENAME TO build_log"))
+    conn.execute(text("CREATE INDEX ix_build_log_id ON build_log (id)"))
+    add_build_history_indexes(conn)
+    return True
+
+
+def add_build_repository(conn: Connection) -> bool:
+    """
+    Record which repository each build belongs to, so the same commit in a
+    fork is its own build: attempts become unique per (commit_hash,
+    repository). The table is rebuilt; existing builds get repository ''.
+    """
+    columns = _columns(conn, "build_log")
+    if "repository" in columns:
+        return False
+    conn.execute(text("""
+        CREATE TABLE build_log_new (
+            id INTEGER NOT NULL PRIMARY KEY,
+            commit_hash VARCHAR NOT NULL,
+            repository VARCHAR NOT NULL DEFAULT '',
+            attempt INTEGER NOT NULL DEFAULT 1,
+            branch VARCHAR NOT NULL,
+            build_date VARCHAR NOT NULL,
+            built_at DATETIME NOT NULL,
+            result VARCHAR NOT NULL,
+            UNIQUE (commit_hash, repository, attempt)
+        )
+    """))
+    conn.execute(text("""
+        INSERT INTO build_log_new (id, commit_hash, attempt, branch, build_date, built_at, result)
+        SELECT id, commit_hash, attempt, branch, build_date, built_at, result FROM build_log
+    """))
+    conn.execute(text("DROP TABLE build_log"))
+    conn.execute(text("ALTER TABLE build_log_new RENAME TO build_log"))
+    conn.execute(text("CREATE INDEX ix_build_log_id ON build_log (id)"))
+    add_build_history_indexes(conn)
+    return True
+
+
+def add_test_case_repository(conn: Connection) -> bool:
+    """
+    Key test_case by repository too, so the same test name in two
+    repositories keeps separate timings. The unique constraint changes, so
+    the table is rebuilt; existing tests belong to repository ''.
+    """
+    columns = _columns(conn, "test_case")
+    if not columns or "repository" in columns:
+        return False
+    conn.execute(text("""
+        CREATE TABLE test_case_new (
+            id INTEGER NOT NULL PRIMARY KEY,
+            repository VARCHAR NOT NULL DEFAULT '',
+            stage VARCHAR NOT NULL,
+            node_id VARCHAR NOT NULL,
+            UNIQUE (repository, stage, node_id)
+        )
+    """))
+    conn.execute(text("INSERT INTO test_case_new (id, stage, node_id) SELECT id, stage, node_id FROM test_case"))
+    conn.execute(text("DROP TABLE test_case"))
+    conn.execute(text("ALTER TABLE test_case_new RENAME TO test_case"))
+    return True
+
+
+def drop_test_duration_table(conn: Connection) -> bool:
+    """Sharding reads the per-test timings now, the separate moving averages are no longer kept"""
+    if not conn.execute(text("SELECT name FROM sqlite_master WHERE name = 'test_duration'")).first():
+        return False
+    conn.execute(text("DROP TABLE test_duration"))
+    return True
+
+
+MIGRATIONS = [
+    move_logs_to_log_table,
+    move_results_to_stage_table,
+    add_stage_duration_column,
+    add_build_timestamp_columns,
+    add_build_history_indexes,
+    allow_build_attempts,
+    add_test_case_repository,
+    drop_test_duration_table,
+    add_build_repository,
+]
+
+
+def migrate(engine: Engine) -> list:
+    """Apply every pending migration and return the names of those that ran"""
+    applied = []
+    with engine.connect() as conn:
+        # Rebuilding a table drops it, which foreign keys would refuse; they are
+        # checked once all steps ran. The pragma only takes effect outside a transaction.
+        conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        conn.commit()
+        try:
+            with conn.begin():
+                if not conn.execute(text("SELECT name FROM sqlite_master WHERE name = 'build_log'")).first():
+                    return applied
+                for step in MIGRATIONS:
+                    if step(conn):
+                        applied.append(step.__name__)
+                violations = conn.execute(text("PRAGMA foreign_key_check")).fetchall()
+                if violations:
+                    raise RuntimeError(f"Migrations left rows with missing references: {violations[:5]}")
+        finally:
+            conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+            conn.commit()
+    if applied:
+        # Give the space of the moved data back to the file system
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+    return applied
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "database/CI.db"
+    steps = migrate(create_engine(f"sqlite:///{path}"))
+    print(f"Applied migrations: {', '.join(steps)}" if steps else "Database is up to date.")
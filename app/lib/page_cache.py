@@ -0,0 +1,138 @@
+"""
+In-memory cache of rendered build pages.
+A recorded build never changes, so its detail page is rendered once and
+kept, together with gzip (and, if the brotli package is installed, br)
+compressed copies of the HTML. Requests are answered with the smallest
+encoding the client accepts, without touching the database. The cache
+holds pages up to a total size in bytes (CI_PAGE_CACHE_MB), dropping the
+least recently used ones, and a page is only ever invalidated when its
+build is written.
+"""
+import gzip
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+from app.lib.metrics import Counter, Gauge
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_CACHE_MB = 64
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Pages this small are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+PAGE_CACHE_REQUESTS = Counter("ci_page_cache_requests", "Build page requests by cache outcome", ["result"])
+PAGE_CACHE_BYTES = Gauge("ci_page_cache_bytes", "Bytes of rendered pages held in the page cache")
+
+logger = logging.getLogger(__name__)
+
+
+def cache_limit_bytes() -> int:
+    """Size cap of the page cache (CI_PAGE_CACHE_MB)"""
+    try:
+        return max(0, int(os.getenv("CI_PAGE_CACHE_MB", DEFAULT_CACHE_MB))) * 1024 * 1024
+    except ValueError:
+        return DEFAULT_CACHE_MB * 1024 * 1024
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> Dict[str, float]:
+    """{coding: q} of an Accept-Encoding header"""
+    encodings: Dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[coding.strip().lower()] = q
+    return encodings
+
+
+class CachedPage:
+    """A rendered page with its precompressed bodies, keyed by content coding"""
+
+    def __init__(self, html: str, etag: str):
+        self.etag = etag
+        body = html.encode("utf-8")
+        self.bodies: Dict[str, bytes] = {"identity": body}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            self.bodies["gzip"] = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            if brotli is not None:
+                self.bodies["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+
+    @property
+    def size(self) -> int:
+        return sum(len(body) for body in self.bodies.values())
+
+    def body_for(self, accept_encoding: Optional[str]) -> Tuple[str, bytes]:
+        """(coding, body): the smallest body the client accepts, identity if none"""
+        accepted = accepted_encodings(accept_encoding)
+        choices = [coding for coding in self.bodies
+                   if coding != "identity" and accepted.get(coding, accepted.get("*", 0)) > 0]
+        if not choices:
+            return "identity", self.bodies["identity"]
+        coding = min(choices, key=lambda coding: len(self.bodies[coding]))
+        return coding, self.bodies[coding]
+
+
+class PageCache:
+    """Rendered pages bounded by their total size, least recently used dropped first"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pages: "OrderedDict[Hashable, CachedPage]" = OrderedDict()
+        self.size = 0
+
+    def get(self, key: Hashable) -> Optional[CachedPage]:
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+        PAGE_CACHE_REQUESTS.labels("hit" if page is not None else "miss").inc()
+        return page
+
+    def put(self, key: Hashable, page: CachedPage) -> bool:
+        """Keep page unless it alone is larger than the cache; returns whether it was kept"""
+        if page.size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._pages.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            self._pages[key] = page
+            self.size += page.size
+            while self.size > self.max_bytes:
+                _, evicted = self._pages.popitem(last=False)
+                self.size -= evicted.size
+        return True
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            page = self._pages.pop(key, None)
+            if page is not None:
+                self.size -= page.size
+                logger.debug("Dropped cached page %s", key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pages.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+
+build_pages = PageCache(cache_limit_bytes())
+PAGE_CACHE_BYTES.set_function(lambda: build_pages.size)
@@ -0,0 +1,176 @@
+"""
+Build pipeline definitions.
+A repository describes its build in a .ci.yml file at its root:
+
+    stages:
+      lint:
+        command: python3 -m pytest tests/test_syntax.py -v
+        timeout: 30
+        syntax_check: true
+      integration:
+        command: python3 -m pytest tests/test_CI.py -v
+        needs: [lint]
+        paths: [app, requirements.txt, tests/test_CI.py]
+        shards: 2
+
+command is split like a shell would but run without one; pytest commands
+run on the warm worker pool. needs lists the stages that must succeed
+first, paths the inputs the result cache keys on (the whole tree if left
+out), and syntax_check compiles the pushed Python files before the command.
+shards splits a pytest stage's tests over that many concurrent sessions.
+Repositories without the file get DEFAULT_PIPELINE.
+"""
+import os
+import shlex
+from typing import Any, Dict, List, Optional
+import yaml
+
+PIPELINE_FILE = ".ci.yml"
+DEFAULT_TIMEOUT = 30
+MAX_TIMEOUT = 3600
+MAX_SHARDS = 16
+STAGE_KEYS = {"command", "timeout", "needs", "paths", "syntax_check", "shards"}
+
+
+class PipelineError(ValueError):
+    """The pipeline definition is malformed"""
+
+
+class Stage:
+    """One step of a pipeline"""
+
+    def __init__(self, name: str, command: str, timeout: float = DEFAULT_TIMEOUT,
+                 needs: Optional[List[str]] = None, paths: Optional[List[str]] = None,
+                 syntax_check: bool = False, shards: int = 1):
+        self.name = name
+        self.command = command
+        self.timeout = timeout
+        self.needs = list(needs or [])
+        self.paths = list(paths or [])
+        self.syntax_check = syntax_check
+        self.shards = shards
+
+    @property
+    def argv(self) -> List[str]:
+        return shlex.split(self.command)
+
+    @property
+    def pytest_args(self) -> Optional[List[str]]:
+        """The arguments to pytest if the command runs pytest, otherwise None"""
+        argv = self.argv
+        if argv[:1] == ["pytest"]:
+            return argv[1:]
+        if len(argv) >= 3 and os.path.basename(argv[0]).startswith("python") and argv[1:3] == ["-m", "pytest"]:
+            return argv[3:]
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "command": self.command,
+            "timeout": self.timeout,
+            "needs": self.needs,
+            "paths": self.paths,
+            "syntax_check": self.syntax_check,
+            "shards": self.shards,
+        }
+
+
+# The three stages this server ran before pipelines could be configured
+DEFAULT_PIPELINE = [
+    Stage("test_syntax", "python3 -m pytest tests/test_syntax.py -v",
+          paths=["app", "requirements.txt", "tests/test_syntax.py"], syntax_check=True),
+    Stage("test_notifier", "python3 -m pytest tests/test_notifier.py -v",
+          paths=["app", "requirements.txt", "tests/test_notifier.py"]),
+    Stage("test_CI", "python3 -m pytest tests/test_CI.py -v",
+          paths=["app", "requirements.txt", "tests/test_CI.py"]),
+]
+
+
+def _string_list(value: Any, what: str) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise PipelineError(f"{what} must be a list of strings")
+    return value
+
+
+def _parse_stage(name: Any, spec: Any) -> Stage:
+    if not isinstance(name, str) or not name or "/" in name:
+        raise PipelineError(f"Invalid stage name: {name!r}")
+    if isinstance(spec, str):
+        spec = {"command": spec}
+    if not isinstance(spec, dict):
+        raise PipelineError(f"Stage {name} must be a mapping")
+    unknown = set(spec) - STAGE_KEYS
+    if unknown:
+        raise PipelineError(f"Stage {name} has unknown keys: {', '.join(sorted(unknown))}")
+    command = spec.get("command")
+    if not isinstance(command, str) or not command.strip():
+        raise PipelineError(f"Stage {name} needs a command")
+    try:
+        shlex.split(command)
+    except ValueError as e:
+        raise PipelineError(f"Stage {name} has an invalid command: {str(e)}")
+    timeout = spec.get("timeout", DEFAULT_TIMEOUT)
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or not 0 < timeout <= MAX_TIMEOUT:
+        raise PipelineError(f"Stage {name} timeout must be between 0 and {MAX_TIMEOUT} seconds")
+    shards = spec.get("shards", 1)
+    if isinstance(shards, bool) or not isinstance(shards, int) or not 1 <= shards <= MAX_SHARDS:
+        raise PipelineError(f"Stage {name} shards must be between 1 and {MAX_SHARDS}")
+    stage = Stage(name, command, timeout,
+                  needs=_string_list(spec.get("needs"), f"{name}.needs"),
+                  paths=_string_list(spec.get("paths"), f"{name}.paths"),
+                  syntax_check=bool(spec.get("syntax_check", False)),
+                  shards=shards)
+    if shards > 1 and stage.pytest_args is None:
+        raise PipelineError(f"Stage {name} can only be sharded if it runs pytest")
+    return stage
+
+
+def order_stages(stages: List[Stage]) -> List[Stage]:
+    """Sort stages so each comes after what it needs, keeping the file order otherwise"""
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for need in stage.needs:
+            if need not in by_name:
+                raise PipelineError(f"Stage {stage.name} needs unknown stage {need}")
+    ordered: List[Stage] = []
+    state: Dict[str, str] = {}
+
+    def visit(stage: Stage, path: List[str]) -> None:
+        if state.get(stage.name) == "done":
+            return
+        if state.get(stage.name) == "visiting":
+            raise PipelineError(f"Stages depend on each other: {' -> '.join(path + [stage.name])}")
+        state[stage.name] = "visiting"
+        for need in stage.needs:
+            visit(by_name[need], path + [stage.name])
+        state[stage.name] = "done"
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage, [])
+    return ordered
+
+
+def parse_pipeline(data: Any) -> List[Stage]:
+    """Stages of a parsed .ci.yml document, in dependency order"""
+    if not isinstance(data, dict) or not isinstance(data.get("stages"), dict) or not data["stages"]:
+        raise PipelineError("The pipeline needs a non-empty 'stages' mapping")
+    return order_stages([_parse_stage(name, spec) for name, spec in data["stages"].items()])
+
+
+def load_pipeline(repo_path: str) -> List[Stage]:
+    """The pipeline of the checkout in repo_path, or DEFAULT_PIPELINE if it has none"""
+    path = os.path.join(repo_path, PIPELINE_FILE)
+    if not os.path.isfile(path):
+        return list(DEFAULT_PIPELINE)
+    try:
+        with open(path) as f:
+            data = yaml.safe_load(f)
+    except yaml.YAMLError as e:
+        raise PipelineError(f"{PIPELINE_FILE} is not valid YAML: {str(e)}")
+    return parse_pipeline(data)
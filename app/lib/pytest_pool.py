@@ -0,0 +1,292 @@
+"""
+Pool of pre-warmed pytest worker processes.
+Starting `python3 -m pytest` cold costs an interpreter startup plus the
+import of pytest, its plugins and the project's heavy dependencies for every
+stage. The workers (app/lib/pytest_worker.py) pay that once, then run test
+sessions on request, and are recycled after a number of runs so state
+cannot leak between builds for long. run_pytest picks the pool or a cold
+subprocess depending on CI_PYTEST_POOL.
+"""
+import json
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+import uuid
+from typing import Callable, List, Optional, Tuple
+from app.lib.cancel import on_cancel
+from app.lib.pytest_worker import DONE_PREFIX, READY_PREFIX
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pytest_worker.py")
+PYTHON = "python3"
+DEFAULT_WORKERS = 3
+DEFAULT_MAX_RUNS = 20
+DEFAULT_PRELOAD = "fastapi,starlette,pydantic,sqlalchemy,httpx,github,dotenv"
+START_TIMEOUT = 60
+
+LineCallback = Callable[[str], None]
+logger = logging.getLogger(__name__)
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except ValueError:
+        return default
+
+
+def pool_enabled() -> bool:
+    """Whether tests run on warm workers (CI_PYTEST_POOL, on by default)"""
+    return os.getenv("CI_PYTEST_POOL", "1").lower() not in ("0", "false", "no", "off")
+
+
+class PytestUnavailable(RuntimeError):
+    """The test interpreter cannot start a pytest worker"""
+
+
+class PytestWorker:
+    """One worker process and the thread reading its output"""
+
+    def __init__(self, python: str = PYTHON, preload: Optional[List[str]] = None):
+        self.process = subprocess.Popen(
+            [python, WORKER_SCRIPT] + list(preload or []),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            errors="replace",
+            bufsize=1
+        )
+        self.runs = 0
+        self.ready = False
+        self._lines: "queue.Queue[Optional[str]]" = queue.Queue()
+        threading.Thread(target=self._pump, daemon=True).start()
+
+    def _pump(self) -> None:
+        for line in self.process.stdout:
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def wait_ready(self, timeout: float = START_TIMEOUT) -> None:
+        """Block until the worker has imported pytest, or raise PytestUnavailable"""
+        if self.ready:
+            return
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            self.kill()
+            raise PytestUnavailable(f"pytest worker did not start within {timeout} seconds")
+        if line is None or not line.startswith(READY_PREFIX):
+            self.kill()
+            raise PytestUnavailable("pytest worker exited during startup")
+        info = json.loads(line[len(READY_PREFIX):])
+        if "error" in info:
+            self.kill()
+            raise PytestUnavailable(f"pytest is not available in the environment: {info['error']}")
+        self.ready = True
+
+    def run(self, cwd: str, args: List[str], on_line: LineCallback, timeout: float) -> Tuple[int, str]:
+        """
+        Run one pytest session in cwd, passing each output line to on_line.
+        Returns (exit code, stderr). On timeout the worker is killed and
+        subprocess.TimeoutExpired is raised. Cancelling the build kills the
+        worker too.
+        """
+        token = uuid.uuid4().hex
+        self.process.stdin.write(json.dumps({"cwd": os.path.abspath(cwd), "args": args, "token": token}) + "\n")
+        self.process.stdin.flush()
+        self.runs += 1
+        deadline = time.monotonic() + timeout
+        with on_cancel(self.process.kill):
+            while True:
+                try:
+                    line = self._lines.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    self.kill()
+                    raise subprocess.TimeoutExpired(args, timeout)
+                if line is None:
+                    raise RuntimeError("pytest worker exited during the test run")
+                if line.startswith(DONE_PREFIX):
+                    done = json.loads(line[len(DONE_PREFIX):])
+                    if done["token"] == token:
+                        return done["exit"], done["stderr"]
+                    continue
+                on_line(line)
+
+    def kill(self) -> None:
+        if self.alive():
+            self.process.kill()
+        self.process.wait()
+
+    def stop(self) -> None:
+        """Let the worker exit by closing its job stream"""
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+
+class PytestPool:
+    """Keeps up to size idle warm workers and hands them out one run at a time"""
+
+    def __init__(self, size: int = DEFAULT_WORKERS, max_runs: int = DEFAULT_MAX_RUNS,
+                 python: str = PYTHON, preload: Optional[List[str]] = None):
+        self.size = size
+        self.max_runs = max_runs
+        self.python = python
+        self.preload = preload if preload is not None else DEFAULT_PRELOAD.split(",")
+        self._idle: List[PytestWorker] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self.started = 0
+        self.recycled = 0
+
+    def _spawn(self) -> PytestWorker:
+        try:
+            worker = PytestWorker(self.python, self.preload)
+        except OSError as e:
+            raise PytestUnavailable(f"Cannot start {self.python}: {str(e)}")
+        self.started += 1
+        return worker
+
+    def warm(self) -> None:
+        """Start workers in the background until size of them are idle"""
+        with self._lock:
+            while not self._closed and len(self._idle) < self.size:
+                try:
+                    self._idle.append(self._spawn())
+                except PytestUnavailable as e:
+                    # Reported again by the run that needs a worker
+                    logger.warning("Could not warm pytest workers: %s", e)
+                    return
+
+    def _acquire(self) -> PytestWorker:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("pytest pool is shut down")
+            worker = None
+            while self._idle and worker is None:
+                candidate = self._idle.pop(0)
+                if candidate.alive():
+                    worker = candidate
+                else:
+                    candidate.kill()
+            if worker is None:
+                worker = self._spawn()
+        worker.wait_ready()
+        return worker
+
+    def _release(self, worker: PytestWorker) -> None:
+        with self._lock:
+            keep = not self._closed and worker.alive() and worker.runs < self.max_runs \
+                and len(self._idle) < self.size
+        if keep:
+            with self._lock:
+                self._idle.append(worker)
+            return
+        if worker.runs >= self.max_runs:
+            self.recycled += 1
+        worker.stop()
+        # Start the replacement now so the next run finds it warm
+        self.warm()
+
+    def run(self, cwd: str, args: List[str], on_line: LineCallback, timeout: float) -> Tuple[int, str]:
+        worker = self._acquire()
+        try:
+            result = worker.run(cwd, args, on_line, timeout)
+        except BaseException:
+            worker.kill()
+            self.warm()
+            raise
+        self._release(worker)
+        return result
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._closed = True
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.stop()
+
+
+def run_cold(cwd: str, args: List[str], on_line: LineCallback, timeout: float) -> Tuple[int, str]:
+    """Run pytest in a fresh `python3 -m pytest` subprocess, like run() on a worker"""
+    return run_process([PYTHON, '-m', 'pytest'] + args, cwd, on_line, timeout)
+
+
+def run_process(argv: List[str], cwd: str, on_line: LineCallback, timeout: float) -> Tuple[int, str]:
+    """
+    Run a command in cwd, passing each stdout line to on_line as it arrives.
+    Returns (exit code, stderr); kills the command and raises
+    subprocess.TimeoutExpired after timeout seconds, or when the build is
+    cancelled.
+    """
+    process = subprocess.Popen(
+        argv,
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors="replace"
+    )
+    stderr_lines: List[str] = []
+
+    def pump_stdout():
+        for line in process.stdout:
+            on_line(line)
+
+    def pump_stderr():
+        for line in process.stderr:
+            stderr_lines.append(line)
+
+    readers = [threading.Thread(target=pump_stdout, daemon=True),
+               threading.Thread(target=pump_stderr, daemon=True)]
+    for reader in readers:
+        reader.start()
+    try:
+        with on_cancel(process.kill):
+            returncode = process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        for reader in readers:
+            reader.join()
+    return returncode, "".join(stderr_lines)
+
+
+_pool: Optional[PytestPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> PytestPool:
+    """The shared pool, sized with CI_PYTEST_WORKERS and CI_PYTEST_MAX_RUNS"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            preload = [name for name in os.getenv("CI_PYTEST_PRELOAD", DEFAULT_PRELOAD).split(",") if name]
+            _pool = PytestPool(_int_env("CI_PYTEST_WORKERS", DEFAULT_WORKERS),
+                               _int_env("CI_PYTEST_MAX_RUNS", DEFAULT_MAX_RUNS), preload=preload)
+        return _pool
+
+
+def reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
+
+
+def run_pytest(cwd: str, args: List[str], on_line: LineCallback, timeout: float) -> Tuple[int, str]:
+    """Run pytest with args in cwd on a warm worker, or cold if the pool is disabled"""
+    if pool_enabled():
+        return get_pool().run(cwd, args, on_line, timeout)
+    return run_cold(cwd, args, on_line, timeout)
@@ -0,0 +1,102 @@
+"""
+Pre-warmed pytest worker, started by app/lib/pytest_pool.py.
+Runs in the interpreter the tests use and depends only on the standard
+library and pytest. After importing pytest and the modules named on the
+command line it prints a ready line, then runs one pytest session per JSON
+job read from stdin. Test output goes to stdout as usual and each job ends
+with a done line. Modules a job imported from its checkout are dropped
+afterwards, so the next checkout is imported fresh; everything else stays warm.
+
+    python3 app/lib/pytest_worker.py [module ...]
+"""
+import io
+import json
+import os
+import sys
+
+READY_PREFIX = "\x00ci-worker-ready "
+DONE_PREFIX = "\x00ci-worker-done "
+
+
+def preload(modules):
+    loaded = []
+    for module in modules:
+        try:
+            __import__(module)
+            loaded.append(module)
+        except Exception:
+            # Heavy dependencies are optional, the tests may not use them
+            pass
+    return loaded
+
+
+def from_checkout(module, cwd):
+    """Whether a module was loaded from the checkout (or from nowhere in particular)"""
+    locations = [getattr(module, "__file__", None)] + list(getattr(module, "__path__", None) or [])
+    locations = [os.path.abspath(location) for location in locations if isinstance(location, str)]
+    root = os.path.abspath(cwd) + os.sep
+    return not locations or any(location.startswith(root) for location in locations)
+
+
+def run_job(job, protocol_out):
+    saved_path = list(sys.path)
+    saved_modules = set(sys.modules)
+    saved_environ = dict(os.environ)
+    saved_cwd = os.getcwd()
+    saved_stderr = sys.stderr
+    stderr = io.StringIO()
+    exit_code = 3
+    try:
+        os.chdir(job["cwd"])
+        # Like `python -m pytest`, make the checkout importable
+        sys.path.insert(0, job["cwd"])
+        sys.stderr = stderr
+        exit_code = int(pytest.main(job["args"]))
+    except BaseException as e:
+        stderr.write(f"pytest worker error: {e!r}\n")
+    finally:
+        sys.stdout.flush()
+        sys.stderr = saved_stderr
+        os.chdir(saved_cwd)
+        sys.path[:] = saved_path
+        os.environ.clear()
+        os.environ.update(saved_environ)
+        for name in set(sys.modules) - saved_modules:
+            if from_checkout(sys.modules[name], job["cwd"]):
+                del sys.modules[name]
+    protocol_out.write(DONE_PREFIX + json.dumps({
+        "token": job["token"],
+        "exit": exit_code,
+        "stderr": stderr.getvalue()
+    }) + "\n")
+    protocol_out.flush()
+
+
+def main():
+    # Keep the CI server's own modules out of reach of the tested code
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:] = [path for path in sys.path if os.path.abspath(path or ".") != script_dir]
+    # Jobs arrive on a private copy of stdin, tests only see /dev/null
+    commands = os.fdopen(os.dup(0), "r")
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    protocol_out = sys.stdout
+
+    global pytest
+    try:
+        import pytest
+    except ImportError as e:
+        protocol_out.write(READY_PREFIX + json.dumps({"error": str(e)}) + "\n")
+        protocol_out.flush()
+        sys.exit(3)
+    loaded = preload(sys.argv[1:])
+    protocol_out.write(READY_PREFIX + json.dumps({"pytest": pytest.__version__, "preloaded": loaded}) + "\n")
+    protocol_out.flush()
+
+    for line in commands:
+        if line.strip():
+            run_job(json.loads(line), protocol_out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+HTML rendering for the build pages.
+Jinja2 templates from app/templates are compiled once at import and
+autoescaped. Pages are rendered to a string, and ETags are derived from the
+data a page shows plus the template version.
+"""
+import hashlib
+import os
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from starlette.staticfiles import StaticFiles
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_DIR = os.path.join(APP_DIR, "templates")
+STATIC_DIR = os.path.join(APP_DIR, "static")
+TEMPLATE_NAMES = ("base.html", "error.html", "build_list.html", "build_detail.html", "build_stats.html")
+
+
+def _files_digest(directory: str, names) -> str:
+    digest = hashlib.sha1()
+    for name in sorted(names):
+        with open(os.path.join(directory, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:10]
+
+
+STATIC_VERSION = _files_digest(STATIC_DIR, os.listdir(STATIC_DIR))
+TEMPLATE_VERSION = _files_digest(TEMPLATE_DIR, TEMPLATE_NAMES)
+
+env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True
+)
+# The version in the URL lets browsers cache the stylesheet for good
+env.globals["stylesheet"] = f"/static/ci.css?v={STATIC_VERSION}"
+templates = {name: env.get_template(name) for name in TEMPLATE_NAMES}
+
+
+def render(name: str, **context) -> str:
+    return templates[name].render(**context)
+
+
+def etag(*parts) -> str:
+    """Weak ETag for a page built from parts with the current templates"""
+    key = "|".join(str(part) for part in (TEMPLATE_VERSION,) + parts)
+    return f'W/"{hashlib.sha1(key.encode()).hexdigest()[:16]}"'
+
+
+def etag_matches(if_none_match: str | None, tag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {candidate.strip() for candidate in if_none_match.split(",")}
+    return "*" in candidates or tag in candidates or tag.removeprefix("W/") in candidates
+
+
+class CachedStaticFiles(StaticFiles):
+    """Static files served with long-lived cache headers (URLs are versioned)"""
+
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
@@ -0,0 +1,159 @@
+"""
+Persistent cache of bare mirror clones, one per repository URL.
+Mirrors are brought up to date with an incremental fetch and every build
+gets its own git worktree of the exact commit, instead of a full clone.
+Cold mirrors are evicted least-recently-used first once the cache grows
+past its size limit.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from typing import Dict, List, Optional
+
+MIRROR_DIR = os.getenv("CI_MIRROR_DIR", "./repo_cache")
+DEFAULT_CACHE_MB = 2048
+
+logger = logging.getLogger(__name__)
+
+_locks_guard = threading.Lock()
+_mirror_locks: Dict[str, threading.Lock] = {}
+
+
+def cache_limit_bytes() -> int:
+    """Size cap for all mirrors together (CI_MIRROR_CACHE_MB)"""
+    try:
+        return int(os.getenv("CI_MIRROR_CACHE_MB", DEFAULT_CACHE_MB)) * 1024 * 1024
+    except ValueError:
+        return DEFAULT_CACHE_MB * 1024 * 1024
+
+
+def mirror_path(repo_url: str) -> str:
+    """Directory of the mirror for a repository URL"""
+    name = repo_url.rstrip("/").split("/")[-1]
+    if name.endswith(".git"):
+        name = name[:-4]
+    digest = hashlib.sha1(repo_url.encode()).hexdigest()[:12]
+    return os.path.join(MIRROR_DIR, f"{name}-{digest}.git")
+
+
+def _lock_for(path: str) -> threading.Lock:
+    with _locks_guard:
+        return _mirror_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def _git(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(["git", *args], check=True, capture_output=True, text=True)
+
+
+def _has_commit(mirror: str, rev: str) -> bool:
+    result = subprocess.run(["git", "-C", mirror, "cat-file", "-e", f"{rev}^{{commit}}"],
+                            capture_output=True)
+    return result.returncode == 0
+
+
+def _update_mirror(repo_url: str, path: str) -> None:
+    """Create or fetch the mirror at path; the caller holds its lock"""
+    if os.path.isdir(path):
+        _git("-C", path, "fetch", "--prune", "origin")
+    else:
+        os.makedirs(MIRROR_DIR, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        _git("clone", "--mirror", repo_url, tmp_path)
+        os.rename(tmp_path, path)
+    os.utime(path)
+
+
+def ensure_mirror(repo_url: str) -> str:
+    """Create the mirror for repo_url, or fetch new objects into it, and return its path"""
+    path = mirror_path(repo_url)
+    with _lock_for(path):
+        _update_mirror(repo_url, path)
+    return path
+
+
+def add_worktree(repo_url: str, rev: str, dest: str) -> str:
+    """
+    Check out rev (a commit SHA or branch name) of repo_url into dest as a
+    detached worktree of the cached mirror. Returns the mirror path.
+    """
+    path = mirror_path(repo_url)
+    # One lock from fetch to worktree, so eviction cannot delete the mirror in between
+    with _lock_for(path):
+        _update_mirror(repo_url, path)
+        if not _has_commit(path, rev):
+            # e.g. a commit that is no longer reachable from any branch
+            _git("-C", path, "fetch", "origin", rev)
+        _git("-C", path, "worktree", "prune")
+        _git("-C", path, "worktree", "add", "--force", "--detach", os.path.abspath(dest), rev)
+        os.utime(path)
+    evict_cold_mirrors()
+    return path
+
+
+def remove_worktree(dest: str) -> bool:
+    """Remove a worktree created by add_worktree. Returns False if dest is not one."""
+    if not os.path.isfile(os.path.join(dest, ".git")):
+        return False
+    try:
+        common_dir = _git("-C", dest, "rev-parse", "--git-common-dir").stdout.strip()
+    except subprocess.CalledProcessError:
+        return False
+    common_dir = os.path.join(dest, common_dir)
+    with _lock_for(common_dir):
+        _git("-C", common_dir, "worktree", "remove", "--force", os.path.abspath(dest))
+    return True
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _in_use(path: str) -> bool:
+    """A mirror with live worktrees is backing a running build"""
+    worktrees = os.path.join(path, "worktrees")
+    return os.path.isdir(worktrees) and bool(os.listdir(worktrees))
+
+
+def list_mirrors() -> List[str]:
+    """Cached mirrors, least recently used first"""
+    if not os.path.isdir(MIRROR_DIR):
+        return []
+    mirrors = [os.path.join(MIRROR_DIR, name) for name in os.listdir(MIRROR_DIR) if name.endswith(".git")]
+    return sorted(mirrors, key=os.path.getmtime)
+
+
+def evict_cold_mirrors(limit: Optional[int] = None) -> List[str]:
+    """Delete least recently used mirrors until the cache fits in limit bytes"""
+    if limit is None:
+        limit = cache_limit_bytes()
+    mirrors = list_mirrors()
+    sizes = {path: _dir_size(path) for path in mirrors}
+    total = sum(sizes.values())
+    evicted = []
+    for path in mirrors:
+        if total <= limit:
+            break
+        lock = _lock_for(path)
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            if _in_use(path):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= sizes[path]
+            evicted.append(path)
+            logger.info("Evicted cold mirror %s", path)
+        finally:
+            lock.release()
+    return evicted
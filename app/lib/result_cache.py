@@ -0,0 +1,98 @@
+"""
+Cache of test stage results keyed by what the stage actually depends on.
+A key combines the stage name, the git object ids of the paths the stage
+reads at the checked-out commit, and a fingerprint of the Python
+interpreter and installed packages the tests run with. If an earlier build
+produced the same key, its result is reused instead of running pytest again.
+"""
+import hashlib
+import logging
+import os
+import subprocess
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from app.lib import database_api
+
+DEFAULT_MAX_ENTRIES = 1000
+FINGERPRINT_TTL = 300
+NO_CACHE_MARKER = "[ci no-cache]"
+
+# Only outcomes decided by the code are reused, not infrastructure errors
+CACHEABLE_STATUSES = {"success", "failure"}
+
+logger = logging.getLogger(__name__)
+
+_fingerprint_lock = threading.Lock()
+_fingerprint: Dict[str, Any] = {"value": None, "at": 0.0}
+
+FINGERPRINT_SCRIPT = (
+    "import sys, importlib.metadata as m; print(sys.version); "
+    "print('\\n'.join(sorted(f\"{d.metadata['Name']}=={d.version}\" for d in m.distributions())))"
+)
+
+
+def max_entries() -> int:
+    """Size bound of the cache (CI_RESULT_CACHE_ENTRIES)"""
+    try:
+        return max(0, int(os.getenv("CI_RESULT_CACHE_ENTRIES", DEFAULT_MAX_ENTRIES)))
+    except ValueError:
+        return DEFAULT_MAX_ENTRIES
+
+
+def environment_fingerprint() -> str:
+    """Hash of the test interpreter's version and installed packages, refreshed every few minutes"""
+    with _fingerprint_lock:
+        if _fingerprint["value"] and time.monotonic() - _fingerprint["at"] < FINGERPRINT_TTL:
+            return _fingerprint["value"]
+        result = subprocess.run(["python3", "-c", FINGERPRINT_SCRIPT], capture_output=True, text=True, check=True)
+        _fingerprint["value"] = hashlib.sha256(result.stdout.encode()).hexdigest()
+        _fingerprint["at"] = time.monotonic()
+        return _fingerprint["value"]
+
+
+def tree_fingerprint(repo_path: str, paths: List[str]) -> str:
+    """Hash of the git object ids of paths at HEAD of the checkout in repo_path"""
+    revs = [f"HEAD:{path}" for path in paths] if paths else ["HEAD^{tree}"]
+    lines = []
+    for rev in revs:
+        result = subprocess.run(["git", "-C", repo_path, "rev-parse", "--verify", "--quiet", rev],
+                                capture_output=True, text=True)
+        lines.append(f"{rev}={result.stdout.strip() if result.returncode == 0 else 'missing'}")
+    if all(line.endswith("=missing") for line in lines):
+        raise ValueError(f"{repo_path} is not a git checkout")
+    return hashlib.sha256("\n".join(lines).encode()).hexdigest()
+
+
+def stage_cache_key(stage: str, repo_path: str, paths: List[str]) -> Optional[str]:
+    """Cache key for running stage on the checkout in repo_path, or None if it cannot be computed"""
+    try:
+        parts = [stage, tree_fingerprint(repo_path, paths), environment_fingerprint()]
+    except (OSError, ValueError, subprocess.CalledProcessError) as e:
+        logger.warning("Result cache disabled for %s: %s", stage, e)
+        return None
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+def lookup(cache_key: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Cached result for cache_key, or None. A broken cache never fails the build."""
+    if cache_key is None or max_entries() == 0:
+        return None
+    try:
+        return database_api.get_cached_stage_result(cache_key)
+    except Exception as e:
+        logger.warning("Result cache lookup failed: %s", e)
+        return None
+
+
+def store(cache_key: Optional[str], stage: str, commit_hash: str, result: Dict[str, Any]) -> None:
+    """Cache a stage result; its log is result["compressed_log"], or else its output and error"""
+    if cache_key is None or max_entries() == 0 or result.get("status") not in CACHEABLE_STATUSES:
+        return
+    compressed = result.get("compressed_log") or database_api.compress_log(
+        result.get("output", "") + "\n" + result.get("error", ""))
+    try:
+        database_api.store_cached_stage_result(cache_key, stage, commit_hash, result["status"], result["description"],
+                                               compressed, result.get("error", ""), max_entries())
+    except Exception as e:
+        logger.warning("Result cache store failed: %s", e)
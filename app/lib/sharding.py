@@ -0,0 +1,127 @@
+"""
+Sharding of a pytest stage across several workers.
+The stage's tests are collected first (--collect-only), split into shards
+of about equal expected duration using the per-test durations recorded by
+earlier builds, and the shards are run concurrently. Their output is merged
+into one stream with a [shard i/n] prefix and the stage reports as a whole.
+"""
+import contextvars
+import heapq
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from app.lib import database_api
+from app.lib.pipeline import MAX_SHARDS
+from app.lib.pytest_pool import run_pytest
+
+DEFAULT_DURATION = 1.0
+VERBOSITY_FLAGS = {"-v", "-vv", "-q", "-qq", "--verbose", "--quiet"}
+# pytest options that report every test's setup, call and teardown time
+DURATION_FLAGS = ["--durations=0", "--durations-min=0"]
+DURATION_LINE = re.compile(r"^(?:\[shard \d+/\d+\] )?\s*(\d+(?:\.\d+)?)s (setup|call|teardown)\s+(\S.*?)\s*$")
+
+LineCallback = Callable[[str], None]
+logger = logging.getLogger(__name__)
+
+
+def split_args(repo_path: str, args: List[str]) -> Tuple[List[str], List[str]]:
+    """Split pytest arguments into (options, test paths in the checkout)"""
+    options, targets = [], []
+    for arg in args:
+        if not arg.startswith("-") and os.path.exists(os.path.join(repo_path, arg.split("::")[0])):
+            targets.append(arg)
+        else:
+            options.append(arg)
+    return options, targets
+
+
+def collect_node_ids(repo_path: str, args: List[str], timeout: float) -> List[str]:
+    """Node ids of the tests pytest would run with args"""
+    lines: List[str] = []
+    options = [arg for arg in args if arg not in VERBOSITY_FLAGS]
+    returncode, _ = run_pytest(repo_path, options + ["--collect-only", "-q"], lines.append, timeout)
+    if returncode != 0:
+        return []
+    node_ids = []
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line.strip():
+            # The summary after the blank line is not a test
+            break
+        if "::" in line:
+            node_ids.append(line)
+    return node_ids
+
+
+def balance(node_ids: List[str], durations: Dict[str, float], shards: int) -> List[List[str]]:
+    """
+    Split node_ids into at most shards groups of about equal total duration,
+    longest tests first (LPT). Tests without history count as the average
+    known duration. Each group keeps the collection order.
+    """
+    shards = max(1, min(shards, len(node_ids)))
+    known = [durations[node_id] for node_id in node_ids if node_id in durations]
+    default = sum(known) / len(known) if known else DEFAULT_DURATION
+    order = {node_id: i for i, node_id in enumerate(node_ids)}
+    heap = [(0.0, i) for i in range(shards)]
+    groups: List[List[str]] = [[] for _ in range(shards)]
+    for node_id in sorted(node_ids, key=lambda node_id: -durations.get(node_id, default)):
+        total, shard = heapq.heappop(heap)
+        groups[shard].append(node_id)
+        heapq.heappush(heap, (total + durations.get(node_id, default), shard))
+    return [sorted(group, key=order.__getitem__) for group in groups if group]
+
+
+def parse_durations(lines: List[str]) -> Dict[str, float]:
+    """Total setup, call and teardown time per test from pytest --durations output (sharded or not)"""
+    durations: Dict[str, float] = {}
+    for line in lines:
+        match = DURATION_LINE.match(line)
+        if match:
+            durations[match.group(3)] = durations.get(match.group(3), 0.0) + float(match.group(1))
+    return durations
+
+
+def run_sharded(repo_path: str, args: List[str], shards: int, on_line: LineCallback, timeout: float,
+                history_key: Optional[str] = None) -> Tuple[int, str]:
+    """
+    Run pytest with args as up to shards concurrent sessions, like run_pytest.
+    Durations are read from the test timings recorded for history_key (the
+    repository); they are stored with the build like any stage's timings.
+    Falls back to a single session if the tests cannot be split.
+    """
+    options, targets = split_args(repo_path, args)
+    node_ids = collect_node_ids(repo_path, args, timeout) if targets else []
+    if len(node_ids) < 2 or shards < 2:
+        return run_pytest(repo_path, args, on_line, timeout)
+
+    durations = {}
+    if history_key:
+        try:
+            durations = database_api.get_test_durations(history_key, node_ids)
+        except Exception as e:
+            logger.warning("Test duration history unavailable: %s", e)
+    groups = balance(node_ids, durations, min(shards, MAX_SHARDS))
+    on_line(f"Running {len(node_ids)} tests in {len(groups)} shards\n")
+
+    def run_shard(index: int) -> Tuple[int, str]:
+        prefix = f"[shard {index + 1}/{len(groups)}] "
+
+        def forward(line: str) -> None:
+            on_line(prefix + line)
+
+        extra = [flag for flag in DURATION_FLAGS if flag not in options]
+        return run_pytest(repo_path, options + extra + groups[index], forward, timeout)
+
+    with ThreadPoolExecutor(max_workers=len(groups), thread_name_prefix="ci-shard") as executor:
+        # Each shard sees the build's context, so cancelling the build kills it
+        futures = [executor.submit(contextvars.copy_context().run, run_shard, index) for index in range(len(groups))]
+        results = [future.result() for future in futures]
+
+    codes = [returncode for returncode, _ in results]
+    # Test failures (exit code 1) take precedence over other problems
+    returncode = 1 if 1 in codes else max(codes)
+    stderr = "".join(f"[shard {i + 1}/{len(groups)}] {err}" for i, (_, err) in enumerate(results) if err)
+    return returncode, stderr
@@ -0,0 +1,115 @@
+"""
+Parallel executor for the stages of a single build.
+Stages are run on a small thread pool (each one mostly waits on a pytest
+subprocess) in the order their dependencies allow, and a callback is fired
+as soon as each stage finishes. Stages see the caller's context variables
+(like the log context of the build).
+"""
+import contextvars
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_STAGE_CONCURRENCY = 3
+SUCCESS = "success"
+SKIPPED = "skipped"
+
+StageResult = Dict[str, Any]
+logger = logging.getLogger(__name__)
+
+
+def stage_concurrency() -> int:
+    """Per-build cap on concurrently running stages (CI_STAGE_CONCURRENCY)"""
+    try:
+        return max(1, int(os.getenv("CI_STAGE_CONCURRENCY", DEFAULT_STAGE_CONCURRENCY)))
+    except ValueError:
+        return DEFAULT_STAGE_CONCURRENCY
+
+
+def run_stages(stages: List[Tuple[str, Callable[[], StageResult]]],
+               on_complete: Optional[Callable[[str, StageResult], None]] = None,
+               max_parallel: Optional[int] = None,
+               needs: Optional[Dict[str, List[str]]] = None) -> Dict[str, StageResult]:
+    """
+    Run the stages of a build as a dependency graph and return their results by name.
+
+    stages is a list of (name, callable) pairs and needs maps a stage name to
+    the stages it depends on. A stage starts as soon as everything it needs
+    has succeeded, and is skipped if any of them did not. At most
+    max_parallel stages run at the same time. on_complete(name, result) is
+    called from the calling thread as soon as each stage is done (or
+    skipped), in completion order. The returned dict keeps the order the
+    stages were given in.
+    """
+    if max_parallel is None:
+        max_parallel = stage_concurrency()
+    needs = needs or {}
+    results: Dict[str, StageResult] = {}
+    if not stages:
+        return results
+
+    def finish(name: str, result: StageResult) -> None:
+        results[name] = result
+        if on_complete is not None:
+            try:
+                on_complete(name, result)
+            except Exception as e:
+                logger.error("Stage callback failed for %s: %s", name, e)
+
+    pending = dict(stages)
+    with ThreadPoolExecutor(max_workers=min(max_parallel, len(stages)),
+                            thread_name_prefix="ci-stage") as executor:
+        running: Dict[Future, str] = {}
+
+        def schedule() -> None:
+            # Skipping a stage can settle the ones after it, so repeat until stable
+            changed = True
+            while changed:
+                changed = False
+                for name in list(pending):
+                    required = needs.get(name, [])
+                    failed = [need for need in required
+                              if need in results and results[need]["status"] != SUCCESS]
+                    if failed:
+                        del pending[name]
+                        finish(name, skipped_result(failed[0]))
+                        changed = True
+                    elif all(need in results for need in required):
+                        running[executor.submit(contextvars.copy_context().run, pending.pop(name))] = name
+
+        schedule()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {
+                        "status": "error",
+                        "description": f"Test execution error: {str(e)}",
+                        "output": "",
+                        "error": str(e)
+                    }
+                finish(name, result)
+            schedule()
+
+    # Needs on unknown stages (or cycles) can never be met
+    for name in pending:
+        finish(name, {
+            "status": "error",
+            "description": f"{name} needs stages that never ran",
+            "output": "",
+            "error": ""
+        })
+    return {name: results[name] for name, _ in stages}
+
+
+def skipped_result(failed_need: str) -> StageResult:
+    return {
+        "status": SKIPPED,
+        "description": f"Skipped because {failed_need} did not succeed",
+        "output": "",
+        "error": ""
+    }
@@ -0,0 +1,171 @@
+"""
+Long-lived GitHub commit status client.
+One Github object (and so one pooled HTTP session) is shared by all builds,
+repository and commit handles are cached, and status updates are sent from
+a background queue. When several updates for the same commit and context
+are waiting, only the newest one is sent.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from github import Auth, Github
+from app.lib.metrics import github_call
+
+VALID_STATES = {"pending", "success", "failure", "error"}
+DEFAULT_BASE_URL = "https://api.github.com"
+COMMIT_CACHE_SIZE = 256
+
+StatusKey = Tuple[str, str, str]
+logger = logging.getLogger(__name__)
+
+
+class StatusClient:
+    """Sends commit statuses through one pooled GitHub connection"""
+
+    def __init__(self, token: str, base_url: str = DEFAULT_BASE_URL, timeout: int = 10,
+                 pool_size: int = 10, commit_cache_size: int = COMMIT_CACHE_SIZE):
+        # The per-call clients this replaces were never throttled, so
+        # PyGithub's write spacing is turned off to keep stages independent
+        self._github = Github(auth=Auth.Token(token), base_url=base_url, timeout=timeout,
+                              pool_size=pool_size, seconds_between_requests=None,
+                              seconds_between_writes=None)
+        self._cache_lock = threading.Lock()
+        self._repos: Dict[str, Any] = {}
+        self._commits: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._commit_cache_size = commit_cache_size
+
+        self._queue_lock = threading.Condition()
+        self._pending: "OrderedDict[StatusKey, Dict[str, Any]]" = OrderedDict()
+        self._in_flight = 0
+        self._worker: Optional[threading.Thread] = None
+        self._closed = False
+        self.sent = 0
+        self.coalesced = 0
+
+    def _commit(self, repo_full_name: str, commit_sha: str):
+        """Cached commit handle; the repository handle is lazy and costs no request"""
+        key = (repo_full_name, commit_sha)
+        with self._cache_lock:
+            if key in self._commits:
+                self._commits.move_to_end(key)
+                return self._commits[key]
+            repo = self._repos.get(repo_full_name)
+            if repo is None:
+                repo = self._repos[repo_full_name] = self._github.get_repo(repo_full_name, lazy=True)
+        commit = repo.get_commit(commit_sha)
+        with self._cache_lock:
+            self._commits[key] = commit
+            while len(self._commits) > self._commit_cache_size:
+                self._commits.popitem(last=False)
+        return commit
+
+    @github_call("create_status")
+    def send(self, repo_full_name: str, commit_sha: str, state: str, description: str,
+             context: str = "CI Notification", target_url: str = "") -> dict:
+        """
+        Create a commit status right away and return GitHub's raw response.
+        API errors are returned as a dummy response instead of being raised.
+        """
+        if state not in VALID_STATES:
+            raise ValueError(f"Invalid commit status state: {state}. Must be one of {VALID_STATES}")
+        try:
+            status = self._commit(repo_full_name, commit_sha).create_status(
+                state=state,
+                target_url=target_url,
+                description=description,
+                context=context
+            )
+            self.sent += 1
+            return status.raw_data
+        except Exception as e:
+            logger.error("GitHub API error: %s", e, extra={"context": context})
+            return {
+                "state": state,
+                "description": description,
+                "context": context,
+                "error": str(e)
+            }
+
+    def enqueue(self, repo_full_name: str, commit_sha: str, state: str, description: str,
+                context: str = "CI Notification", target_url: str = "") -> None:
+        """Queue a status update, replacing any unsent update for the same context"""
+        if state not in VALID_STATES:
+            raise ValueError(f"Invalid commit status state: {state}. Must be one of {VALID_STATES}")
+        key = (repo_full_name, commit_sha, context)
+        update = {"state": state, "description": description, "target_url": target_url}
+        with self._queue_lock:
+            if self._closed:
+                raise RuntimeError("Status client is closed")
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = update
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._drain, name="ci-status", daemon=True)
+                self._worker.start()
+            self._queue_lock.notify_all()
+
+    def _drain(self) -> None:
+        while True:
+            with self._queue_lock:
+                while not self._pending and not self._closed:
+                    self._queue_lock.wait()
+                if not self._pending:
+                    return
+                (repo_full_name, commit_sha, context), update = self._pending.popitem(last=False)
+                self._in_flight += 1
+            try:
+                self.send(repo_full_name, commit_sha, update["state"], update["description"],
+                          context, update["target_url"])
+            finally:
+                with self._queue_lock:
+                    self._in_flight -= 1
+                    self._queue_lock.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued update has been sent. Returns False on timeout."""
+        with self._queue_lock:
+            return self._queue_lock.wait_for(lambda: not self._pending and not self._in_flight, timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Send what is still queued, then stop the worker and the HTTP session"""
+        with self._queue_lock:
+            self._closed = True
+            self._queue_lock.notify_all()
+        if self._worker is not None:
+            self._worker.join(timeout)
+        self._github.close()
+
+
+_client: Optional[StatusClient] = None
+_client_lock = threading.Lock()
+
+
+def get_status_client() -> StatusClient:
+    """
+    Shared client configured from the environment.
+
+    Requires:
+      - CI_SERVER_AUTH_TOKEN
+    Optional:
+      - GITHUB_API_URL (defaults to https://api.github.com)
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            token = os.getenv("CI_SERVER_AUTH_TOKEN")
+            if not token:
+                raise Exception("Missing GitHub configuration. Please check the environment variables.")
+            _client = StatusClient(token, base_url=os.getenv("GITHUB_API_URL", DEFAULT_BASE_URL))
+        return _client
+
+
+def reset_status_client() -> None:
+    """Close the shared client so the next call picks up a new configuration"""
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close(timeout=5)
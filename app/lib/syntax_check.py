@@ -0,0 +1,103 @@
+"""
+Incremental Python syntax checking.
+Files are compiled in-process with compile(), and each result is cached by
+the file's git blob hash, so an unchanged file is never checked twice. Large
+batches are spread over a process pool to use every core.
+"""
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+CACHE_SIZE = 10000
+PARALLEL_THRESHOLD = 64
+CHUNK_SIZE = 16
+
+
+def blob_hash(content: bytes) -> str:
+    """The id git gives a file with this content"""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def compile_source(path: str, content: bytes) -> Optional[str]:
+    """Return what is wrong with the source (without the path), or None if it compiles"""
+    try:
+        compile(content, path, "exec", dont_inherit=True)
+        return None
+    except SyntaxError as e:
+        return f"line {e.lineno}: {e.msg}"
+    except ValueError as e:
+        # e.g. source containing null bytes
+        return str(e)
+
+
+def _compile_batch(batch: List[Tuple[str, bytes]]) -> List[Optional[str]]:
+    return [compile_source(path, content) for path, content in batch]
+
+
+class SyntaxChecker:
+    """Compiles Python files, remembering the outcome for each blob hash"""
+
+    def __init__(self, cache_size: int = CACHE_SIZE, workers: Optional[int] = None,
+                 parallel_threshold: int = PARALLEL_THRESHOLD):
+        self.cache_size = cache_size
+        self.workers = workers or os.cpu_count() or 1
+        self.parallel_threshold = parallel_threshold
+        self._cache: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn, because forking a threaded server is not safe
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def check_files(self, paths: List[str]) -> Dict[str, Optional[str]]:
+        """Return {path: "path: line N: message" or None} for every file in paths"""
+        results: Dict[str, Optional[str]] = {}
+        todo: List[Tuple[str, bytes, str]] = []
+        for path in paths:
+            with open(path, "rb") as f:
+                content = f.read()
+            digest = blob_hash(content)
+            with self._lock:
+                if digest in self._cache:
+                    self._cache.move_to_end(digest)
+                    error = self._cache[digest]
+                    results[path] = f"{path}: {error}" if error else None
+                    self.hits += 1
+                    continue
+                self.misses += 1
+            todo.append((path, content, digest))
+
+        if len(todo) >= self.parallel_threshold and self.workers > 1:
+            batches = [[(path, content) for path, content, _ in todo[i:i + CHUNK_SIZE]]
+                       for i in range(0, len(todo), CHUNK_SIZE)]
+            errors = [error for batch in self._get_pool().map(_compile_batch, batches) for error in batch]
+        else:
+            errors = [compile_source(path, content) for path, content, _ in todo]
+
+        with self._lock:
+            for (path, _, digest), error in zip(todo, errors):
+                results[path] = f"{path}: {error}" if error else None
+                self._cache[digest] = error
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return results
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+syntax_checker = SyntaxChecker()
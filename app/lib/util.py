@@ -1,3 +1,4 @@
+import logging
 import os
 import subprocess
 import shutil
@@ -5,6 +6,12 @@ import stat
 import time
 from github import Github, Auth 
 from typing import Dict, Any
+from app.lib.repo_cache import add_worktree, remove_worktree
+from app.lib.syntax_check import syntax_checker
+from app.lib.metrics import CLONE_ERRORS, CLONE_SECONDS, github_call, timed
+
+logger = logging.getLogger(__name__)
+
 def run_tests(repo_path: str) -> Dict[str, Any]:
     """
     Run tests in the specified repository path.
@@ -40,56 +47,92 @@ def run_tests(repo_path: str) -> Dict[str, Any]:
         }
 
 
-def check_syntax(repo):
+def changed_python_files(commits) -> list:
+    """
+    Python files added or modified by the commits of a push event, in
+    repository-relative form, leaving out files removed again later.
+    """
+    changed = {}
+    for commit in commits or []:
+        for path in commit.get("added", []) + commit.get("modified", []):
+            changed[path] = True
+        for path in commit.get("removed", []):
+            changed.pop(path, None)
+    return [path for path in changed if path.endswith(".py")]
+
+def check_syntax(repo, changed_files=None, deep=False):
+    """
+    Check Python files for syntax errors by compiling them in-process.
+    repo is a file or a directory. If changed_files (paths relative to repo)
+    is given only those are checked, otherwise every .py file under repo.
+    Results are cached per file content; deep=True adds a pylint pass.
+    """
     if not os.path.exists(repo):
-        print("File does not exist")
+        logger.warning("%s does not exist", repo)
         return False
     try:
-        # Find all Python files in the repository
-        python_files = [os.path.join(root, file) 
-                       for root, _, files in os.walk(repo)
-                       for file in files if file.endswith('.py')]
+        if os.path.isfile(repo):
+            python_files = [repo]
+        elif changed_files is not None:
+            python_files = [os.path.join(repo, path) for path in changed_files
+                            if path.endswith('.py') and os.path.isfile(os.path.join(repo, path))]
+        else:
+            # Find all Python files in the repository
+            python_files = [os.path.join(root, file) 
+                           for root, _, files in os.walk(repo)
+                           for file in files if file.endswith('.py')]
         
         if not python_files:
-            print("No Python files found to check")
+            logger.info("No Python files found to check")
             return True
-            
-        # Check all Python files in a single pylint call
-        syntax = subprocess.run(["pylint"] + python_files + ["--errors-only"], 
-                              capture_output=True, text=True)
-        
-        # Check both stdout and stderr for syntax errors
-        output = syntax.stdout + syntax.stderr
-        if "syntax-error" in output.lower():
-            print("Syntax errors found")
+
+        errors = [error for error in syntax_checker.check_files(python_files).values() if error]
+        if errors:
+            for error in errors:
+                logger.info("Syntax error: %s", error)
             return False
+
+        if deep:
+            # Optional deeper pass, much slower than compiling
+            syntax = subprocess.run(["pylint"] + python_files + ["--errors-only"], 
+                                  capture_output=True, text=True)
+            output = syntax.stdout + syntax.stderr
+            if "syntax-error" in output.lower():
+                logger.info("pylint found syntax errors")
+                return False
         
-        print("Syntax check passed with no errors.")
+        logger.debug("Syntax check passed with no errors")
         return True
         
     except Exception as e:
-        print("Error in syntax check:", e)
+        logger.error("Error in syntax check: %s", e)
         return False
 
-def clone_repo(repo_url, id, branch):
+@timed(CLONE_SECONDS, errors=CLONE_ERRORS, failed=lambda cloned: not cloned)
+def clone_repo(repo_url, id, branch, commit_sha=None):
+    """
+    Check out the pushed code into ./cloned_repo/<name>-<id>.
+    The checkout is a git worktree of a cached mirror of the repository, at
+    commit_sha if given and otherwise at the tip of branch.
+    """
     if not repo_url.startswith("https://github.com"):
-        print("Invalid GitHub repo URL")
+        logger.warning("Invalid GitHub repo URL: %s", repo_url)
         return False
 
     repo_name = f"{repo_url.split('/')[-1].split('.')[0]}-{id}"
     repo_path = f"./cloned_repo/{repo_name}"
 
     try:
-        subprocess.run(["git", "clone", repo_url, repo_path], check=True)
-        subprocess.run(["git", "-C", repo_path, "checkout", branch], check=True)
-        subprocess.run(["git", "-C", repo_path, "pull"], check=True)
-        print(f"GitHub repo cloned successfully to {repo_path}")
+        add_worktree(repo_url, commit_sha or branch, repo_path)
+        logger.info("Checked out %s", repo_path)
         return True
     except subprocess.CalledProcessError as e:
-        print(f"Error in cloning {repo_name}: {e}")
+        logger.error("Error in cloning %s: %s %s", repo_name, e, e.stderr or "")
         return False
 
-def update_commit_status(commit_sha: str, state: str, description: str, context: str = "CI Notification", target_url: str = "") -> dict:
+@github_call("create_status")
+def update_commit_status(commit_sha: str, state: str, description: str, context: str = "CI Notification", target_url: str = "",
+                         repository: str | None = None) -> dict:
     """
     Update the commit status on GitHub using PyGithub.
 
@@ -101,10 +144,12 @@ def update_commit_status(commit_sha: str, state: str, description: str, context:
 
     Requires:
       - CI_SERVER_AUTH_TOKEN
-      - REPO_OWNER
-      - REPO_NAME
+      - repository ("owner/name"), or REPO_OWNER and REPO_NAME
 
     Returns GitHub API's raw response data.
+
+    This opens a fresh GitHub connection on every call; the build pipeline
+    uses the shared, queued client in app.lib.status_client instead.
     """
     VALID_STATES = {"pending", "success", "failure", "error"}
 
@@ -112,8 +157,12 @@ def update_commit_status(commit_sha: str, state: str, description: str, context:
         raise ValueError(f"Invalid commit status state: {state}. Must be one of {VALID_STATES}")
 
     token = os.getenv("CI_SERVER_AUTH_TOKEN")
-    repo_owner = os.getenv("REPO_OWNER")
-    repo_name = os.getenv("REPO_NAME")
+    # The environment only names a default repository, builds pass their own
+    if repository:
+        repo_owner, _, repo_name = repository.partition("/")
+    else:
+        repo_owner = os.getenv("REPO_OWNER")
+        repo_name = os.getenv("REPO_NAME")
 
     if not token or not repo_owner or not repo_name:
         raise Exception("Missing GitHub configuration. Please check the environment variables.")
@@ -142,7 +191,7 @@ def update_commit_status(commit_sha: str, state: str, description: str, context:
         
         return status.raw_data
     except Exception as e:
-        print(f"GitHub API Error: {str(e)}")
+        logger.error("GitHub API error: %s", e)
         # Return a dummy response to prevent blocking
         return {
             "state": state,
@@ -156,6 +205,12 @@ def delete_repo(repo_name):
     # delete the cloned repo
     repo_path = os.path.join("./cloned_repo", repo_name)
     if os.path.exists(repo_path):
+        try:
+            if remove_worktree(repo_path):
+                logger.debug("Deleted %s", repo_name)
+                return True
+        except subprocess.CalledProcessError as e:
+            logger.warning("Error in removing worktree %s, deleting files instead: %s", repo_name, e)
         try:
             for root, dirs, files in os.walk(repo_path):
                 for directory in files:
@@ -164,12 +219,12 @@ def delete_repo(repo_name):
                     os.chmod(os.path.join(root, name), stat.S_IRWXU)
             os.chmod(root, stat.S_IRWXU)
             shutil.rmtree(repo_path, ignore_errors=False)
-            print(f"{repo_name} was deleted successfully!")
+            logger.debug("Deleted %s", repo_name)
             
             return True
         except Exception as e:
-            print(f"Error in removing {repo_name}: ", e)
+            logger.error("Error in removing %s: %s", repo_name, e)
             return False
     else:
-        print(f"{repo_name} does not exist")
+        logger.warning("%s does not exist", repo_name)
         return False
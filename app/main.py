@@ -1,9 +1,16 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from app.routers import notify, builds
+from app.lib.render import CachedStaticFiles, STATIC_DIR
+from app.lib import metrics
+from app.lib.log import configure_logging
 import uvicorn
 
+configure_logging()
+
 app = FastAPI()
 
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
+
 app.include_router(notify.router)
 app.include_router(builds.router)
 
@@ -11,3 +18,7 @@ app.include_router(builds.router)
 def read_root():
     return {"message": "Hello, World!"}
 
+@app.get("/metrics")
+def read_metrics():
+    """Server metrics in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
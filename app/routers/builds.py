@@ -1,122 +1,121 @@
-from fastapi import APIRouter
-from fastapi.responses import HTMLResponse
-from app.lib.database_api import get_entries, get_entry_by_id
+from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from urllib.parse import quote, urlencode
+import datetime
+import asyncio
+from sqlalchemy.orm import Session
+from app.lib.database_api import get_db, log_bytes, on_build_written, utcnow
+from app.lib.async_db import build_repository
+from app.lib.build_queue import build_queue
+from app.lib import build_stats, log_view
+from app.lib.live_log import LogSink, get_sink
+from app.lib.page_cache import CachedPage, accepted_encodings, build_pages
+from app.lib.render import render, etag, etag_matches
 
 router = APIRouter()
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+LOG_POLL_INTERVAL = 0.2
+DEFAULT_STATS_DAYS = 30
+MAX_STATS_DAYS = 365
+
+# Titles of the default pipeline's stages, other stages are shown by name
+STAGE_TITLES = {
+    "test_syntax": "Syntax Test Results",
+    "test_notifier": "Notifier Test Results",
+    "test_CI": "CI Test Results",
+}
+
+# Build ids are reused when a database is replaced, so a stored build drops its old page
+on_build_written(build_pages.invalidate)
+
 def error_page(message: str) -> str:
-    return f"""
-    <html>
-        <head>
-            <title>Error</title>
-            <style>
-                body {{ 
-                    font-family: Arial, sans-serif; 
-                    margin: 40px;
-                    display: flex;
-                    flex-direction: column;
-                    align-items: center;
-                }}
-                .error-box {{
-                    background-color: #ffebee;
-                    border: 1px solid #ffcdd2;
-                    border-radius: 5px;
-                    padding: 20px;
-                    margin: 20px;
-                    max-width: 600px;
-                }}
-                .back-link {{
-                    margin-top: 20px;
-                }}
-                .back-link a {{
-                    color: #0066cc;
-                    text-decoration: none;
-                }}
-                .back-link a:hover {{
-                    text-decoration: underline;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="error-box">
-                <h2>Error</h2>
-                <p>{message}</p>
-            </div>
-            <div class="back-link">
-                <a href="/builds">← Back to Build List</a>
-            </div>
-        </body>
-    </html>
-    """
+    return render("error.html", message=message)
+
+def page_response(page: CachedPage, request: Request) -> Response:
+    """A cached page in the smallest encoding the client accepts"""
+    coding, body = page.body_for(request.headers.get("accept-encoding"))
+    headers = {"ETag": page.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if coding != "identity":
+        headers["Content-Encoding"] = coding
+    return Response(content=body, media_type="text/html; charset=utf-8", headers=headers)
 
 @router.get("/builds", response_class=HTMLResponse)
-async def get_builds():
-    builds = get_entries()
+async def get_builds(request: Request, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                     after: int | None = None, branch: str | None = None, date: datetime.date | None = None,
+                     db: Session = Depends(get_db)):
+    # Builds are only ever added, so the newest id versions every page
+    latest_id = await build_repository.get_latest_build_id(db=db)
+    tag = etag("builds", latest_id, limit, after, branch, date)
+    if etag_matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers={"ETag": tag})
+
+    # Fetch one extra row to know whether there is a next page
+    builds = await build_repository.get_build_summaries(limit + 1, after=after, branch=branch, build_date=date, db=db)
     
     if isinstance(builds, dict) and "error" in builds:
         return HTMLResponse(content=error_page(builds["error"]), status_code=500)
     
     if not builds:
-        return HTMLResponse(content=error_page("No builds found in the database."), status_code=404)
-    
-    html_content = """
-    <html>
-        <head>
-            <title>CI Build History</title>
-            <style>
-                body { font-family: Arial, sans-serif; margin: 40px; }
-                .build-list { list-style: none; padding: 0; }
-                .build-item { 
-                    margin: 10px 0;
-                    padding: 15px;
-                    background-color: #f5f5f5;
-                    border-radius: 5px;
-                }
-                .build-item a {
-                    color: #0066cc;
-                    text-decoration: none;
-                }
-                .build-item a:hover {
-                    text-decoration: underline;
-                }
-                .branch-tag {
-                    display: inline-block;
-                    background-color: #e1e4e8;
-                    padding: 2px 8px;
-                    border-radius: 12px;
-                    font-size: 0.9em;
-                    margin-left: 8px;
-                }
-            </style>
-        </head>
-        <body>
-            <h1>CI Build History</h1>
-            <ul class="build-list">
+        if after is None and not branch and not date:
+            return HTMLResponse(content=error_page("No builds found in the database."), status_code=404)
+        return HTMLResponse(content=error_page("No builds match the given filters."), status_code=404)
+
+    next_url = None
+    if len(builds) > limit:
+        builds = builds[:limit]
+        params = {"limit": limit, "after": builds[-1][0]}
+        if branch:
+            params["branch"] = branch
+        if date:
+            params["date"] = date.isoformat()
+        next_url = f"/builds?{urlencode(params)}"
+
+    # One string: streaming Jinja's many small chunks costs a threadpool hop each
+    return HTMLResponse(
+        content=render("build_list.html", builds=builds, next_url=next_url),
+        headers={"ETag": tag, "Cache-Control": "no-cache"}
+    )
+
+@router.get("/builds/queue")
+async def get_queue():
+    """Show the queued, running and recently finished build jobs"""
+    return build_queue.snapshot()
+
+@router.get("/builds/stats", response_class=HTMLResponse)
+async def get_stats(request: Request, days: int = Query(DEFAULT_STATS_DAYS, ge=1, le=MAX_STATS_DAYS),
+                    branch: str | None = None, format: str = "html", db: Session = Depends(get_db)):
     """
-    
-    for build in builds:
-        build_id = build[0]
-        commit_hash = build[1]
-        branch = build[2]
-        date = build[3]
-        html_content += f"""
-                <li class="build-item">
-                    <a href="/builds/{build_id}">
-                        Build #{build_id} - Commit: {commit_hash} - Date: {date}
-                    </a>
-                    <span class="branch-tag">{branch}</span>
-                </li>
-        """
-    
-    html_content += """
-            </ul>
-        </body>
-    </html>
+    Stage and test durations of the last days: p50/p95 per stage and day,
+    the slowest tests, and the slowest tests per branch. format=json returns
+    the same data for scripts.
     """
-    return html_content
+    # The window moves at midnight (UTC, like built_at) even when no build was added
+    today = utcnow().date()
+    latest_id = await build_repository.get_latest_build_id(db=db)
+    tag = etag("stats", latest_id, days, branch, format, today)
+    if etag_matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers={"ETag": tag})
+
+    since = (today - datetime.timedelta(days=days - 1)).isoformat()
+    stage_rows = await build_repository.get_stage_durations(since=since, branch=branch, db=db)
+    test_rows = await build_repository.get_test_timings(since=since, branch=branch, db=db)
+    stats = {
+        "since": since,
+        "branch": branch,
+        "stages": build_stats.stage_trends(stage_rows),
+        "slowest_tests": build_stats.slowest_tests(test_rows),
+        "slowest_by_branch": build_stats.slowest_by_branch(test_rows),
+    }
+    headers = {"ETag": tag, "Cache-Control": "no-cache"}
+    if format == "json":
+        return JSONResponse(stats, headers=headers)
+    return HTMLResponse(content=render("build_stats.html", days=days, **stats), headers=headers)
 
 @router.get("/builds/{build_id}", response_class=HTMLResponse)
-async def get_build(build_id: str):
+async def get_build(build_id: str, request: Request, db: Session = Depends(get_db)):
+    """Detail page of a recorded build, rendered once and then served from the page cache"""
     try:
         build_id_int = int(build_id)
     except ValueError:
@@ -124,8 +123,16 @@ async def get_build(build_id: str):
             content=error_page("Invalid build ID format. Must be a number."),
             status_code=400
         )
+
+    # A recorded build never changes
+    tag = etag("build", build_id_int)
+    if etag_matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers={"ETag": tag})
+    page = build_pages.get(build_id_int)
+    if page is not None:
+        return page_response(page, request)
     
-    build = get_entry_by_id(build_id_int)
+    build = await build_repository.get_entry_by_id(build_id_int, db=db)
     
     if isinstance(build, dict) and "error" in build:
         return HTMLResponse(content=error_page(build["error"]), status_code=500)
@@ -137,107 +144,89 @@ async def get_build(build_id: str):
         )
     
     build = build[0]
-    commit_hash = build[1]
-    branch = build[2]
-    date = build[3]
-    test_syntax_result = build[4]
-    test_notifier_result = build[5]
-    test_CI_result = build[6]
-    test_syntax_log = build[7]
-    test_notifier_log = build[8]
-    test_CI_log = build[9]
-    
-    html_content = f"""
-    <html>
-        <head>
-            <title>Build #{build_id} Details</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 40px; }}
-                .back-link {{ margin-bottom: 20px; }}
-                .back-link a {{ color: #0066cc; text-decoration: none; }}
-                .back-link a:hover {{ text-decoration: underline; }}
-                .build-details {{ 
-                    background-color: #f5f5f5;
-                    padding: 20px;
-                    border-radius: 5px;
-                    margin-bottom: 20px;
-                }}
-                .branch-tag {{
-                    display: inline-block;
-                    background-color: #e1e4e8;
-                    padding: 2px 8px;
-                    border-radius: 12px;
-                    font-size: 0.9em;
-                    margin-left: 8px;
-                }}
-                .test-section {{
-                    margin-top: 20px;
-                    padding: 15px;
-                    border-radius: 5px;
-                }}
-                .test-section.success {{
-                    background-color: #e8f5e9;
-                    border: 1px solid #c8e6c9;
-                }}
-                .test-section.failure {{
-                    background-color: #ffebee;
-                    border: 1px solid #ffcdd2;
-                }}
-                .test-section.error {{
-                    background-color: #fff3e0;
-                    border: 1px solid #ffe0b2;
-                }}
-                .test-log {{
-                    background-color: #2b2b2b;
-                    color: #ffffff;
-                    padding: 15px;
-                    border-radius: 5px;
-                    white-space: pre-wrap;
-                    font-family: monospace;
-                    margin-top: 10px;
-                    max-height: 400px;
-                    overflow-y: auto;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="back-link">
-                <a href="/builds">← Back to Build List</a>
-            </div>
-            <div class="build-details">
-                <h1>Build #{build_id}</h1>
-                <p>
-                    <strong>Commit Hash:</strong> {commit_hash}
-                    <span class="branch-tag">{branch}</span>
-                </p>
-                <p><strong>Build Date:</strong> {date}</p>
-            </div>
-            
-            <div class="test-section {test_syntax_result}">
-                <h2>Syntax Test Results</h2>
-                <p><strong>Status:</strong> {test_syntax_result}</p>
-                <div class="test-log">
-                    {test_syntax_log}
-                </div>
-            </div>
-            
-            <div class="test-section {test_notifier_result}">
-                <h2>Notifier Test Results</h2>
-                <p><strong>Status:</strong> {test_notifier_result}</p>
-                <div class="test-log">
-                    {test_notifier_log}
-                </div>
-            </div>
-            
-            <div class="test-section {test_CI_result}">
-                <h2>CI Test Results</h2>
-                <p><strong>Status:</strong> {test_CI_result}</p>
-                <div class="test-log">
-                    {test_CI_log}
-                </div>
-            </div>
-        </body>
-    </html>
+    # Only the head and tail of each log go into the page, the rest is on the raw log endpoint
+    stages = [
+        {"title": STAGE_TITLES.get(stage["stage"], stage["stage"]), "result": stage["status"],
+         "description": stage["description"], "log": log_view.excerpt(stage["log"]),
+         "log_url": f"/builds/{build_id_int}/log/{quote(stage['stage'], safe='')}"}
+        for stage in build[4]
+    ]
+    html_content = render(
+        "build_detail.html",
+        build_id=build_id_int,
+        commit_hash=build[1],
+        branch=build[2],
+        date=build[3],
+        attempt=build[5],
+        stages=stages
+    )
+    # Compressing megabytes of logs would hold up the event loop
+    page = await asyncio.to_thread(CachedPage, html_content, tag)
+    build_pages.put(build_id_int, page)
+    return page_response(page, request)
+
+async def follow_sink(sink: LogSink):
+    """Server-sent events for a live log, ending once the stage has finished"""
+    cursor = 0
+    while True:
+        closed = sink.closed
+        lines, cursor, skipped = sink.read(cursor)
+        if skipped:
+            yield f"data: [... {skipped} lines skipped ...]\n\n"
+        for line in lines:
+            yield f"data: {line}\n\n"
+        if closed:
+            yield "event: end\ndata: \n\n"
+            return
+        await asyncio.sleep(LOG_POLL_INTERVAL)
+
+@router.get("/builds/{build_id}/log/{stage}")
+async def get_build_log(build_id: str, stage: str, request: Request, db: Session = Depends(get_db)):
+    """
+    Stream a stage's output while the build runs (build_id is the queue job id),
+    or return the stored log of a finished build. A stored log is sent still
+    gzip-compressed to clients that accept it, and a Range header gets just
+    the requested bytes.
     """
-    return html_content
+    sink = get_sink(build_id, stage)
+    if sink is not None:
+        return StreamingResponse(follow_sink(sink), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"})
 
+    try:
+        build_id_int = int(build_id)
+    except ValueError:
+        return PlainTextResponse(f"No running build {build_id}.", status_code=404)
+    if not await build_repository.build_exists(build_id_int, db=db):
+        return PlainTextResponse(f"Build #{build_id} not found.", status_code=404)
+    stored = await build_repository.get_stage_log(build_id_int, stage, db=db)
+    if stored is None:
+        return PlainTextResponse(f"Unknown stage: {stage}", status_code=404)
+
+    compression, content = stored
+    # The gzip blob and the log itself are different bodies, each with its own validator
+    identity_tag = etag("log", build_id_int, stage, "identity")
+    range_header = request.headers.get("range")
+    if request.headers.get("if-range") not in (None, identity_tag):
+        range_header = None
+    accepted = accepted_encodings(request.headers.get("accept-encoding"))
+    send_gzip = range_header is None and compression == "gzip" and accepted.get("gzip", accepted.get("*", 0)) > 0
+    tag = etag("log", build_id_int, stage, "gzip") if send_gzip else identity_tag
+    headers = {"ETag": tag, "Accept-Ranges": "bytes", "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+    if send_gzip:
+        return Response(content, media_type="text/plain; charset=utf-8",
+                        headers={**headers, "Content-Encoding": "gzip"})
+
+    # Ranges are byte offsets into the log itself, not into its compressed form
+    body = await asyncio.to_thread(log_bytes, content, compression)
+    try:
+        byte_range = log_view.parse_range(range_header, len(body))
+    except log_view.RangeNotSatisfiable:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{len(body)}"})
+    if byte_range is None:
+        return Response(body, media_type="text/plain; charset=utf-8", headers=headers)
+    first, last = byte_range
+    return Response(body[first:last + 1], status_code=206, media_type="text/plain; charset=utf-8",
+                    headers={**headers, "Content-Range": f"bytes {first}-{last}/{len(body)}"})
@@ -1,11 +1,26 @@
-from fastapi import APIRouter, Request, HTTPException
+from fastapi import APIRouter, Header, Request, Response, HTTPException
+import logging
 import os
-import sys
 import subprocess
 import shutil
-sys.path.append('app/lib')
-from util import clone_repo, update_commit_status, delete_repo
-from database_api import create_new_entry
+import time
+from functools import partial
+from app.lib.util import clone_repo, delete_repo, changed_python_files
+from app.lib.syntax_check import syntax_checker
+from app.lib.database_api import create_new_entry, log_lines
+from app.lib.build_queue import ACTIVE, build_queue, new_job_id
+from app.lib.async_db import build_repository
+from app.lib.cancel import BuildCancelled, check_cancelled, current_token
+from app.lib.build_context import BuildContext, build_scope
+from app.lib.stage_executor import SKIPPED, run_stages
+from app.lib.status_client import get_status_client
+from app.lib.live_log import LogSink, OutputSpool, open_sink
+from app.lib.pytest_pool import PytestUnavailable, get_pool, pool_enabled, run_pytest, run_process
+from app.lib.pipeline import PIPELINE_FILE, PipelineError, Stage, load_pipeline
+from app.lib.sharding import DURATION_FLAGS, DURATION_LINE, parse_durations, run_sharded
+from app.lib import result_cache
+from app.lib.metrics import STAGE_SECONDS, WEBHOOKS
+from app.lib.log import log_context
 from typing import Dict, Any
 from pydantic import BaseModel
 from dotenv import load_dotenv
@@ -14,6 +29,16 @@ from dotenv import load_dotenv
 load_dotenv()
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Commit status context for the build as a whole, before stages are known
+BUILD_CONTEXT = "CI/build"
+# A build's result, kept in the queue's job history, holds this much of a stage's error
+MAX_STEP_ERROR_CHARS = 2000
+
+# How a stage's command ended, and the commit status each outcome is reported as
+PASSED, FAILED, ERROR = "passed", "failed", "error"
+OUTCOME_STATUSES = {PASSED: "success", FAILED: "failure", ERROR: "error"}
 
 class WebhookPayload(BaseModel):
     ref: str
@@ -31,99 +56,156 @@ class WebhookPayload(BaseModel):
     sender: Dict[str, Any] | None = None
     organization: Dict[str, Any] | None = None
 
-def run_test_file(repo_path: str, test_file: str) -> Dict[str, Any]:
-    """Run a specific test file and return the results"""
+def run_stage_command(repo_path: str, stage: Stage, log_sink: LogSink | None = None,
+                      history_key: str | None = None, timeout: float | None = None) -> Dict[str, Any]:
+    """
+    Run a pipeline stage's command in the checkout and return the results.
+    pytest commands run on a warm worker (or several, if the stage is
+    sharded), anything else as a subprocess. Sharded stages are balanced
+    by the test timings recorded for history_key. Output is streamed line
+    by line into log_sink while the command runs. timeout defaults to the
+    stage's own.
+
+    The result's "outcome" is PASSED or FAILED when the code decided it,
+    and ERROR when the stage could not run to a verdict (a timeout, a kill,
+    a missing tool or checkout); only the first two are reused by the
+    result cache. The result's "output" is only the bounded window log_sink
+    keeps; the complete output, followed by the error, is returned
+    gzip-compressed as "compressed_log", so a stage's memory does not grow
+    with its output.
+    """
+    # The sink only keeps a window for live viewers, the spool keeps all of it
+    stdout_sink = log_sink or LogSink()
+    spool = OutputSpool()
     try:
-        # Get just the filename without the tests/ prefix
-        test_filename = os.path.basename(test_file)
-        test_path = os.path.join("tests", test_filename)
-        abs_test_path = os.path.join(repo_path, test_path)
-        
-        print(f"\nDEBUG: Testing file {test_file}")
-        print(f"DEBUG: Absolute test path: {abs_test_path}")
-        
-        if not os.path.exists(abs_test_path):
-            print(f"DEBUG: Test file not found at {abs_test_path}")
+        result = _run_command(repo_path, stage, stdout_sink, spool, history_key,
+                              stage.timeout if timeout is None else timeout)
+        # Also what a timed out or failing stage printed before it stopped
+        result["output"] = stdout_sink.text()
+        result["compressed_log"] = spool.compressed(trailer=result["error"])
+        return result
+    finally:
+        stdout_sink.close()
+        spool.close()
+
+def _run_command(repo_path: str, stage: Stage, stdout_sink: LogSink, spool: OutputSpool,
+                 history_key: str | None, timeout: float) -> Dict[str, Any]:
+    """run_stage_command without the output, which is left in stdout_sink and spool"""
+    try:
+        logger.debug("Running stage %s: %s", stage.name, stage.command)
+        if not os.path.isdir(repo_path):
+            logger.warning("Checkout not found at %s", repo_path)
             return {
                 "success": False,
-                "output": "",
-                "error": f"Test file not found: {test_path}"
+                "outcome": ERROR,
+                "error": f"Checkout not found: {repo_path}"
             }
 
-        # First verify pytest is available in the environment
+        # Run from the repo root to ensure proper import paths,
+        # streaming the output into the log sink as it is produced.
+        # A warm worker has already imported pytest, so there is no separate check.
+        markers = {"no tests ran": False, "FAILURES": False}
+        duration_lines = []
+
+        def on_line(line: str) -> None:
+            if "no tests ran" in line.lower():
+                markers["no tests ran"] = True
+            if "FAILURES" in line:
+                markers["FAILURES"] = True
+            if DURATION_LINE.match(line):
+                duration_lines.append(line)
+            stdout_sink.write(line)
+            spool.write(line)
+
+        pytest_args = stage.pytest_args
+        if pytest_args is not None:
+            # Have pytest report every test's duration for the timings table
+            pytest_args = pytest_args + [flag for flag in DURATION_FLAGS if flag not in pytest_args]
         try:
-            pytest_version = subprocess.run(['python3', '-m', 'pytest', '--version'], 
-                         capture_output=True, 
-                         text=True,
-                         check=True)
-            print(f"DEBUG: pytest version: {pytest_version.stdout}")
-        except subprocess.CalledProcessError:
-            print("DEBUG: pytest is not available in the environment")
+            if pytest_args is not None and stage.shards > 1:
+                returncode, stderr = run_sharded(repo_path, pytest_args, stage.shards, on_line,
+                                                 timeout=timeout, history_key=history_key)
+            elif pytest_args is not None:
+                returncode, stderr = run_pytest(repo_path, pytest_args, on_line, timeout=timeout)
+            else:
+                returncode, stderr = run_process(stage.argv, repo_path, on_line, timeout=timeout)
+        except PytestUnavailable as e:
+            logger.warning("pytest unavailable: %s", e)
             return {
                 "success": False,
-                "output": "",
+                "outcome": ERROR,
                 "error": "pytest is not available in the environment"
             }
-
-        print(f"DEBUG: Running pytest from directory: {repo_path}")
-        # Run the test from the repo root to ensure proper import paths
-        result = subprocess.run(
-            ['python3', '-m', 'pytest', test_path, '-v'],
-            cwd=repo_path,
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
         
-        print(f"DEBUG: Test return code: {result.returncode}")
-        print(f"DEBUG: Test stdout: {result.stdout}")
-        print(f"DEBUG: Test stderr: {result.stderr}")
+        logger.debug("Stage command exited", extra={"returncode": returncode,
+                                                    "output_lines": stdout_sink.total_lines,
+                                                    "output_bytes": stdout_sink.total_bytes})
+        tests = parse_durations(duration_lines)
         
         # Check if the test actually ran or if it was collected but not run
-        if "no tests ran" in result.stdout.lower():
+        if pytest_args is not None and markers["no tests ran"]:
             return {
                 "success": False,
-                "output": result.stdout,
+                "outcome": FAILED,
                 "error": "No tests were actually executed"
             }
         
         # Check for test failures vs execution failures
-        if result.returncode != 0:
-            if "FAILURES" in result.stdout:
-                # This is a legitimate test failure, which should be reported as such
+        if returncode < 0:
+            # Killed by a signal, e.g. because the build was cancelled
+            return {
+                "success": False,
+                "outcome": ERROR,
+                "error": f"Command was killed by signal {-returncode}"
+            }
+        if returncode != 0:
+            if pytest_args is None or (returncode == 1 and markers["FAILURES"]):
+                # This is a legitimate failure, which should be reported as such
                 return {
                     "success": False,
-                    "output": result.stdout,
-                    "error": "Tests failed"
+                    "outcome": FAILED,
+                    "error": "Tests failed" if pytest_args is not None else f"Command exited with {returncode}",
+                    "tests": tests
                 }
             else:
                 # This is an execution error
                 return {
                     "success": False,
-                    "output": result.stdout,
-                    "error": f"Test execution error: {result.stderr}"
+                    "outcome": ERROR,
+                    "error": f"Test execution error: {stderr}"
                 }
             
         return {
             "success": True,
-            "output": result.stdout,
-            "error": result.stderr
+            "outcome": PASSED,
+            "error": stderr,
+            "tests": tests
         }
     except subprocess.TimeoutExpired:
-        print("DEBUG: Test execution timed out after 30 seconds")
+        logger.warning("Stage timed out after %s seconds", timeout)
         return {
             "success": False,
-            "output": "",
-            "error": "Test execution timed out after 30 seconds"
+            "outcome": ERROR,
+            "error": f"Test execution timed out after {round(timeout)} seconds"
         }
     except Exception as e:
-        print(f"DEBUG: Unexpected error running tests: {str(e)}")
+        logger.exception("Unexpected error running stage")
         return {
             "success": False,
-            "output": "",
+            "outcome": ERROR,
             "error": f"Error running tests: {str(e)}"
         }
 
+def step_summary(stage_result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    What a build's result keeps of a finished stage: its outcome and the
+    bounded window of its output. The complete log only goes to the database.
+    """
+    summary = {key: value for key, value in stage_result.items() if key not in ("compressed_log", "tests")}
+    if "error" in summary:
+        summary["error"] = summary["error"][:MAX_STEP_ERROR_CHARS]
+    return summary
+
 def ensure_clean_clone_dir(repo_dir_name: str) -> None:
     """Ensure the clone directory is clean before cloning"""
     clone_path = os.path.join("./cloned_repo", repo_dir_name)
@@ -131,144 +213,285 @@ def ensure_clean_clone_dir(repo_dir_name: str) -> None:
         try:
             shutil.rmtree(clone_path)
         except Exception as e:
-            print(f"Warning: Failed to clean up existing directory: {str(e)}")
+            logger.warning("Failed to clean up existing directory: %s", e)
+
+def post_status(build: BuildContext, state: str, description: str, context: str, target_url: str = "") -> None:
+    """Queue a commit status update for the build's commit on the shared GitHub status client"""
+    try:
+        # GitHub has no skipped state for commit statuses
+        state = "error" if state == SKIPPED else state
+        get_status_client().enqueue(build.repository, build.commit_sha, state, description, context, target_url)
+    except Exception as e:
+        logger.error("Failed to queue status for %s: %s", context, e)
 
-@router.post("/webhook")
-async def notify(payload: WebhookPayload):
-    repo_dir_name = None
+def duplicate(response: Response, reason: str, **ids) -> Dict[str, Any]:
+    WEBHOOKS.labels("duplicate").inc()
+    response.status_code = 200
+    return {**ids, "status": "duplicate", "reason": reason}
+
+@router.post("/webhook", status_code=202)
+async def notify(payload: WebhookPayload, response: Response, rebuild: bool = False,
+                 x_github_delivery: str | None = Header(None)):
+    """
+    Validate a push event and queue a build for it.
+    A redelivery (same X-GitHub-Delivery id) or a push of a commit that is
+    being built, or was built already, is not built again; rebuild=true
+    (or "[ci no-cache]" in the commit message) skips the result cache and
+    builds an already built commit anyway, recorded as its next attempt. The new build supersedes the
+    builds of older commits on the same branch.
+    """
     try:
         repo_url = payload.repository["clone_url"]
         identifier = payload.repository["pushed_at"]
         branch = payload.ref.replace("refs/heads/", "")
         owner, name = payload.repository["full_name"].split("/")
-        os.environ["REPO_OWNER"] = owner
-        os.environ["REPO_NAME"] = name
+        commit_sha = payload.head_commit["id"]
     except Exception as e:
+        WEBHOOKS.labels("rejected").inc()
         raise HTTPException(status_code=400, detail=f"Error processing payload: {str(e)}")
 
-    print(f"Push event to {repo_url} on branch {branch}")
-    commit_sha = payload.head_commit["id"]
+    repository = f"{owner}/{name}"
+    if x_github_delivery:
+        job = build_queue.find(delivery=x_github_delivery)
+        if job:
+            return duplicate(response, "delivery", job_id=job.id)
+    job = build_queue.find(ACTIVE, repository=repository, commit=commit_sha)
+    if job:
+        return duplicate(response, "commit", job_id=job.id)
+    if not rebuild:
+        built = await build_repository.get_entry_by_commit(commit_sha, repository=repository)
+        if built:
+            return duplicate(response, "commit", build_id=built[0][0])
 
-    test_contexts = ["CI/test_syntax", "CI/test_notifier", "CI/test_CI"]
-    # Initial status set to pending
-    for context in test_contexts:
-        try:
-            update_commit_status(commit_sha, "pending", "Setting up CI environment", context)
-        except Exception as e:
-            print(f"Failed to set initial status for {context}: {str(e)}")
+    job_id = new_job_id()
+    logger.info("Push event to %s on branch %s, queueing build", repo_url, branch,
+                extra={"build": job_id, "commit": commit_sha})
+    use_cache = not rebuild and result_cache.NO_CACHE_MARKER not in (payload.head_commit.get("message") or "")
+    build_queue.submit(run_build, payload, job_id, use_cache, job_id=job_id, group=f"{repository}:{branch}", info={
+        "repository": repository,
+        "branch": branch,
+        "commit": commit_sha,
+        "pushed_at": identifier,
+        "delivery": x_github_delivery
+    })
+    WEBHOOKS.labels("queued").inc()
+    return {"job_id": job_id, "status": "queued"}
+
+def run_build(payload: WebhookPayload, build_key: str, use_cache: bool = True) -> Dict[str, Any]:
+    """
+    Clone the pushed commit, run its pipeline and record the results.
+    Live stage output is published under build_key (the queue job id).
+    Stages whose inputs match an earlier run reuse its result unless use_cache is False.
+    """
+    build = BuildContext.from_payload(payload, build_key, use_cache, token=current_token())
+    with build_scope(build):
+        return build_pipeline(build)
+
+def build_pipeline(build: BuildContext) -> Dict[str, Any]:
+    """Run the build described by build; everything it touches is derived from it"""
+    logger.info("Building %s on branch %s", build.clone_url, build.branch)
+    if pool_enabled():
+        # Let the pytest workers start up while the repository is cloned
+        get_pool().warm()
 
-    repo_dir_name = repo_url.split("/")[-1].split(".")[0] + "-" + str(identifier)
-    ensure_clean_clone_dir(repo_dir_name)
+    post_status(build, "pending", "Setting up CI environment", BUILD_CONTEXT)
 
-    print("Attempting to clone repo... with branch: ", branch)
-    clone_success = clone_repo(repo_url, identifier, branch)
+    # The checkout is named after the build, so concurrent builds never share one
+    ensure_clean_clone_dir(build.checkout_name)
+    clone_success = clone_repo(build.clone_url, build.build_key, build.branch, build.commit_sha)
     if not clone_success:
         error_msg = "Repository clone failed"
-        for context in test_contexts:
-            try:
-                update_commit_status(commit_sha, "error", error_msg, context)
-            except Exception as e:
-                print(f"Failed to update clone failure status: {str(e)}")
+        logger.error(error_msg)
+        post_status(build, "error", error_msg, BUILD_CONTEXT)
+        return {"message": error_msg, "status": "error"}
+
+    logger.info("Repository checked out")
+    repo_path = build.repo_path
+    reason = build.cancelled_reason()
+    if reason:
+        post_status(build, "error", reason, BUILD_CONTEXT)
+        delete_repo(build.checkout_name)
+        raise BuildCancelled(reason)
+
+    try:
+        stages = load_pipeline(repo_path)
+    except PipelineError as e:
+        error_msg = f"Invalid {PIPELINE_FILE}: {str(e)}"
+        logger.error(error_msg)
+        post_status(build, "error", error_msg[:140], BUILD_CONTEXT)
+        delete_repo(build.checkout_name)
         return {"message": error_msg, "status": "error"}
 
-    print("Repo cloned successfully!")
-    repo_path = f"./cloned_repo/{repo_dir_name}"
+    # Initial status set to pending
+    for stage in stages:
+        post_status(build, "pending", "Waiting to run", f"CI/{stage.name}")
+    post_status(build, "success", f"Pipeline with {len(stages)} stage(s)", BUILD_CONTEXT)
     
     result = {
         "status": "ok",
-        "steps": {
-            "test_syntax": {"status": "pending", "description": "Not started"},
-            "test_notifier": {"status": "pending", "description": "Not started"},
-            "test_CI": {"status": "pending", "description": "Not started"}
-        }
+        "steps": {stage.name: {"status": "pending", "description": "Not started"} for stage in stages}
     }
+    changed_files = changed_python_files(build.commits)
 
-    test_files = [
-        ("test_syntax", "tests/test_syntax.py"),
-        ("test_notifier", "tests/test_notifier.py"),
-        ("test_CI", "tests/test_CI.py")
-    ]
+    def precheck_syntax(stage: Stage, log_sink: LogSink) -> Dict[str, Any] | None:
+        # Compile the pushed Python files first, a failure here makes pytest pointless
+        paths = [os.path.join(repo_path, path) for path in changed_files
+                 if os.path.isfile(os.path.join(repo_path, path))]
+        errors = [error for error in syntax_checker.check_files(paths).values() if error]
+        log_sink.write(f"Compiled {len(paths)} changed Python file(s)")
+        if not errors:
+            return None
+        for error in errors:
+            log_sink.write(f"Syntax error: {error.replace(repo_path + os.sep, '', 1)}")
+        output = log_sink.text()
+        return {
+            "status": "failure",
+            "description": f"{stage.name} failed: {len(errors)} file(s) with syntax errors"[:140],
+            "output": output,
+            "error": "Syntax errors found"
+        }
 
-    try:
-        test_results = {}
-        for test_name, test_file in test_files:
-            print(f"\n=== Starting {test_name} ===")
-            
+    def run_stage(stage: Stage) -> Dict[str, Any]:
+        check_cancelled()
+        with log_context(stage=stage.name):
+            logger.info("Starting stage")
+            return execute_stage(stage)
+
+    def execute_stage(stage: Stage) -> Dict[str, Any]:
+        log_sink = open_sink(build.build_key, stage.name)
+        if stage.syntax_check and changed_files:
             try:
-                test_result = run_test_file(repo_path, test_file)
-                status = "success" if test_result["success"] else "failure"
-                description = (f"{test_name} passed" if test_result["success"] 
-                             else f"{test_name} failed: {test_result.get('error', '')[:140]}")
-                
-                print(f"DEBUG: {test_name} results:")
-                print(f"DEBUG: Status: {status}")
-                print(f"DEBUG: Description: {description}")
-                
-                test_results[test_name] = {
-                    "status": status,
-                    "description": description,
-                    "output": test_result.get("output", ""),
-                    "error": test_result.get("error", "")
-                }
-                
-                result["steps"][test_name] = test_results[test_name]
+                failed = precheck_syntax(stage, log_sink)
             except Exception as e:
-                error_msg = f"Test execution error: {str(e)}"
-                print(f"DEBUG: Error in {test_name}: {error_msg}")
-                test_results[test_name] = {
-                    "status": "error",
-                    "description": error_msg,
-                    "output": "",
-                    "error": str(e)
-                }
-                result["steps"][test_name] = test_results[test_name]
+                logger.warning("Syntax pre-check skipped: %s", e)
+                failed = None
+            if failed:
+                log_sink.close()
+                return failed
+        cache_key = result_cache.stage_cache_key(f"{stage.name}:{stage.command}", repo_path, stage.paths)
+        cached = result_cache.lookup(cache_key) if build.use_cache else None
+        if cached:
+            logger.info("Reusing cached result of commit %s", cached["commit_hash"])
+            log_sink.write(f"Reusing the result of commit {cached['commit_hash']}, which had identical inputs")
+            for line in log_lines(cached["compressed_log"]):
+                log_sink.write(line)
+            log_sink.close()
+            return {
+                "status": cached["status"],
+                "description": f"(cached) {cached['description']}"[:140],
+                "output": log_sink.text(),
+                "error": cached["error"],
+                "compressed_log": cached["compressed_log"],
+                "cached": True
+            }
+        started = time.monotonic()
+        try:
+            test_result = run_stage_command(repo_path, stage, log_sink, history_key=build.repository,
+                                            timeout=build.timeout_for(stage.timeout))
+            status = OUTCOME_STATUSES[test_result["outcome"]]
+            if status == "success":
+                description = f"{stage.name} passed"
+            elif status == "failure":
+                description = f"{stage.name} failed: {test_result.get('error', '')[:140]}"
+            else:
+                description = f"{stage.name} could not finish: {test_result.get('error', '')[:140]}"
+            
+            duration = time.monotonic() - started
+            logger.info("Stage finished: %s", description,
+                        extra={"status": status, "duration": round(duration, 3)})
+            STAGE_SECONDS.labels(stage.name, status).observe(duration)
+            stage_result = {
+                "status": status,
+                "description": description,
+                "output": test_result.get("output", ""),
+                "error": test_result.get("error", ""),
+                "compressed_log": test_result.get("compressed_log"),
+                "duration": duration,
+                "tests": test_result.get("tests", {})
+            }
+            # A superseded build's stage was stopped, whatever it returned says nothing about the code
+            if not build.cancelled_reason():
+                result_cache.store(cache_key, stage.name, build.commit_sha, stage_result)
+            return stage_result
+        except Exception as e:
+            error_msg = f"Test execution error: {str(e)}"
+            logger.exception("Stage failed to run")
+            return {
+                "status": "error",
+                "description": error_msg,
+                "output": "",
+                "error": str(e)
+            }
+        finally:
+            log_sink.close()
+
+    def report_stage(test_name: str, stage_result: Dict[str, Any]) -> None:
+        # Publish each stage's outcome as soon as it finishes
+        result["steps"][test_name] = step_summary(stage_result)
+        if build.cancelled_reason():
+            return
+        post_status(build, stage_result["status"], stage_result["description"], f"CI/{test_name}")
+
+    try:
+        test_results = run_stages(
+            [(stage.name, partial(run_stage, stage)) for stage in stages],
+            on_complete=report_stage,
+            needs={stage.name: stage.needs for stage in stages}
+        )
+        reason = build.cancelled_reason()
+        if reason:
+            # The results of a superseded build are incomplete, so they are not stored
+            logger.info("Build superseded: %s", reason)
+            for name in test_results:
+                post_status(build, "error", reason, f"CI/{name}")
+            raise BuildCancelled(reason)
 
         # Store results in database
         try:
-            build_id = create_new_entry(
-                commit_hash=commit_sha,
-                branch=branch,
-                test_syntax_result=test_results["test_syntax"]["status"],
-                test_notifier_result=test_results["test_notifier"]["status"],
-                test_CI_result=test_results["test_CI"]["status"],
-                test_syntax_log=test_results["test_syntax"]["output"] + "\n" + test_results["test_syntax"].get("error", ""),
-                test_notifier_log=test_results["test_notifier"]["output"] + "\n" + test_results["test_notifier"].get("error", ""),
-                test_CI_log=test_results["test_CI"]["output"] + "\n" + test_results["test_CI"].get("error", "")
+            build.build_id = create_new_entry(
+                commit_hash=build.commit_sha,
+                branch=build.branch,
+                repository=build.repository,
+                stages=[{
+                    "stage": name,
+                    "status": stage_result["status"],
+                    "description": stage_result["description"],
+                    "log": stage_result.get("output", "") + "\n" + stage_result.get("error", ""),
+                    "compressed_log": stage_result.get("compressed_log"),
+                    "duration": stage_result.get("duration"),
+                    "tests": stage_result.get("tests")
+                } for name, stage_result in test_results.items()]
             )
             
             # Update GitHub status with links to build details
             for test_name in test_results:
                 status = test_results[test_name]["status"]
                 description = test_results[test_name]["description"]
-                update_commit_status(
-                    commit_sha, 
+                post_status(
+                    build,
                     status, 
                     description, 
                     f"CI/{test_name}",
-                    target_url=f"/builds/{build_id}"
+                    target_url=f"/builds/{build.build_id}"
                 )
         except Exception as e:
-            print(f"Failed to store build results: {str(e)}")
-            # Still update GitHub status but without build links
-            for test_name in test_results:
-                status = test_results[test_name]["status"]
-                description = test_results[test_name]["description"]
-                update_commit_status(commit_sha, status, description, f"CI/{test_name}")
+            # Each stage's status was already published without a build link
+            logger.exception("Failed to store build results")
 
+    except BuildCancelled:
+        raise
     except Exception as e:
         error_msg = f"CI process error: {str(e)}"
-        print(error_msg)
+        logger.exception(error_msg)
         # Update any remaining pending statuses to error
         for step_name in result["steps"]:
             if result["steps"][step_name]["status"] == "pending":
-                update_commit_status(commit_sha, "error", error_msg, f"CI/{step_name}")
+                post_status(build, "error", error_msg, f"CI/{step_name}")
                 result["steps"][step_name] = {
                     "status": "error",
                     "description": error_msg
                 }
     finally:
-        if repo_dir_name:
-            delete_repo(repo_dir_name)
+        delete_repo(build.checkout_name)
 
     return result
-
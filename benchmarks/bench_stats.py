@@ -0,0 +1,26 @@
+'''
+Latency summaries shared by the benchmark scripts.
+
+Percentiles are nearest-rank, the same as on the /builds/stats page, so a
+benchmark's p95 and the server's agree on what p95 means.
+'''
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.lib.build_stats import percentile
+
+
+def summary(samples, count_key="count", digits=2):
+    """Count, p50, p95, min, max and mean of samples in seconds, as milliseconds"""
+    if not samples:
+        return {count_key: 0}
+    return {
+        count_key: len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, digits),
+        "p95_ms": round(percentile(samples, 95) * 1000, digits),
+        "min_ms": round(min(samples) * 1000, digits),
+        "max_ms": round(max(samples) * 1000, digits),
+        "mean_ms": round(statistics.mean(samples) * 1000, digits),
+    }
@@ -0,0 +1,103 @@
+'''
+Load test for the build list while builds are being recorded.
+
+Serves the app in-process, hammers GET /builds with concurrent clients, and
+compares latency with an idle database against latency while a writer thread
+keeps recording builds with large logs. Prints the results as JSON, with
+how many times slower p50 and p95 are while recording; with --max-slowdown
+the script exits with status 1 if either is slower than that.
+
+    python benchmarks/builds_latency.py [--seconds 5] [--clients 8] [--history 2000] [--max-slowdown 2]
+'''
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import httpx
+from app.main import app
+from app.lib import database_api
+from bench_stats import summary
+
+
+async def measure(seconds, clients):
+    latencies = []
+    deadline = time.monotonic() + seconds
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            while time.monotonic() < deadline:
+                start = time.monotonic()
+                response = await client.get("/builds?limit=50")
+                response.raise_for_status()
+                latencies.append(time.monotonic() - start)
+        await asyncio.gather(*(worker() for _ in range(clients)))
+    return latencies
+
+
+def stage_results(log, last_status):
+    statuses = ("success", "success", last_status)
+    return [{"stage": stage, "status": status, "log": log}
+            for stage, status in zip(("test_syntax", "test_notifier", "test_CI"), statuses)]
+
+
+def record_builds(stop, counter, log):
+    while not stop.is_set():
+        counter[0] += 1
+        database_api.create_new_entry(f"bench-{counter[0]}-{time.time_ns()}", "main", stage_results(log, "failure"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--history", type=int, default=2000)
+    parser.add_argument("--max-slowdown", type=float, help="allowed recording/idle latency ratio")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    engine = database_api.make_engine(f"sqlite:///{tmp}/CI.db")
+    database_api.Base.metadata.create_all(bind=engine)
+    database_api.SessionLocal.configure(bind=engine)
+    log = "tests/test_CI.py::test_webhook PASSED\n" * 5000
+    try:
+        for i in range(args.history):
+            database_api.create_new_entry(f"history-{i}", "main", stage_results(log, "success"))
+
+        idle = asyncio.run(measure(args.seconds, args.clients))
+
+        stop, written = threading.Event(), [0]
+        writer = threading.Thread(target=record_builds, args=(stop, written, log))
+        writer.start()
+        try:
+            busy = asyncio.run(measure(args.seconds, args.clients))
+        finally:
+            stop.set()
+            writer.join()
+
+        idle_summary, busy_summary = summary(idle, "requests"), summary(busy, "requests")
+        slowdown = {f"{key[:-3]}_ratio": round(busy_summary[key] / idle_summary[key], 2) for key in ("p50_ms", "p95_ms")}
+        print(json.dumps({
+            "benchmark": "builds_latency",
+            "history": args.history,
+            "clients": args.clients,
+            "idle": idle_summary,
+            "while_recording": dict(busy_summary, builds_written=written[0]),
+            "slowdown": slowdown,
+        }, indent=2))
+        if args.max_slowdown and max(slowdown.values()) > args.max_slowdown:
+            sys.exit(1)
+    finally:
+        database_api.SessionLocal.configure(bind=database_api.engine)
+        engine.dispose()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
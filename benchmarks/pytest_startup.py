@@ -0,0 +1,97 @@
+'''
+Startup overhead of a test stage, cold subprocess against warm worker.
+
+Runs the same small test file repeatedly, once per run with a fresh
+`python3 -m pytest` (plus the old `pytest --version` check) and once on the
+warm worker pool. The test itself is trivial, so the wall time is almost all
+startup and import overhead. Prints the results as JSON.
+
+    python benchmarks/pytest_startup.py [--runs 10] [--project PATH --test tests/test_x.py]
+'''
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.lib.pytest_pool import PYTHON, PytestPool, run_cold, DEFAULT_PRELOAD
+from bench_stats import summary
+
+SAMPLE_TEST = '''
+import fastapi
+import sqlalchemy
+
+def test_sample():
+    assert fastapi.FastAPI() is not None
+'''
+
+
+def time_cold(project, test, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.monotonic()
+        subprocess.run([PYTHON, '-m', 'pytest', '--version'], capture_output=True, check=True)
+        returncode, _ = run_cold(project, [test, '-v'], lambda line: None, 120)
+        samples.append(time.monotonic() - start)
+        assert returncode == 0, "the benchmark test failed"
+    return samples
+
+
+def time_warm(project, test, runs, max_runs):
+    pool = PytestPool(size=1, max_runs=max_runs, preload=DEFAULT_PRELOAD.split(","))
+    try:
+        start = time.monotonic()
+        pool.warm()
+        # Wait for the first worker, as the server would while cloning
+        worker = pool._acquire()
+        pool._release(worker)
+        warmup = time.monotonic() - start
+        samples = []
+        for _ in range(runs):
+            start = time.monotonic()
+            returncode, _ = pool.run(project, [test, '-v'], lambda line: None, 120)
+            samples.append(time.monotonic() - start)
+            assert returncode == 0, "the benchmark test failed"
+        return samples, warmup, pool.recycled
+    finally:
+        pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-runs", type=int, default=20, help="worker recycling threshold")
+    parser.add_argument("--project", help="checkout to run the test in (default: a generated sample)")
+    parser.add_argument("--test", default="tests/test_sample.py")
+    args = parser.parse_args()
+
+    tmp = None
+    project = args.project
+    if project is None:
+        tmp = tempfile.mkdtemp()
+        project = tmp
+        os.makedirs(os.path.join(tmp, "tests"))
+        with open(os.path.join(tmp, args.test), "w") as f:
+            f.write(SAMPLE_TEST)
+    try:
+        cold = time_cold(project, args.test, args.runs)
+        warm, warmup, recycled = time_warm(project, args.test, args.runs, args.max_runs)
+        cold_summary, warm_summary = summary(cold, "runs", 1), summary(warm, "runs", 1)
+        print(json.dumps({
+            "benchmark": "pytest_startup",
+            "test": args.test,
+            "cold": cold_summary,
+            "warm": dict(warm_summary, worker_startup_ms=round(warmup * 1000, 1), recycled=recycled),
+            "speedup_p50": round(cold_summary["p50_ms"] / warm_summary["p50_ms"], 2),
+        }, indent=2))
+    finally:
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+'''
+Webhook intake and build throughput.
+
+Creates a local bare repository with one commit per push (on its own branch
+by default), serves the app in-process against a fake GitHub status API,
+and replays bursts of push events to POST /webhook. Builds really clone
+(through the mirror cache) and run the repository's pipeline. Reports the
+intake latency, end-to-end build latency, throughput and peak RSS as JSON.
+With --baseline, exits with status 1 if a latency or throughput figure is
+more than --tolerance percent worse than in the baseline file.
+
+    python benchmarks/webhook_throughput.py [--pushes 20] [--burst 10] [--branches 20] [--workers 2]
+                                            [--output result.json] [--baseline old.json]
+'''
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+from bench_stats import summary
+
+# clone_repo only accepts GitHub URLs; git rewrites them to the local repository
+BENCH_URL = "https://github.com/bench/project.git"
+PIPELINE = '''stages:
+  lint:
+    command: python3 -c "import compileall, sys; sys.exit(not compileall.compile_dir('src', quiet=1))"
+  unit:
+    command: python3 -m pytest tests -q
+    needs: [lint]
+'''
+SAMPLE_TEST = '''
+def test_sample():
+    assert sum(range(10)) == 45
+'''
+# Lower is better for latencies, higher for throughput
+REGRESSION_CHECKS = {
+    ("intake", "p95_ms"): "lower",
+    ("build", "p95_ms"): "lower",
+    ("throughput", "builds_per_minute"): "higher",
+}
+
+
+def git(*args, cwd=None):
+    subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True)
+
+
+def make_repository(tmp, pushes, branches):
+    """Bare repository with one new commit per push; returns [(branch, sha)]"""
+    work, bare = os.path.join(tmp, "work"), os.path.join(tmp, "project.git")
+    os.makedirs(os.path.join(work, "src"))
+    os.makedirs(os.path.join(work, "tests"))
+    with open(os.path.join(work, ".ci.yml"), "w") as f:
+        f.write(PIPELINE)
+    with open(os.path.join(work, "tests", "test_sample.py"), "w") as f:
+        f.write(SAMPLE_TEST)
+    git("init", "-q", "-b", "main", cwd=work)
+    commits = []
+    for i in range(pushes):
+        branch = f"bench-{i % branches}"
+        git("checkout", "-q", "-B", branch, cwd=work)
+        # A different tree per push, so no stage result is reused from the cache
+        with open(os.path.join(work, "src", "change.py"), "w") as f:
+            f.write(f"PUSH = {i}\n")
+        git("add", "-A", cwd=work)
+        git("-c", "user.email=bench@example.com", "-c", "user.name=bench", "commit", "-q", "-m", f"push {i}", cwd=work)
+        sha = subprocess.run(["git", "rev-parse", "HEAD"], cwd=work, check=True, capture_output=True,
+                             text=True).stdout.strip()
+        commits.append((branch, sha))
+    git("clone", "-q", "--bare", work, bare)
+    return bare, commits
+
+
+def payload(i, branch, sha):
+    return {
+        "ref": f"refs/heads/{branch}",
+        "repository": {"clone_url": BENCH_URL, "full_name": "bench/project", "pushed_at": str(i)},
+        "head_commit": {"id": sha, "message": f"push {i}"},
+        "commits": [{"id": sha, "added": [], "modified": ["src/change.py"], "removed": []}],
+    }
+
+
+async def replay(app, commits, burst, interval):
+    """Post the pushes in bursts; returns [(job_id, seconds to answer, status code)]"""
+    import httpx
+    transport = httpx.ASGITransport(app=app)
+    posted = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def post(i, branch, sha):
+            start = time.monotonic()
+            response = await client.post("/webhook", json=payload(i, branch, sha),
+                                         headers={"X-GitHub-Delivery": f"bench-{i}"})
+            posted.append((response.json().get("job_id"), time.monotonic() - start, response.status_code))
+
+        for first in range(0, len(commits), burst):
+            await asyncio.gather(*(post(i, branch, sha) for i, (branch, sha)
+                                   in enumerate(commits[first:first + burst], start=first)))
+            if interval and first + burst < len(commits):
+                await asyncio.sleep(interval)
+    return posted
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {"server_mb": round(own / 1024, 1), "largest_child_mb": round(children / 1024, 1)}
+
+
+def regressions(result, baseline, tolerance):
+    found = []
+    for (section, key), better in REGRESSION_CHECKS.items():
+        old, new = baseline.get(section, {}).get(key), result.get(section, {}).get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        if (better == "lower" and change > tolerance) or (better == "higher" and -change > tolerance):
+            found.append({"metric": f"{section}.{key}", "baseline": old, "result": new, "change_pct": round(change, 1)})
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--pushes", type=int, default=20)
+    parser.add_argument("--burst", type=int, default=10, help="pushes sent at once")
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between bursts")
+    parser.add_argument("--branches", type=int, default=None,
+                        help="branches the pushes go to (default one per push; fewer supersede builds)")
+    parser.add_argument("--workers", type=int, default=2, help="CI_BUILD_WORKERS")
+    parser.add_argument("--github-latency", type=float, default=0.0, help="seconds per fake GitHub request")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    parser.add_argument("--baseline", help="JSON result of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=20.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    # The app runs from the temporary directory, so paths given are resolved first
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    output_path = os.path.abspath(args.output) if args.output else None
+    tmp = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    bare, commits = make_repository(tmp, args.pushes, args.branches or args.pushes)
+
+    from app.lib.fake_github import FakeGitHub
+    github = FakeGitHub(latency=args.github_latency).start()
+    os.environ.update({
+        "CI_BUILD_WORKERS": str(args.workers),
+        "CI_MIRROR_DIR": os.path.join(tmp, "mirrors"),
+        "CI_SERVER_AUTH_TOKEN": "bench",
+        "GITHUB_API_URL": github.url,
+        "CI_LOG_LEVEL": os.getenv("CI_LOG_LEVEL", "WARNING"),
+        "GIT_CONFIG_COUNT": "1",
+        "GIT_CONFIG_KEY_0": f"url.file://{bare}.insteadOf",
+        "GIT_CONFIG_VALUE_0": BENCH_URL,
+    })
+    # The app reads its configuration on import, so it is imported after the environment is set
+    os.chdir(tmp)
+    from app.main import app
+    from app.lib import database_api
+    from app.lib.build_queue import build_queue
+    from app.lib.status_client import get_status_client, reset_status_client
+    engine = database_api.make_engine(f"sqlite:///{tmp}/CI.db")
+    database_api.Base.metadata.create_all(bind=engine)
+    database_api.SessionLocal.configure(bind=engine)
+    reset_status_client()
+
+    try:
+        started = time.monotonic()
+        posted = asyncio.run(replay(app, commits, args.burst, args.interval))
+        intake_seconds = time.monotonic() - started
+        jobs = [build_queue.wait(job_id, timeout=args.timeout) for job_id, _, code in posted if code == 202]
+        finished = time.monotonic()
+        get_status_client().flush(timeout=60)
+
+        build_latencies = [(job.finished_at - job.queued_at).total_seconds()
+                           for job in jobs if job is not None and job.finished_at]
+        states = {}
+        for job in jobs:
+            status = job.status if job is not None else "lost"
+            states[status] = states.get(status, 0) + 1
+        built = states.get("finished", 0)
+        result = {
+            "benchmark": "webhook_throughput",
+            "pushes": args.pushes,
+            "burst": args.burst,
+            "branches": args.branches or args.pushes,
+            "workers": args.workers,
+            "intake": dict(summary([seconds for _, seconds, _ in posted]),
+                           accepted=sum(1 for _, _, code in posted if code == 202)),
+            "build": dict(summary(build_latencies), states=states),
+            "throughput": {
+                "intake_per_second": round(len(posted) / intake_seconds, 1),
+                "builds_per_minute": round(built / (finished - started) * 60, 1),
+                "wall_seconds": round(finished - started, 2),
+            },
+            "statuses_sent": len(github.statuses),
+            "peak_rss": peak_rss_mb(),
+        }
+        if baseline:
+            with open(baseline) as f:
+                result["regressions"] = regressions(result, json.load(f), args.tolerance)
+        output = json.dumps(result, indent=2)
+        print(output)
+        if output_path:
+            with open(output_path, "w") as f:
+                f.write(output + "\n")
+        if result.get("regressions"):
+            sys.exit(1)
+    finally:
+        build_queue.shutdown()
+        reset_status_client()
+        github.stop()
+        database_api.SessionLocal.configure(bind=database_api.engine)
+        engine.dispose()
+        os.chdir(cwd)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+Helpers for tests that need a build database: each test gets an empty
+SQLite database in a temp dir that database_api is pointed at.
+"""
+import shutil
+import tempfile
+from app.lib import database_api
+
+DEFAULT_STAGES = ("test_syntax", "test_notifier", "test_CI")
+
+
+def use_temp_database(test):
+    """Point database_api at an empty database in a temp dir for one test"""
+    test.tmp = tempfile.mkdtemp()
+    test.engine = database_api.make_engine(f"sqlite:///{test.tmp}/CI.db")
+    database_api.Base.metadata.create_all(bind=test.engine)
+    database_api.SessionLocal.configure(bind=test.engine)
+
+
+def restore_database(test):
+    database_api.SessionLocal.configure(bind=database_api.engine)
+    test.engine.dispose()
+    shutil.rmtree(test.tmp, ignore_errors=True)
+
+
+def add_build(commit_hash, branch="main", result="success", log="log", stages=DEFAULT_STAGES, repository=""):
+    return database_api.create_new_entry(commit_hash, branch, [
+        {"stage": stage, "status": result, "description": f"{stage} {result}", "log": log} for stage in stages
+    ], repository=repository)
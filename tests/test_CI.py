@@ -3,9 +3,11 @@ import os
 import sys
 import shutil
 import subprocess
+from unittest.mock import patch
 from fastapi.testclient import TestClient
 sys.path.append('app')
 from main import app
+from app.lib.build_queue import build_queue
 
 class TestCITestExecution(unittest.TestCase):
     def setUp(self):
@@ -83,16 +85,15 @@ def test_with_syntax_error()
         }
         
         # Mock the clone_repo function to use our test directory
-        import app.lib.util as util
-        original_clone = util.clone_repo
-        util.clone_repo = lambda *args: True
-        
-        try:
+        with patch("app.routers.notify.clone_repo", return_value=True), \
+             patch("app.routers.notify.get_status_client"), \
+             patch("app.routers.notify.create_new_entry", return_value=1):
             response = self.client.post("/webhook", json=payload)
-            self.assertEqual(response.status_code, 200)
-            # Add more specific assertions based on your response format
-        finally:
-            util.clone_repo = original_clone
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json()["status"], "queued")
+            job = build_queue.wait(response.json()["job_id"], timeout=120)
+            self.assertEqual(job.status, "finished")
+            self.assertEqual(set(job.result["steps"]), {"test_syntax", "test_notifier", "test_CI"})
 
     def test_webhook_with_failing_tests(self):
         """Test webhook handling when tests fail"""
@@ -109,16 +110,15 @@ def test_with_syntax_error()
         }
         
         # Mock the clone_repo function and ensure failing tests are run
-        import app.lib.util as util
-        original_clone = util.clone_repo
-        util.clone_repo = lambda *args: True
-        
-        try:
+        with patch("app.routers.notify.clone_repo", return_value=True), \
+             patch("app.routers.notify.get_status_client"), \
+             patch("app.routers.notify.create_new_entry", return_value=1):
             response = self.client.post("/webhook", json=payload)
-            self.assertEqual(response.status_code, 200)
-            # Add assertions to verify failure is properly handled
-        finally:
-            util.clone_repo = original_clone
+            self.assertEqual(response.status_code, 202)
+            job = build_queue.wait(response.json()["job_id"], timeout=120)
+            # Nothing was cloned, so no stage can run: an error, not a test failure
+            for step in job.result["steps"].values():
+                self.assertEqual(step["status"], "error")
 
     def test_test_execution_error_handling(self):
         """Test proper handling of test execution errors"""
@@ -135,18 +135,23 @@ def test_with_syntax_error()
         }
         
         # Mock clone_repo to simulate a failed clone
-        import app.lib.util as util
-        original_clone = util.clone_repo
-        util.clone_repo = lambda *args: False
-        
-        try:
+        with patch("app.routers.notify.clone_repo", return_value=False), \
+             patch("app.routers.notify.get_status_client"):
             response = self.client.post("/webhook", json=payload)
-            self.assertEqual(response.status_code, 200)
-            self.assertEqual(response.json()["message"], "Repository clone failed")
-            self.assertEqual(response.json()["status"], "error")
-        finally:
-            # Restore original function
-            util.clone_repo = original_clone
+            self.assertEqual(response.status_code, 202)
+            job = build_queue.wait(response.json()["job_id"], timeout=120)
+            self.assertEqual(job.result["message"], "Repository clone failed")
+            self.assertEqual(job.result["status"], "error")
+
+    def test_invalid_payload(self):
+        """Test that a payload missing repository fields is rejected before queueing"""
+        payload = {
+            "ref": "refs/heads/main",
+            "repository": {"clone_url": "https://github.com/test/repo.git"},
+            "head_commit": {"id": "testsha123"}
+        }
+        response = self.client.post("/webhook", json=payload)
+        self.assertEqual(response.status_code, 400)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import sys
+import time
+import asyncio
+from unittest.mock import patch
+import httpx
+sys.path.append('app')
+from main import app
+from app.lib import database_api
+from app.lib.async_db import BuildRepository
+from database_helpers import use_temp_database, restore_database, add_build
+
+
+class TestBuildRepository(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.repository = BuildRepository(max_workers=2)
+
+    def tearDown(self):
+        self.repository.shutdown()
+        restore_database(self)
+
+    async def test_mirrors_database_api(self):
+        build_id = await self.repository.create_new_entry("sha1", "main", [
+            {"stage": "test_syntax", "status": "success", "log": "a"},
+            {"stage": "test_CI", "status": "failure", "log": "c"}
+        ])
+        self.assertTrue(await self.repository.build_exists(build_id))
+        self.assertEqual(await self.repository.get_entry_by_id(build_id), database_api.get_entry_by_id(build_id))
+        self.assertEqual((await self.repository.get_build_logs(build_id))["test_CI"], "c")
+        self.assertEqual(await self.repository.get_stage_results(build_id), database_api.get_stage_results(build_id))
+        self.assertEqual(len(await self.repository.get_build_summaries(10)), 1)
+
+    async def test_slow_query_does_not_block_event_loop(self):
+        # while one /builds request waits on a slow query, other requests are served
+        add_build("sha1")
+        original = database_api.get_build_summaries
+
+        def slow_summaries(*args, **kwargs):
+            time.sleep(0.5)
+            return original(*args, **kwargs)
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async def timed(path):
+                start = time.monotonic()
+                response = await client.get(path)
+                return response.status_code, time.monotonic() - start
+
+            with patch.object(database_api, "get_build_summaries", slow_summaries):
+                slow = asyncio.create_task(timed("/builds"))
+                await asyncio.sleep(0.05)
+                fast_status, fast_time = await timed("/builds/queue")
+                slow_status, slow_time = await slow
+        self.assertEqual((fast_status, slow_status), (200, 200))
+        self.assertLess(fast_time, 0.3)
+        self.assertGreaterEqual(slow_time, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
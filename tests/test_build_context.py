@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import os
+import subprocess
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from app.lib import database_api
+from app.lib.build_context import BuildContext, DeadlineExceeded, build_scope, current_build
+from app.lib.cancel import current_token
+from app.lib.pipeline import PIPELINE_FILE
+from app.routers.notify import WebhookPayload, run_build
+from database_helpers import use_temp_database, restore_database
+
+
+def git(*args, cwd=None):
+    subprocess.run(["git"] + list(args), cwd=cwd, check=True, capture_output=True)
+
+
+def make_context(build_key="job1", timeout=None):
+    return BuildContext(build_key, "alice/app", "https://github.com/alice/app.git", "sha1", "main", timeout=timeout)
+
+
+class TestBuildContext(unittest.TestCase):
+
+    def test_checkout_is_per_build(self):
+        self.assertEqual(make_context("job1").repo_path, "./cloned_repo/app-job1")
+        self.assertNotEqual(make_context("job1").checkout_name, make_context("job2").checkout_name)
+
+    def test_deadline(self):
+        build = make_context(timeout=60)
+        self.assertEqual(build.timeout_for(30), 30)
+        self.assertLessEqual(build.timeout_for(600), 60)
+        build = make_context(timeout=0.01)
+        time.sleep(0.02)
+        with self.assertRaises(DeadlineExceeded):
+            build.timeout_for(30)
+
+    def test_scope_reaches_threads_and_tasks(self):
+        first, second = make_context("job1"), make_context("job2")
+
+        async def task_build():
+            await asyncio.sleep(0)
+            return current_build()
+
+        async def both():
+            # each task keeps the build it was started in
+            with build_scope(first):
+                one = asyncio.create_task(task_build())
+            with build_scope(second):
+                two = asyncio.create_task(task_build())
+            return await one, await two
+
+        self.assertEqual(asyncio.run(both()), (first, second))
+        with build_scope(first):
+            self.assertIs(current_token(), first.token)
+            with ThreadPoolExecutor(1) as executor:
+                seen = executor.submit(contextvars.copy_context().run, current_build).result()
+        self.assertIs(seen, first)
+        self.assertIsNone(current_build())
+
+
+class TestConcurrentBuilds(unittest.TestCase):
+    """Two repositories with the same name, pushed at the same time, built at once"""
+
+    def setUp(self):
+        use_temp_database(self)
+        self.origins = {}
+        for owner, assertion in (("alice", "True"), ("bob", "False")):
+            origin = os.path.join(self.tmp, owner)
+            os.makedirs(os.path.join(origin, "tests"))
+            with open(os.path.join(origin, "tests", "test_unit.py"), "w") as f:
+                f.write(f"def test_it():\n    assert {assertion}\n")
+            with open(os.path.join(origin, PIPELINE_FILE), "w") as f:
+                f.write("stages:\n  unit:\n    command: python3 -m pytest tests/test_unit.py -v\n")
+            git("init", "-q", cwd=origin)
+            git("add", ".", cwd=origin)
+            git("-c", "user.email=ci@example.com", "-c", "user.name=ci", "commit", "-q", "-m", "init", cwd=origin)
+            self.origins[f"https://github.com/{owner}/app.git"] = origin
+        self.both_cloned = threading.Barrier(2, timeout=30)
+        self.statuses = []
+
+    def tearDown(self):
+        restore_database(self)
+
+    def fake_clone(self, repo_url, identifier, branch, commit_sha=None):
+        git("clone", "-q", self.origins[repo_url], f"./cloned_repo/app-{identifier}")
+        # neither build goes on until both have their checkout
+        self.both_cloned.wait()
+        return True
+
+    def record_status(self, repository, commit_sha, state, description, context, target_url=""):
+        self.statuses.append((repository, commit_sha, context, state))
+
+    def payload(self, owner):
+        return WebhookPayload(
+            ref="refs/heads/main",
+            repository={"clone_url": f"https://github.com/{owner}/app.git", "full_name": f"{owner}/app",
+                        "pushed_at": "1700000000"},
+            head_commit={"id": f"{owner}-sha", "message": "change"}
+        )
+
+    def test_builds_do_not_share_state(self):
+        with patch("app.routers.notify.clone_repo", side_effect=self.fake_clone), \
+             patch("app.routers.notify.get_status_client") as client:
+            client.return_value.enqueue.side_effect = self.record_status
+            with ThreadPoolExecutor(2) as executor:
+                alice = executor.submit(run_build, self.payload("alice"), "job-alice", False)
+                bob = executor.submit(run_build, self.payload("bob"), "job-bob", False)
+                results = {"alice": alice.result(120), "bob": bob.result(120)}
+
+        self.assertEqual(results["alice"]["steps"]["unit"]["status"], "success")
+        self.assertEqual(results["bob"]["steps"]["unit"]["status"], "failure")
+        self.assertEqual(database_api.get_entry_by_commit("alice-sha")[0][4], {"unit": "success"})
+        self.assertEqual(database_api.get_entry_by_commit("bob-sha")[0][4], {"unit": "failure"})
+        # every status went to the commit of its own repository
+        for owner, state in (("alice", "success"), ("bob", "failure")):
+            final = [status for status in self.statuses if status[0] == f"{owner}/app" and status[2] == "CI/unit"]
+            self.assertTrue(final)
+            self.assertTrue(all(status[1] == f"{owner}-sha" for status in final))
+            self.assertEqual(final[-1][3], state)
+        self.assertFalse(os.path.exists("./cloned_repo/app-job-alice"))
+
+
+if __name__ == '__main__':
+    unittest.main()
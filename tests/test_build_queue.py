@@ -0,0 +1,175 @@
+import unittest
+import sys
+import threading
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+sys.path.append('app')
+from main import app
+from app.lib import database_api
+from app.lib.build_queue import BuildQueue, build_queue
+from app.lib.cancel import check_cancelled, current_token
+from database_helpers import use_temp_database, restore_database
+
+
+class TestBuildQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = BuildQueue(max_workers=1)
+
+    def tearDown(self):
+        self.queue.shutdown()
+
+    def test_submit_returns_result(self):
+        # a finished job keeps the value returned by the build function
+        job_id = self.queue.submit(lambda x: x * 2, 21, info={"branch": "main"})
+        job = self.queue.wait(job_id, timeout=5)
+        self.assertEqual(job.status, "finished")
+        self.assertEqual(job.result, 42)
+        self.assertEqual(job.to_dict()["branch"], "main")
+
+    def test_failing_job(self):
+        # an exception in the build function marks the job as failed
+        def broken():
+            raise RuntimeError("boom")
+        job = self.queue.wait(self.queue.submit(broken), timeout=5)
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.error, "boom")
+
+    def test_snapshot_states(self):
+        # with one worker the second job waits until the first is released
+        started, release = threading.Event(), threading.Event()
+        def blocking():
+            started.set()
+            release.wait()
+        first = self.queue.submit(blocking)
+        second = self.queue.submit(lambda: None)
+        started.wait(5)
+        snapshot = self.queue.snapshot()
+        self.assertEqual([job["id"] for job in snapshot["running"]], [first])
+        self.assertEqual([job["id"] for job in snapshot["queued"]], [second])
+        release.set()
+        self.queue.wait(second, timeout=5)
+        finished = [job["id"] for job in self.queue.snapshot()["finished"]]
+        self.assertEqual(finished, [first, second])
+
+    def test_finished_history_is_bounded(self):
+        queue = BuildQueue(max_workers=1, history_size=2)
+        ids = [queue.submit(lambda: None) for _ in range(4)]
+        queue.wait(ids[-1], timeout=5)
+        queue.shutdown()
+        self.assertIsNone(queue.get_job(ids[0]))
+        self.assertIsNotNone(queue.get_job(ids[-1]))
+
+    def test_newer_job_supersedes_group(self):
+        started, release, submitted = threading.Event(), threading.Event(), threading.Event()
+        def blocking():
+            started.set()
+            # a build notices the cancel between its steps
+            current_token().add_callback(release.set)
+            release.wait(5)
+            # keep the worker busy until every job is queued
+            submitted.wait(5)
+            check_cancelled()
+        running = self.queue.submit(blocking, group="repo:main", info={"commit": "a"})
+        started.wait(5)
+        queued = self.queue.submit(lambda: "old", group="repo:main", info={"commit": "b"})
+        other_branch = self.queue.submit(lambda: "other", group="repo:dev", info={"commit": "c"})
+        newest = self.queue.submit(lambda: "new", group="repo:main", info={"commit": "d"})
+        submitted.set()
+        self.assertEqual(self.queue.wait(newest, timeout=5).result, "new")
+        self.assertEqual(self.queue.get_job(running).status, "superseded")
+        self.assertEqual(self.queue.get_job(running).error, "Superseded by b")
+        self.assertEqual(self.queue.get_job(queued).status, "superseded")
+        self.assertEqual(self.queue.get_job(queued).error, "Superseded by d")
+        self.assertIsNone(self.queue.get_job(queued).started_at)
+        self.assertEqual(self.queue.get_job(other_branch).status, "finished")
+        self.assertEqual(self.queue.find(commit="d").id, newest)
+
+    def test_queue_endpoint(self):
+        # the queue endpoint lists jobs grouped by state
+        response = TestClient(app).get("/builds/queue")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["workers"], build_queue.max_workers)
+        for key in ("queued", "running", "finished"):
+            self.assertIn(key, response.json())
+
+
+class TestWebhookIntake(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.client = TestClient(app)
+        self.release = threading.Event()
+        self.builds = []
+
+    def tearDown(self):
+        self.release.set()
+        restore_database(self)
+
+    def fake_build(self, payload, job_id, use_cache):
+        self.builds.append(payload.head_commit["id"])
+        current_token().add_callback(self.release.set)
+        self.release.wait(5)
+        return {"status": "ok"}
+
+    def push(self, commit_sha, delivery=None, branch="main"):
+        payload = {
+            "ref": f"refs/heads/{branch}",
+            "repository": {"clone_url": "https://github.com/test/intake.git",
+                           "full_name": "test/intake", "pushed_at": commit_sha},
+            "head_commit": {"id": commit_sha}
+        }
+        headers = {"X-GitHub-Delivery": delivery} if delivery else {}
+        return self.client.post("/webhook", json=payload, headers=headers)
+
+    def test_redeliveries_and_pushes_of_the_same_commit(self):
+        with patch("app.routers.notify.run_build", self.fake_build):
+            first = self.push("intake1", delivery="d-1")
+            self.assertEqual(first.status_code, 202)
+            again = self.push("intake1", delivery="d-1")
+            self.assertEqual(again.status_code, 200)
+            self.assertEqual(again.json(), {"job_id": first.json()["job_id"], "status": "duplicate",
+                                            "reason": "delivery"})
+            # a new delivery of the commit that is being built
+            self.assertEqual(self.push("intake1", delivery="d-2").json()["reason"], "commit")
+            self.release.set()
+            build_queue.wait(first.json()["job_id"], timeout=5)
+        self.assertEqual(self.builds, ["intake1"])
+
+    def test_built_commit(self):
+        database_api.create_new_entry("intake2", "main", [], repository="test/intake")
+        response = self.push("intake2")
+        self.assertEqual(response.json()["status"], "duplicate")
+        self.assertEqual(response.json()["build_id"], 1)
+        with patch("app.routers.notify.run_build", self.fake_build):
+            self.release.set()
+            response = self.client.post("/webhook?rebuild=true", json={
+                "ref": "refs/heads/main", "head_commit": {"id": "intake2"},
+                "repository": {"clone_url": "https://github.com/test/intake.git",
+                               "full_name": "test/intake", "pushed_at": "2"}})
+            self.assertEqual(response.status_code, 202)
+            build_queue.wait(response.json()["job_id"], timeout=5)
+
+    def test_commit_built_in_another_repository(self):
+        # a fork shares the commit but has not built it yet
+        database_api.create_new_entry("intake6", "main", [], repository="test/fork")
+        with patch("app.routers.notify.run_build", self.fake_build):
+            self.release.set()
+            response = self.push("intake6")
+            self.assertEqual(response.status_code, 202)
+            build_queue.wait(response.json()["job_id"], timeout=5)
+        self.assertEqual(self.builds, ["intake6"])
+
+    def test_newer_push_supersedes(self):
+        with patch("app.routers.notify.run_build", self.fake_build):
+            old = self.push("intake3").json()["job_id"]
+            other = self.push("intake4", branch="dev").json()["job_id"]
+            new = self.push("intake5").json()["job_id"]
+            self.assertEqual(build_queue.wait(old, timeout=5).status, "superseded")
+            self.release.set()
+            self.assertEqual(build_queue.wait(new, timeout=5).status, "finished")
+            self.assertEqual(build_queue.wait(other, timeout=5).status, "finished")
+
+
+if __name__ == '__main__':
+    unittest.main()
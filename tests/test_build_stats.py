@@ -0,0 +1,112 @@
+import unittest
+import sys
+from datetime import timedelta
+from unittest import mock
+from fastapi.testclient import TestClient
+sys.path.append('app')
+from main import app
+from app.lib import database_api
+from app.lib.build_stats import percentile, slowest_by_branch, slowest_tests, stage_trends
+from database_helpers import use_temp_database, restore_database
+
+
+def add_timed_build(commit_hash, branch, slow_ms, repository="test/repo"):
+    return database_api.create_new_entry(commit_hash, branch, [
+        {"stage": "unit", "status": "success", "log": "", "duration": slow_ms / 1000 + 1,
+         "tests": {"tests/test_a.py::test_slow": slow_ms / 1000, "tests/test_a.py::test_fast": 0.002}},
+        {"stage": "lint", "status": "success", "log": ""}
+    ], repository=repository)
+
+
+class TestAggregates(unittest.TestCase):
+
+    def test_percentile(self):
+        # nearest rank: the smallest sample with at least pct percent of the samples at or below it
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 95), 95)
+        self.assertEqual(percentile(samples, 100), 100)
+        self.assertEqual(percentile([2.0, 1.0], 50), 1.0)
+        self.assertEqual(percentile(list(range(1, 21)), 95), 19)
+        self.assertEqual(percentile([3.0], 95), 3.0)
+
+    def test_stage_trends(self):
+        rows = [("2025-02-01", "unit", 1.0), ("2025-02-01", "unit", 3.0), ("2025-02-02", "unit", 2.0)]
+        trends = stage_trends(rows)
+        self.assertEqual([(row["date"], row["runs"]) for row in trends], [("2025-02-01", 2), ("2025-02-02", 1)])
+        self.assertEqual(trends[0]["p95"], 3.0)
+
+    def test_slowest(self):
+        rows = [("main", "r", "unit", "a", 100), ("main", "r", "unit", "b", 900), ("dev", "r", "unit", "a", 5000)]
+        self.assertEqual([test["test"] for test in slowest_tests(rows)], ["a", "b"])
+        by_branch = slowest_by_branch(rows)
+        self.assertEqual([test["test"] for test in by_branch["main"]], ["b", "a"])
+        self.assertEqual(by_branch["dev"][0]["p50"], 5.0)
+
+    def test_repositories_are_separate(self):
+        rows = [("main", "one", "unit", "a", 100), ("main", "two", "unit", "a", 900)]
+        self.assertEqual([(test["repository"], test["runs"]) for test in slowest_tests(rows)],
+                         [("two", 1), ("one", 1)])
+
+
+class TestStatsPage(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.client = TestClient(app)
+        add_timed_build("sha1", "main", 400)
+        add_timed_build("sha2", "main", 600)
+        add_timed_build("sha3", "feature", 2000)
+
+    def tearDown(self):
+        restore_database(self)
+
+    def test_timings_are_compact(self):
+        # a test's name is stored once, each build only adds (build, test, ms)
+        with database_api.session_scope() as db:
+            self.assertEqual(db.query(database_api.TestCase).count(), 2)
+            self.assertEqual(db.query(database_api.TestTiming).count(), 6)
+
+    def test_timings_per_repository(self):
+        # the same test name in another repository is another test
+        add_timed_build("sha4", "main", 9000, repository="other/repo")
+        with database_api.session_scope() as db:
+            self.assertEqual(db.query(database_api.TestCase).count(), 4)
+        slow = "tests/test_a.py::test_slow"
+        self.assertEqual(database_api.get_test_durations("test/repo", [slow]), {slow: 1.0})
+        self.assertEqual(database_api.get_test_durations("other/repo", [slow]), {slow: 9.0})
+
+    def test_json(self):
+        response = self.client.get("/builds/stats?format=json")
+        self.assertEqual(response.status_code, 200)
+        stats = response.json()
+        self.assertEqual(stats["slowest_tests"][0]["test"], "tests/test_a.py::test_slow")
+        self.assertEqual(stats["slowest_tests"][0]["p95"], 2.0)
+        self.assertEqual(stats["slowest_by_branch"]["main"][0]["p50"], 0.4)
+        # lint was not timed, unit ran three times today
+        self.assertEqual([(row["stage"], row["runs"], row["date"]) for row in stats["stages"]],
+                         [("unit", 3, database_api.utcnow().date().isoformat())])
+
+    def test_branch_filter(self):
+        stats = self.client.get("/builds/stats?format=json&branch=feature").json()
+        self.assertEqual(list(stats["slowest_by_branch"]), ["feature"])
+
+    def test_html_and_etag(self):
+        response = self.client.get("/builds/stats")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("tests/test_a.py::test_slow", response.text)
+        cached = self.client.get("/builds/stats", headers={"If-None-Match": response.headers["etag"]})
+        self.assertEqual(cached.status_code, 304)
+
+    def test_etag_changes_with_the_day(self):
+        # the window moves at midnight, so yesterday's page is not reused
+        response = self.client.get("/builds/stats")
+        tomorrow = database_api.utcnow().replace(hour=0) + timedelta(days=1)
+        with mock.patch("app.routers.builds.utcnow", return_value=tomorrow):
+            later = self.client.get("/builds/stats", headers={"If-None-Match": response.headers["etag"]})
+        self.assertEqual(later.status_code, 200)
+        self.assertNotEqual(later.headers["etag"], response.headers["etag"])
+
+
+if __name__ == '__main__':
+    unittest.main()
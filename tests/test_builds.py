@@ -0,0 +1,147 @@
+import unittest
+import sys
+from fastapi.testclient import TestClient
+sys.path.append('app')
+from main import app
+from unittest.mock import patch
+from app.lib.async_db import build_repository
+from app.lib.database_api import utcnow
+from app.lib.page_cache import build_pages
+from database_helpers import use_temp_database, restore_database, add_build
+
+
+class TestBuildList(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        restore_database(self)
+
+    def test_empty_history(self):
+        response = self.client.get("/builds")
+        self.assertEqual(response.status_code, 404)
+
+    def test_pagination_links(self):
+        # the first page links to the next one and the last page does not
+        ids = [add_build(f"sha{i}") for i in range(3)]
+        page = self.client.get("/builds?limit=2")
+        self.assertEqual(page.status_code, 200)
+        self.assertIn(f"Build #{ids[2]}", page.text)
+        self.assertNotIn(f"Build #{ids[0]}", page.text)
+        self.assertIn(f"after={ids[1]}", page.text)
+        last = self.client.get(f"/builds?limit=2&after={ids[1]}")
+        self.assertIn(f"Build #{ids[0]}", last.text)
+        self.assertNotIn("Older builds", last.text)
+
+    def test_branch_filter(self):
+        add_build("sha-main", branch="main")
+        add_build("sha-feature", branch="feature")
+        page = self.client.get("/builds?branch=feature")
+        self.assertIn("sha-feature", page.text)
+        self.assertNotIn("sha-main", page.text)
+        self.assertEqual(self.client.get("/builds?branch=missing").status_code, 404)
+
+    def test_invalid_limit(self):
+        self.assertEqual(self.client.get("/builds?limit=0").status_code, 422)
+
+    def test_date_filter(self):
+        ids = [add_build(f"sha{i}") for i in range(2)]
+        today = utcnow().date().isoformat()
+        page = self.client.get(f"/builds?limit=1&date={today}")
+        self.assertIn(f"Build #{ids[1]}", page.text)
+        self.assertIn(f"date={today}", page.text)
+        self.assertEqual(self.client.get("/builds?date=1999-01-01").status_code, 404)
+
+    def test_invalid_date(self):
+        self.assertEqual(self.client.get("/builds?date=notadate").status_code, 422)
+        self.assertEqual(self.client.get("/builds?date=2025-02-30").status_code, 422)
+
+    def test_branch_names_are_escaped(self):
+        add_build("sha1", branch="<script>alert(1)</script>")
+        page = self.client.get("/builds")
+        self.assertNotIn("<script>alert(1)</script>", page.text)
+        self.assertIn("&lt;script&gt;", page.text)
+
+    def test_etag_follows_latest_build(self):
+        # the list is not re-rendered until a new build is recorded
+        add_build("sha1")
+        first = self.client.get("/builds")
+        tag = first.headers["etag"]
+        self.assertEqual(self.client.get("/builds", headers={"If-None-Match": tag}).status_code, 304)
+        self.assertNotEqual(self.client.get("/builds?limit=1").headers["etag"], tag)
+        add_build("sha2")
+        refreshed = self.client.get("/builds", headers={"If-None-Match": tag})
+        self.assertEqual(refreshed.status_code, 200)
+        self.assertIn("sha2", refreshed.text)
+
+
+class TestBuildDetail(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        restore_database(self)
+
+    def test_detail_page(self):
+        build_id = add_build("sha1", result="failure", log="assert <b>1</b> == 2")
+        page = self.client.get(f"/builds/{build_id}")
+        self.assertEqual(page.status_code, 200)
+        self.assertIn("CI Test Results", page.text)
+        self.assertIn('class="test-section failure"', page.text)
+        self.assertIn("assert &lt;b&gt;1&lt;/b&gt; == 2", page.text)
+        cached = self.client.get(f"/builds/{build_id}", headers={"If-None-Match": page.headers["etag"]})
+        self.assertEqual(cached.status_code, 304)
+
+    def test_long_logs_are_folded(self):
+        # the page shows the head and tail of a long log and links to the raw log
+        log = "\n".join(f"output line {i}" for i in range(5000))
+        build_id = add_build("sha1", log=log, stages=("test_CI",))
+        page = self.client.get(f"/builds/{build_id}").text
+        self.assertIn("output line 0\n", page)
+        self.assertIn("output line 4999", page)
+        self.assertNotIn("output line 2500", page)
+        self.assertIn("4800 more lines", page)
+        self.assertIn(f'href="/builds/{build_id}/log/test_CI"', page)
+        self.assertLess(len(page), len(log) / 5)
+
+    def test_detail_page_is_cached_compressed(self):
+        # the page is rendered once; later hits skip the database and get gzip if accepted
+        build_id = add_build("sha1", log="FAILED tests/test_CI.py::test_webhook\n" * 500)
+        first = self.client.get(f"/builds/{build_id}", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(first.headers["content-encoding"], "gzip")
+        self.assertIn("sha1", first.text)
+        with patch.object(build_repository, "get_entry_by_id", side_effect=AssertionError("queried")):
+            again = self.client.get(f"/builds/{build_id}", headers={"Accept-Encoding": "identity"})
+        self.assertEqual(again.text, first.text)
+        self.assertNotIn("content-encoding", again.headers)
+        self.assertEqual(again.headers["vary"], "Accept-Encoding")
+
+    def test_written_build_drops_cached_page(self):
+        # a build stored under an id that has a cached page (a fresh database) replaces it
+        build_id = add_build("sha1")
+        self.client.get(f"/builds/{build_id}")
+        self.assertIsNotNone(build_pages.get(build_id))
+        restore_database(self)
+        use_temp_database(self)
+        self.assertEqual(add_build("sha2"), build_id)
+        self.assertIsNone(build_pages.get(build_id))
+        self.assertIn("sha2", self.client.get(f"/builds/{build_id}").text)
+
+    def test_invalid_and_missing(self):
+        self.assertEqual(self.client.get("/builds/abc").status_code, 400)
+        self.assertEqual(self.client.get("/builds/999").status_code, 404)
+
+    def test_stylesheet_is_cacheable(self):
+        page = self.client.get("/builds/999")
+        self.assertIn("/static/ci.css?v=", page.text)
+        css = self.client.get("/static/ci.css")
+        self.assertEqual(css.status_code, 200)
+        self.assertIn("max-age", css.headers["cache-control"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from app.lib.cancel import BuildCancelled, CancelToken, cancel_scope, check_cancelled, on_cancel
+from app.lib.pytest_pool import PytestPool, run_process
+
+
+class TestCancelToken(unittest.TestCase):
+
+    def test_callbacks(self):
+        token, calls = CancelToken(), []
+        with cancel_scope(token):
+            with on_cancel(lambda: calls.append("inside")):
+                pass
+            with on_cancel(lambda: calls.append("registered")):
+                self.assertTrue(token.cancel("Superseded by abc"))
+                self.assertFalse(token.cancel("again"))
+            # registering after the cancel calls right away
+            with on_cancel(lambda: calls.append("late")):
+                pass
+            with self.assertRaises(BuildCancelled):
+                check_cancelled()
+        self.assertEqual(calls, ["registered", "late"])
+        self.assertEqual(token.reason, "Superseded by abc")
+
+    def test_no_scope(self):
+        # outside a build nothing can be cancelled
+        with on_cancel(self.fail):
+            check_cancelled()
+
+    def cancel_soon(self, token):
+        timer = threading.Timer(0.5, token.cancel)
+        timer.start()
+        return timer
+
+    def test_kills_process(self):
+        token = CancelToken()
+        self.cancel_soon(token)
+        started = time.monotonic()
+        with cancel_scope(token):
+            returncode, _ = run_process([sys.executable, "-c", "import time; time.sleep(30)"], ".", lambda line: None, 60)
+        self.assertNotEqual(returncode, 0)
+        self.assertLess(time.monotonic() - started, 10)
+
+    def test_kills_pytest_worker(self):
+        pool = PytestPool(size=1, preload=[])
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "test_slow.py"), "w") as f:
+                f.write("import time\n\ndef test_slow():\n    time.sleep(30)\n")
+            token = CancelToken()
+            try:
+                pool.warm()
+                self.cancel_soon(token)
+                started = time.monotonic()
+                with cancel_scope(token):
+                    with self.assertRaises(RuntimeError):
+                        pool.run(tmp, ["test_slow.py"], lambda line: None, 60)
+                self.assertLess(time.monotonic() - started, 10)
+            finally:
+                pool.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
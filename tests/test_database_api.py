@@ -0,0 +1,328 @@
+import unittest
+import sys
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event, text
+sys.path.append('app')
+from app.lib import database_api, migrations
+from database_helpers import use_temp_database, restore_database, add_build
+
+
+class TestBuildSummaries(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.ids = [add_build(f"sha{i}", branch="main" if i % 2 else "feature") for i in range(7)]
+
+    def tearDown(self):
+        restore_database(self)
+
+    def test_summary_columns_only(self):
+        # each row is (id, commit_hash, branch, build_date), newest first
+        rows = database_api.get_build_summaries(limit=2)
+        self.assertEqual([row[0] for row in rows], [self.ids[6], self.ids[5]])
+        self.assertEqual(len(rows[0]), 4)
+        self.assertEqual(rows[0][1], "sha6")
+
+    def test_keyset_pages(self):
+        # walking the cursor visits every build exactly once
+        seen, after = [], None
+        while True:
+            rows = database_api.get_build_summaries(limit=3, after=after)
+            if not rows:
+                break
+            seen += [row[0] for row in rows]
+            after = rows[-1][0]
+        self.assertEqual(seen, list(reversed(self.ids)))
+
+    def test_filters(self):
+        # branch and date filters narrow the page
+        rows = database_api.get_build_summaries(branch="main")
+        self.assertEqual({row[2] for row in rows}, {"main"})
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(database_api.get_build_summaries(build_date="1999-01-01"), [])
+
+
+class TestBuildLogs(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+
+    def tearDown(self):
+        restore_database(self)
+
+    def test_logs_are_compressed(self):
+        # logs live gzip-compressed outside the build_log table
+        log = "PASSED tests/test_CI.py::test_webhook\n" * 1000
+        build_id = add_build("sha1", log=log)
+        with self.engine.connect() as conn:
+            stored = conn.execute(text("SELECT content FROM build_log_output WHERE build_id = :id"),
+                                  {"id": build_id}).fetchall()
+        self.assertEqual(len(stored), 3)
+        self.assertLess(len(stored[0][0]), len(log) / 10)
+        self.assertEqual(database_api.get_build_logs(build_id)["test_CI"], log)
+
+    def test_entry_by_id_includes_logs(self):
+        build_id = add_build("sha1", log="output")
+        entry = database_api.get_entry_by_id(build_id)[0]
+        self.assertEqual(entry[1], "sha1")
+        self.assertEqual([stage["log"] for stage in entry[4]], ["output", "output", "output"])
+        self.assertEqual(database_api.get_entry_by_commit("sha1")[0][4],
+                         {"test_syntax": "success", "test_notifier": "success", "test_CI": "success"})
+
+    def test_any_stages(self):
+        # a pipeline's stages are rows, kept in pipeline order
+        build_id = add_build("sha1", result="failure", stages=("lint", "unit", "deploy"))
+        results = database_api.get_stage_results(build_id)
+        self.assertEqual([result["stage"] for result in results], ["lint", "unit", "deploy"])
+        self.assertEqual(results[0], {"stage": "lint", "status": "failure", "description": "lint failure"})
+        self.assertEqual(set(database_api.get_build_logs(build_id)), {"lint", "unit", "deploy"})
+
+    def test_migrate_old_schema(self):
+        # a database with log columns in build_log is converted in place
+        path = f"{self.tmp}/old.db"
+        engine = create_engine(f"sqlite:///{path}")
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE build_log (
+                    id INTEGER PRIMARY KEY, commit_hash VARCHAR UNIQUE NOT NULL, branch VARCHAR NOT NULL,
+                    build_date VARCHAR NOT NULL, test_syntax_result VARCHAR NOT NULL,
+                    test_notifier_result VARCHAR NOT NULL, test_CI_result VARCHAR NOT NULL,
+                    test_syntax_log VARCHAR NOT NULL, test_notifier_log VARCHAR NOT NULL, test_CI_log VARCHAR NOT NULL)
+            """))
+            conn.execute(text("""
+                INSERT INTO build_log VALUES (1, 'abc', 'main', '2025-02-10', 'success', 'failure', 'success',
+                                              'syntax ok', 'notifier failed', 'ci ok')
+            """))
+        self.assertEqual(migrations.migrate(engine), ["move_logs_to_log_table", "move_results_to_stage_table",
+                                                   "add_stage_duration_column", "add_build_timestamp_columns",
+                                                   "add_build_history_indexes", "allow_build_attempts",
+                                                   "add_build_repository"])
+        self.assertEqual(migrations.migrate(engine), [])
+        with engine.connect() as conn:
+            columns = {row[1] for row in conn.execute(text("PRAGMA table_info(build_log)"))}
+            row = conn.execute(text("SELECT built_at, result FROM build_log")).first()
+            indexes = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+        self.assertTrue(indexes.issuperset(migrations.BUILD_LOG_INDEXES))
+        self.assertEqual(columns, {"id", "commit_hash", "repository", "attempt", "branch", "build_date", "built_at",
+                                   "result"})
+        self.assertEqual(tuple(row), ("2025-02-10 00:00:00.000000", "failure"))
+        engine.dispose()
+
+        database_api.SessionLocal.configure(bind=database_api.make_engine(f"sqlite:///{path}"))
+        stages = database_api.get_entry_by_id(1)[0][4]
+        self.assertEqual([(stage["stage"], stage["status"], stage["log"]) for stage in stages], [
+            ("test_syntax", "success", "syntax ok"),
+            ("test_notifier", "failure", "notifier failed"),
+            ("test_CI", "success", "ci ok")
+        ])
+        self.assertEqual(database_api.get_entries_by_date("2025-02-10")[0][1], "abc")
+        self.assertEqual(database_api.get_latest_build("main", result="failure")[1], "abc")
+        # the migrated build keeps its stages and the commit can be built again
+        rebuilt = add_build("abc")
+        self.assertEqual([row[:2] for row in database_api.get_attempts("abc")], [(1, 1), (rebuilt, 2)])
+
+
+    def test_migrate_test_case_repository(self):
+        # tests recorded before timings were kept per repository belong to repository ''
+        path = f"{self.tmp}/timings.db"
+        engine = create_engine(f"sqlite:///{path}")
+        database_api.Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE test_case"))
+            conn.execute(text("""
+                CREATE TABLE test_case (id INTEGER PRIMARY KEY, stage VARCHAR NOT NULL, node_id VARCHAR NOT NULL,
+                                        UNIQUE (stage, node_id))
+            """))
+            conn.execute(text("INSERT INTO test_case VALUES (7, 'unit', 'tests/test_a.py::test_one')"))
+            conn.execute(text("CREATE TABLE test_duration (repository VARCHAR, node_id VARCHAR, duration FLOAT)"))
+        self.assertEqual(migrations.migrate(engine), ["add_test_case_repository", "drop_test_duration_table"])
+        self.assertEqual(migrations.migrate(engine), [])
+        with engine.connect() as conn:
+            row = conn.execute(text("SELECT id, repository, stage, node_id FROM test_case")).first()
+            tables = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+        self.assertEqual(tuple(row), (7, "", "unit", "tests/test_a.py::test_one"))
+        self.assertNotIn("test_duration", tables)
+        engine.dispose()
+
+class TestAttempts(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+
+    def tearDown(self):
+        restore_database(self)
+
+    def test_rebuild_records_next_attempt(self):
+        # building a commit again adds an attempt instead of failing to store it
+        first = add_build("sha1", result="failure")
+        second = add_build("sha1", result="success", log="second")
+        self.assertNotEqual(first, second)
+        self.assertEqual([row[:3] for row in database_api.get_attempts("sha1")],
+                         [(first, 1, "failure"), (second, 2, "success")])
+        self.assertEqual(database_api.get_entry_by_commit("sha1")[0][0], second)
+        entry = database_api.get_entry_by_id(second)[0]
+        self.assertEqual((entry[4][0]["log"], entry[5]), ("second", 2))
+        self.assertEqual(database_api.get_entry_by_id(first)[0][5], 1)
+
+    def test_attempts_per_repository(self):
+        # the same commit in a fork is numbered on its own and found by repository
+        first = database_api.create_new_entry("sha1", "main", [], repository="test/repo")
+        fork = database_api.create_new_entry("sha1", "main", [], repository="test/fork")
+        self.assertEqual([row[:2] for row in database_api.get_attempts("sha1", "test/repo")], [(first, 1)])
+        self.assertEqual([row[:2] for row in database_api.get_attempts("sha1", "test/fork")], [(fork, 1)])
+        self.assertEqual(database_api.get_entry_by_commit("sha1", repository="test/repo")[0][0], first)
+        self.assertEqual(database_api.get_entry_by_commit("sha1", repository="other/repo"), [])
+        self.assertEqual(database_api.get_entry_by_commit("sha1")[0][0], fork)
+
+    def test_concurrent_attempts_are_numbered_once(self):
+        ids = []
+        threads = [threading.Thread(target=lambda: ids.append(add_build("sha1"))) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(row[1] for row in database_api.get_attempts("sha1")), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(len(set(ids)), 6)
+
+
+def set_built_at(build_id, built_at):
+    with database_api.session_scope() as db:
+        db.query(database_api.BuildLog).filter(database_api.BuildLog.id == build_id) \
+            .update({"built_at": built_at, "build_date": built_at.strftime(database_api.time_format)})
+
+
+class TestBuildHistory(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.start = datetime(2025, 3, 1, 12)
+        # main: sha0 success, sha2 failure, sha4 success; feature: sha1, sha3; one every six hours
+        self.ids = []
+        for i in range(5):
+            build_id = add_build(f"sha{i}", branch="feature" if i % 2 else "main",
+                                 result="failure" if i == 2 else "success")
+            set_built_at(build_id, self.start + timedelta(hours=6 * i))
+            self.ids.append(build_id)
+
+    def tearDown(self):
+        restore_database(self)
+
+    def test_new_builds_record_time_and_result(self):
+        before = database_api.utcnow()
+        build_id = add_build("sha9", result="error", stages=("lint",))
+        with database_api.session_scope() as db:
+            entry = db.query(database_api.BuildLog).filter(database_api.BuildLog.id == build_id).one()
+        self.assertGreaterEqual(entry.built_at, before)
+        self.assertEqual(entry.build_date, entry.built_at.strftime(database_api.time_format))
+        self.assertEqual(entry.result, "error")
+
+    def test_builds_between(self):
+        # half-open range, newest first, narrowed by branch and result
+        rows = database_api.get_builds_between(self.start, self.start + timedelta(hours=18))
+        self.assertEqual([row[1] for row in rows], ["sha2", "sha1", "sha0"])
+        rows = database_api.get_builds_between(self.start, self.start + timedelta(days=2), branch="main",
+                                               result="success")
+        self.assertEqual([row[1] for row in rows], ["sha4", "sha0"])
+        self.assertEqual([row[1] for row in database_api.get_entries_by_date("2025-03-02")], ["sha4", "sha3", "sha2"])
+
+    def test_branch_builds_and_latest(self):
+        rows = database_api.get_branch_builds("main", limit=2)
+        self.assertEqual([row[1] for row in rows], ["sha4", "sha2"])
+        rows = database_api.get_branch_builds("main", before=self.start + timedelta(hours=12))
+        self.assertEqual([row[1] for row in rows], ["sha0"])
+        self.assertEqual(database_api.get_latest_build("main")[1], "sha4")
+        self.assertEqual(database_api.get_latest_build("main", result="failure")[1], "sha2")
+        self.assertIsNone(database_api.get_latest_build("nope"))
+
+    def test_forks_are_kept_apart(self):
+        # a fork's main is not upstream's main
+        fork_id = add_build("sha5", branch="main", result="failure", repository="fork/app")
+        set_built_at(fork_id, self.start + timedelta(hours=30))
+        self.assertEqual(database_api.get_latest_build("main", repository="")[1], "sha4")
+        self.assertEqual(database_api.get_latest_build("main", repository="fork/app")[1], "sha5")
+        self.assertIsNone(database_api.get_latest_build("main", result="success", repository="fork/app"))
+        self.assertEqual([row[1] for row in database_api.get_branch_builds("main", repository="")],
+                         ["sha4", "sha2", "sha0"])
+        self.assertEqual([row[1] for row in database_api.get_branch_builds("main", repository="fork/app")], ["sha5"])
+        rows = database_api.get_builds_between(self.start, self.start + timedelta(days=2), branch="main",
+                                               repository="fork/app")
+        self.assertEqual([row[1] for row in rows], ["sha5"])
+        self.assertEqual(database_api.get_latest_build("main")[1], "sha5")
+
+    def test_queries_use_indexes(self):
+        # the branch, result and date filters are index lookups, not table scans
+        queries = {
+            "ix_build_log_branch_built_at": "branch = 'main' ORDER BY built_at DESC LIMIT 1",
+            "ix_build_log_repository_branch_built_at":
+                "repository = 'fork/app' AND branch = 'main' ORDER BY built_at DESC LIMIT 1",
+            "ix_build_log_result_built_at": "result = 'failure' AND built_at >= '2025-03-01'",
+            "ix_build_log_built_at": "built_at >= '2025-03-01' AND built_at < '2025-03-02'",
+        }
+        with self.engine.connect() as conn:
+            for index, where in queries.items():
+                plan = " ".join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN SELECT id FROM build_log WHERE {where}")))
+                self.assertIn(index, plan)
+
+    def test_branch_page_needs_no_sort(self):
+        # a page of one branch's builds walks the (branch, id) index instead of sorting the branch's history
+        statements = []
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().startswith("SELECT build_log.id"):
+                statements.append((statement, parameters))
+        event.listen(self.engine, "before_cursor_execute", capture)
+        try:
+            rows = database_api.get_build_summaries(limit=2, after=self.ids[4], branch="main")
+        finally:
+            event.remove(self.engine, "before_cursor_execute", capture)
+        self.assertEqual([row[1] for row in rows], ["sha2", "sha0"])
+        with self.engine.connect() as conn:
+            plan = " ".join(row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statements[0][0]}",
+                                                                     statements[0][1]))
+        self.assertIn("ix_build_log_branch_id", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+class TestSessions(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+
+    def tearDown(self):
+        restore_database(self)
+
+    def test_wal_mode(self):
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.execute(text("PRAGMA journal_mode")).scalar(), "wal")
+
+    def test_session_scope_rolls_back(self):
+        # a failing unit of work leaves nothing behind
+        with self.assertRaises(RuntimeError):
+            with database_api.session_scope() as db:
+                db.add(database_api.BuildLog(commit_hash="sha1", branch="main", build_date="2025-01-01"))
+                db.flush()
+                raise RuntimeError("boom")
+        self.assertEqual(database_api.get_entry_by_commit("sha1"), [])
+
+    def test_get_db_dependency(self):
+        # the request session is reused by the query functions and closed afterwards
+        build_id = add_build("sha1")
+        dependency = database_api.get_db()
+        db = next(dependency)
+        self.assertTrue(database_api.build_exists(build_id, db=db))
+        self.assertEqual(database_api.get_entry_by_id(build_id, db=db)[0][1], "sha1")
+        dependency.close()
+        self.assertFalse(db.in_transaction())
+
+    def test_read_during_write(self):
+        # readers are not blocked by an open write transaction
+        add_build("sha1")
+        with database_api.session_scope() as writer:
+            writer.add(database_api.BuildLog(commit_hash="sha2", branch="main", build_date="2025-01-01"))
+            writer.flush()
+            self.assertEqual(len(database_api.get_build_summaries()), 1)
+        self.assertEqual(len(database_api.get_build_summaries()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
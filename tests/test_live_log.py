@@ -0,0 +1,173 @@
+import unittest
+import gzip
+import sys
+from fastapi.testclient import TestClient
+sys.path.append('app')
+from main import app
+from app.lib import live_log
+from app.lib.live_log import LogSink, OutputSpool
+from app.lib.pipeline import Stage
+from app.routers.notify import run_stage_command
+from database_helpers import use_temp_database, restore_database, add_build
+
+
+class TestLogSink(unittest.TestCase):
+
+    def test_read_with_cursor(self):
+        sink = LogSink()
+        sink.write("first\n")
+        lines, cursor, skipped = sink.read()
+        self.assertEqual((lines, cursor, skipped), (["first"], 1, 0))
+        sink.write("second\n")
+        self.assertEqual(sink.read(cursor)[0], ["second"])
+
+    def test_bounded_memory(self):
+        # a huge output keeps only the head and the latest tail lines
+        sink = LogSink(head_bytes=100, tail_bytes=100)
+        for i in range(10000):
+            sink.write(f"line {i:05d}")
+        self.assertEqual(sink.total_lines, 10000)
+        text = sink.text()
+        self.assertLess(len(text), 300)
+        self.assertTrue(text.startswith("line 00000"))
+        self.assertTrue(text.endswith("line 09999"))
+        self.assertIn("lines omitted", text)
+
+    def test_window_counts_bytes(self):
+        # the limits are in encoded bytes, so non-ASCII output fills them sooner
+        sink = LogSink(head_bytes=0, tail_bytes=100)
+        for _ in range(100):
+            sink.write("é" * 9)
+        self.assertEqual(sink.total_bytes, 100 * 19)
+        self.assertEqual(len(sink.read(0)[0]), 5)
+
+    def test_slow_reader_skips(self):
+        # a reader that falls behind the window is told how much it missed
+        sink = LogSink(head_bytes=0, tail_bytes=50)
+        for i in range(100):
+            sink.write(f"line {i}")
+        lines, cursor, skipped = sink.read(0)
+        self.assertGreater(skipped, 0)
+        self.assertEqual(lines[-1], "line 99")
+        self.assertEqual(cursor, 100)
+
+
+class TestOutputSpool(unittest.TestCase):
+
+    def test_keeps_all_output(self):
+        # nothing is dropped, output past the memory limit goes to a temporary file
+        spool = OutputSpool(max_memory=100)
+        for i in range(1000):
+            spool.write(f"line {i} ü\n")
+        self.assertEqual(spool.text(), "\n".join(f"line {i} ü" for i in range(1000)))
+        self.assertEqual(spool.total_lines, 1000)
+        spool.close()
+
+    def test_compressed(self):
+        # the stored log is the output, a newline and the error, as one gzip stream
+        spool = OutputSpool(max_memory=100)
+        for i in range(1000):
+            spool.write(f"line {i} ü")
+        expected = "".join(f"line {i} ü\n" for i in range(1000)) + "Tests failed"
+        self.assertEqual(gzip.decompress(spool.compressed(trailer="Tests failed")).decode(), expected)
+        spool.close()
+        empty = OutputSpool()
+        self.assertEqual(gzip.decompress(empty.compressed(trailer="boom")), b"\nboom")
+        empty.close()
+
+    def test_stage_output_is_stored_whole(self):
+        # the stored log is the whole output, not the live window
+        script = "for i in range(20000): print(f'output line {i:05d}')"
+        stage = Stage("noisy", f'python3 -c "{script}"')
+        sink = LogSink(head_bytes=100, tail_bytes=100)
+        result = run_stage_command(".", stage, log_sink=sink)
+        lines = gzip.decompress(result["compressed_log"]).decode().split("\n")
+        self.assertEqual(len(lines), 20001)
+        self.assertEqual(lines[12345], "output line 12345")
+        # the result itself only keeps the bounded window
+        self.assertEqual(result["output"], sink.text())
+        self.assertIn("lines omitted", result["output"])
+
+    def test_timed_out_stage_keeps_its_output(self):
+        stage = Stage("slow", 'python3 -u -c "import time; print(\'started\'); time.sleep(5)"', timeout=1)
+        result = run_stage_command(".", stage)
+        self.assertIn("timed out", result["error"])
+        self.assertEqual(result["outcome"], "error")
+        self.assertEqual(result["output"], "started")
+        self.assertEqual(gzip.decompress(result["compressed_log"]).decode(),
+                         "started\nTest execution timed out after 1 seconds")
+
+
+class TestLogEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        restore_database(self)
+
+    def test_stream_live_log(self):
+        # output of a running stage is served as server-sent events
+        sink = live_log.open_sink("job123", "test_CI")
+        sink.write("collected 3 items")
+        sink.write("3 passed")
+        sink.close()
+        response = self.client.get("/builds/job123/log/test_CI")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/event-stream"))
+        self.assertIn("data: collected 3 items\n\n", response.text)
+        self.assertTrue(response.text.endswith("event: end\ndata: \n\n"))
+
+    def test_stored_log(self):
+        build_id = add_build("sha1", log="stored output")
+        response = self.client.get(f"/builds/{build_id}/log/test_syntax")
+        self.assertEqual(response.text, "stored output")
+        self.assertEqual(self.client.get(f"/builds/{build_id + 1}/log/test_syntax").status_code, 404)
+        self.assertEqual(self.client.get(f"/builds/{build_id}/log/unknown").status_code, 404)
+
+    def test_stored_log_ranges_and_gzip(self):
+        log = "".join(f"line {i}\n" for i in range(1000))
+        build_id = add_build("sha1", log=log)
+        url = f"/builds/{build_id}/log/test_CI"
+        # the stored gzip blob is sent as it is to clients that accept gzip
+        compressed = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(compressed.headers["content-encoding"], "gzip")
+        self.assertLess(int(compressed.headers["content-length"]), len(log) / 3)
+        self.assertEqual(compressed.text, log)
+        plain = self.client.get(url, headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("content-encoding", plain.headers)
+        self.assertEqual(plain.headers["accept-ranges"], "bytes")
+
+        tail = self.client.get(url, headers={"Range": "bytes=-9"})
+        self.assertEqual(tail.status_code, 206)
+        self.assertEqual(tail.text, "line 999\n")
+        self.assertEqual(tail.headers["content-range"], f"bytes {len(log) - 9}-{len(log) - 1}/{len(log)}")
+        self.assertEqual(self.client.get(url, headers={"Range": "bytes=0-6"}).text, "line 0\n")
+        outside = self.client.get(url, headers={"Range": f"bytes={len(log)}-"})
+        self.assertEqual(outside.status_code, 416)
+        self.assertEqual(outside.headers["content-range"], f"bytes */{len(log)}")
+        # a stale If-Range gets the whole log
+        stale = self.client.get(url, headers={"Range": "bytes=0-6", "If-Range": 'W/"old"'})
+        self.assertEqual((stale.status_code, stale.text), (200, log))
+        self.assertEqual(self.client.get(url, headers={"Range": "bytes=0-6", "If-Range": plain.headers["etag"]}).text,
+                         "line 0\n")
+
+    def test_stored_log_validator_per_encoding(self):
+        build_id = add_build("sha1", log="stored output\n" * 100)
+        url = f"/builds/{build_id}/log/test_CI"
+        compressed = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+        plain = self.client.get(url, headers={"Accept-Encoding": "identity"})
+        self.assertNotEqual(compressed.headers["etag"], plain.headers["etag"])
+        for encoding, response in (("gzip", compressed), ("identity", plain)):
+            cached = self.client.get(url, headers={"Accept-Encoding": encoding,
+                                                   "If-None-Match": response.headers["etag"]})
+            self.assertEqual(cached.status_code, 304)
+            self.assertEqual(cached.headers["etag"], response.headers["etag"])
+        # a cached plain copy does not validate the gzip body
+        other = self.client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": plain.headers["etag"]})
+        self.assertEqual((other.status_code, other.headers["content-encoding"]), (200, "gzip"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import io
+import json
+import logging
+import threading
+import unittest
+from app.lib import log
+from app.lib.log import configure_logging, log_context, parse_levels, shutdown_logging
+from app.lib.stage_executor import run_stages
+
+
+class TestLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        configure_logging("INFO,app.tests.noisy=ERROR", stream=self.stream)
+        self.logger = logging.getLogger("app.tests")
+
+    def tearDown(self):
+        # Back to the server's default configuration
+        configure_logging()
+
+    def records(self):
+        shutdown_logging()
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_json_with_context_and_extra(self):
+        with log_context(build="job1", stage="unit"):
+            self.logger.info("Stage %s finished", "unit", extra={"duration": 1.5})
+        self.logger.info("outside")
+        first, second = self.records()
+        self.assertEqual(first["message"], "Stage unit finished")
+        self.assertEqual(first["level"], "INFO")
+        self.assertEqual(first["logger"], "app.tests")
+        self.assertEqual((first["build"], first["stage"], first["duration"]), ("job1", "unit", 1.5))
+        self.assertNotIn("build", second)
+
+    def test_levels(self):
+        self.logger.debug("hidden")
+        logging.getLogger("app.tests.noisy").warning("hidden too")
+        logging.getLogger("app.tests.noisy").error("shown")
+        self.assertEqual([record["message"] for record in self.records()], ["shown"])
+        self.assertEqual(parse_levels("warning,app.lib=DEBUG"), {"app": logging.WARNING, "app.lib": logging.DEBUG})
+        with self.assertRaises(ValueError):
+            parse_levels("LOUD")
+
+    def test_exception(self):
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            self.logger.exception("failed")
+        record, = self.records()
+        self.assertIn("RuntimeError: boom", record["exception"])
+
+    def test_written_off_the_calling_thread(self):
+        writers = []
+        original = log.JsonFormatter.format
+
+        def format(formatter, record):
+            writers.append(threading.current_thread().name)
+            return original(formatter, record)
+
+        log.JsonFormatter.format = format
+        try:
+            self.logger.info("queued")
+            self.records()
+        finally:
+            log.JsonFormatter.format = original
+        self.assertEqual(len(writers), 1)
+        self.assertNotEqual(writers[0], threading.current_thread().name)
+
+    def test_stages_inherit_context(self):
+        with log_context(build="job2"):
+            run_stages([(name, lambda name=name: self.logger.info(name) or {"status": "success"})
+                        for name in ("a", "b")])
+        self.assertEqual({record["build"] for record in self.records()}, {"job2"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import sys
+sys.path.append('app')
+from app.lib.log_view import MAX_LINE_CHARS, RangeNotSatisfiable, excerpt, parse_range
+
+
+class TestExcerpt(unittest.TestCase):
+
+    def test_short_log_is_kept_whole(self):
+        view = excerpt("line 1\nline 2", head_lines=2, tail_lines=2)
+        self.assertFalse(view.folded)
+        self.assertEqual((view.head, view.tail, view.total_lines), ("line 1\nline 2", "", 2))
+
+    def test_middle_is_folded(self):
+        log = "\n".join(f"line {i}" for i in range(10))
+        view = excerpt(log, head_lines=2, tail_lines=3)
+        self.assertTrue(view.folded)
+        self.assertEqual(view.head, "line 0\nline 1")
+        self.assertEqual(view.tail, "line 7\nline 8\nline 9")
+        self.assertEqual((view.omitted_lines, view.omitted_bytes, view.total_lines), (5, 35, 10))
+
+    def test_long_lines_are_clipped(self):
+        view = excerpt("x" * (MAX_LINE_CHARS + 10))
+        self.assertTrue(view.head.endswith("[... 10 more characters]"))
+
+
+class TestParseRange(unittest.TestCase):
+
+    def test_ranges(self):
+        self.assertEqual(parse_range("bytes=0-9", 100), (0, 9))
+        self.assertEqual(parse_range("bytes=90-", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=-10", 100), (90, 99))
+        self.assertEqual(parse_range("bytes=-500", 100), (0, 99))
+        self.assertEqual(parse_range("bytes=50-500", 100), (50, 99))
+
+    def test_whole_body(self):
+        # no header, unparsable or multiple ranges are answered with the whole log
+        for header in (None, "", "items=0-1", "bytes=0-1,5-9", "bytes=9-1", "bytes=-"):
+            self.assertIsNone(parse_range(header, 100), header)
+
+    def test_not_satisfiable(self):
+        for header, size in (("bytes=100-", 100), ("bytes=-0", 100), ("bytes=-5", 0)):
+            with self.assertRaises(RangeNotSatisfiable):
+                parse_range(header, size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import sys
+from fastapi.testclient import TestClient
+sys.path.append('app')
+from main import app
+from app.lib import database_api, metrics
+from app.lib.metrics import Counter, Gauge, Histogram, Registry, timed
+from database_helpers import add_build, use_temp_database, restore_database
+
+
+class TestMetricTypes(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = Counter("jobs", "Jobs seen", ["kind"], registry=self.registry)
+        counter.labels("a").inc()
+        counter.labels("a").inc(2)
+        counter.labels('b"').inc()
+        text = self.registry.render()
+        self.assertIn("# TYPE jobs counter", text)
+        self.assertIn('jobs_total{kind="a"} 3', text)
+        self.assertIn('jobs_total{kind="b\\""} 1', text)
+        with self.assertRaises(ValueError):
+            counter.labels("a").inc(-1)
+
+    def test_gauge_function(self):
+        gauge = Gauge("depth", "Queue depth", registry=self.registry)
+        gauge.set_function(lambda: 7)
+        self.assertIn("depth 7\n", self.registry.render())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0), registry=self.registry)
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+        text = self.registry.render()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn("latency_seconds_sum 3.65", text)
+        self.assertIn("latency_seconds_count 4", text)
+
+    def test_duplicate_name(self):
+        Counter("jobs", "Jobs seen", registry=self.registry)
+        with self.assertRaises(ValueError):
+            Counter("jobs", "Jobs seen again", registry=self.registry)
+
+    def test_timed_counts_errors(self):
+        histogram = Histogram("call_seconds", "Calls", ["call"], registry=self.registry)
+        errors = Counter("call_errors", "Failed calls", ["call"], registry=self.registry)
+
+        @timed(histogram, "lookup", errors=errors, failed=lambda result: result is None)
+        def lookup(key):
+            if key == "boom":
+                raise KeyError(key)
+            return {"a": 1}.get(key)
+
+        self.assertEqual(lookup("a"), 1)
+        self.assertIsNone(lookup("b"))
+        with self.assertRaises(KeyError):
+            lookup("boom")
+        self.assertEqual(lookup.__name__, "lookup")
+        self.assertEqual(histogram.labels("lookup").count, 3)
+        self.assertEqual(errors.labels("lookup").value, 2)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        restore_database(self)
+
+    def test_database_calls_are_timed(self):
+        before = metrics.DB_QUERY_SECONDS.labels("get_latest_build_id").count
+        database_api.get_latest_build_id()
+        self.assertEqual(metrics.DB_QUERY_SECONDS.labels("get_latest_build_id").count, before + 1)
+
+    def test_nested_database_calls_count_once(self):
+        # get_entry_by_id reads the stages through get_build_logs and get_stage_results
+        build_id = add_build("sha1")
+        names = ("get_entry_by_id", "get_build_logs", "get_stage_results")
+        before = {name: metrics.DB_QUERY_SECONDS.labels(name).count for name in names}
+        database_api.get_entry_by_id(build_id)
+        after = {name: metrics.DB_QUERY_SECONDS.labels(name).count for name in names}
+        self.assertEqual({name: after[name] - before[name] for name in names},
+                         {"get_entry_by_id": 1, "get_build_logs": 0, "get_stage_results": 0})
+        # called on their own they are still timed
+        database_api.get_build_logs(build_id)
+        self.assertEqual(metrics.DB_QUERY_SECONDS.labels("get_build_logs").count, after["get_build_logs"] + 1)
+
+    def test_metrics_page(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain; version=0.0.4"))
+        for name in ("ci_webhooks_total", "ci_build_queue_depth", "ci_active_builds",
+                     "ci_clone_duration_seconds", "ci_stage_duration_seconds",
+                     "ci_github_request_duration_seconds", "ci_db_query_duration_seconds"):
+            self.assertIn(f"# TYPE {name.replace('_total', '')}", response.text)
+        self.assertIn("ci_build_queue_depth 0", response.text)
+
+
+if __name__ == '__main__':
+    unittest.main()
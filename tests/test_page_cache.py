@@ -0,0 +1,65 @@
+import gzip
+import unittest
+import sys
+sys.path.append('app')
+from app.lib.page_cache import CachedPage, PageCache, accepted_encodings
+
+LARGE_HTML = "<pre>" + "FAILED tests/test_CI.py::test_webhook\n" * 200 + "</pre>"
+
+
+class TestCachedPage(unittest.TestCase):
+
+    def test_precompressed_bodies(self):
+        page = CachedPage(LARGE_HTML, 'W/"tag"')
+        self.assertEqual(gzip.decompress(page.bodies["gzip"]).decode(), LARGE_HTML)
+        self.assertLess(len(page.bodies["gzip"]), len(LARGE_HTML) / 10)
+        self.assertEqual(page.size, sum(len(body) for body in page.bodies.values()))
+
+    def test_small_pages_are_not_compressed(self):
+        self.assertEqual(set(CachedPage("<p>ok</p>", 'W/"tag"').bodies), {"identity"})
+
+    def test_encoding_negotiation(self):
+        page = CachedPage(LARGE_HTML, 'W/"tag"')
+        self.assertEqual(page.body_for(None), ("identity", LARGE_HTML.encode()))
+        self.assertEqual(page.body_for("gzip, deflate")[0], "gzip")
+        self.assertEqual(page.body_for("gzip;q=0, deflate")[0], "identity")
+        self.assertEqual(page.body_for("*")[0], min(set(page.bodies) - {"identity"},
+                                                    key=lambda coding: len(page.bodies[coding])))
+        self.assertEqual(accepted_encodings("br;q=0.5, GZIP"), {"br": 0.5, "gzip": 1.0})
+
+
+class TestPageCache(unittest.TestCase):
+
+    def page(self, size):
+        # below the compression threshold, so the page is size bytes
+        return CachedPage("x" * size, 'W/"tag"')
+
+    def test_lru_eviction_by_bytes(self):
+        cache = PageCache(max_bytes=1000)
+        for key in (1, 2, 3):
+            cache.put(key, self.page(300))
+        # reading 1 makes 2 the least recently used
+        self.assertIsNotNone(cache.get(1))
+        cache.put(4, self.page(300))
+        self.assertIsNone(cache.get(2))
+        self.assertEqual({key for key in (1, 3, 4) if cache.get(key)}, {1, 3, 4})
+        self.assertEqual(cache.size, 900)
+
+    def test_oversized_page_is_not_kept(self):
+        cache = PageCache(max_bytes=100)
+        self.assertFalse(cache.put(1, self.page(200)))
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+    def test_invalidate(self):
+        cache = PageCache(max_bytes=1000)
+        cache.put(1, self.page(300))
+        cache.put(1, self.page(400))
+        self.assertEqual(cache.size, 400)
+        cache.invalidate(1)
+        cache.invalidate(2)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.size, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+import sys
+import os
+import subprocess
+import tempfile
+from unittest.mock import patch
+sys.path.append('app/lib')
+from app.lib.pipeline import (DEFAULT_PIPELINE, PIPELINE_FILE, PipelineError, Stage, load_pipeline,
+                              parse_pipeline)
+from database_helpers import use_temp_database, restore_database
+from app.lib import database_api
+
+
+class TestParsePipeline(unittest.TestCase):
+
+    def test_stages_in_dependency_order(self):
+        stages = parse_pipeline({"stages": {
+            "deploy": {"command": "echo deploy", "needs": ["unit", "lint"]},
+            "unit": {"command": "python3 -m pytest tests -q", "timeout": 120, "needs": "lint"},
+            "lint": "python3 -m pytest tests/test_syntax.py"
+        }})
+        self.assertEqual([stage.name for stage in stages], ["lint", "unit", "deploy"])
+        self.assertEqual(stages[1].timeout, 120)
+        self.assertEqual(stages[1].needs, ["lint"])
+
+    def test_invalid_definitions(self):
+        for data in (
+            None,
+            {"stages": {}},
+            {"stages": {"a": {"timeout": 5}}},
+            {"stages": {"a": {"command": "true", "timeout": 0}}},
+            {"stages": {"a": {"command": "true", "needs": ["b"]}}},
+            {"stages": {"a": {"command": "true", "needs": ["b"]}, "b": {"command": "true", "needs": ["a"]}}},
+            {"stages": {"a": {"command": "true", "retries": 3}}},
+            {"stages": {"a/b": {"command": "true"}}},
+            {"stages": {"a": {"command": "echo 'unterminated"}}},
+            {"stages": {"a": {"command": "make test", "shards": 2}}},
+            {"stages": {"a": {"command": "pytest", "shards": 0}}},
+        ):
+            with self.assertRaises(PipelineError, msg=data):
+                parse_pipeline(data)
+
+    def test_pytest_commands(self):
+        self.assertEqual(Stage("a", "python3 -m pytest tests/test_x.py -v").pytest_args, ["tests/test_x.py", "-v"])
+        self.assertEqual(Stage("a", "pytest -q").pytest_args, ["-q"])
+        self.assertIsNone(Stage("a", "make test").pytest_args)
+
+    def test_load_from_checkout(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual(load_pipeline(tmp), DEFAULT_PIPELINE)
+            with open(os.path.join(tmp, PIPELINE_FILE), "w") as f:
+                f.write("stages:\n  only:\n    command: echo hi\n")
+            self.assertEqual([stage.name for stage in load_pipeline(tmp)], ["only"])
+            with open(os.path.join(tmp, PIPELINE_FILE), "w") as f:
+                f.write("stages: [\n")
+            with self.assertRaises(PipelineError):
+                load_pipeline(tmp)
+
+
+def git(*args, cwd=None):
+    subprocess.run(["git"] + list(args), cwd=cwd, check=True, capture_output=True)
+
+
+class TestPipelineBuild(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.origin = os.path.join(self.tmp, "origin")
+        os.makedirs(os.path.join(self.origin, "tests"))
+        with open(os.path.join(self.origin, "tests", "test_unit.py"), "w") as f:
+            f.write("def test_it():\n    assert False\n")
+        with open(os.path.join(self.origin, PIPELINE_FILE), "w") as f:
+            f.write(
+                "stages:\n"
+                "  check:\n"
+                "    command: python3 -c \"print('checked')\"\n"
+                "  unit:\n"
+                "    command: python3 -m pytest tests/test_unit.py -v\n"
+                "    needs: [check]\n"
+                "  deploy:\n"
+                "    command: python3 -c \"print('deployed')\"\n"
+                "    needs: [unit]\n"
+            )
+        git("init", "-q", cwd=self.origin)
+        git("add", ".", cwd=self.origin)
+        git("-c", "user.email=ci@example.com", "-c", "user.name=ci", "commit", "-q", "-m", "init", cwd=self.origin)
+
+    def tearDown(self):
+        restore_database(self)
+
+    def fake_clone(self, repo_url, identifier, branch, commit_sha=None):
+        git("clone", "-q", self.origin, f"./cloned_repo/repo-{identifier}")
+        return True
+
+    def test_pipeline_from_repository(self):
+        from app.routers.notify import WebhookPayload, run_build
+        payload = WebhookPayload(
+            ref="refs/heads/main",
+            repository={"clone_url": "https://github.com/test/repo.git", "full_name": "test/repo",
+                        "pushed_at": "pipesha1"},
+            head_commit={"id": "pipesha1", "message": "change"}
+        )
+        with patch("app.routers.notify.clone_repo", side_effect=self.fake_clone), \
+             patch("app.routers.notify.get_status_client"):
+            result = run_build(payload, "job-pipesha1", False)
+        self.assertEqual({name: step["status"] for name, step in result["steps"].items()},
+                         {"check": "success", "unit": "failure", "deploy": "skipped"})
+        # the job's result keeps the outcome of each stage, the complete log is only stored
+        self.assertFalse(any("compressed_log" in step or "tests" in step for step in result["steps"].values()))
+        build = database_api.get_entry_by_commit("pipesha1")[0]
+        self.assertEqual(build[4], {"check": "success", "unit": "failure", "deploy": "skipped"})
+        self.assertIn("checked", database_api.get_build_logs(build[0])["check"])
+        # stage durations and the tests' timings are recorded with the build
+        self.assertEqual({row[1] for row in database_api.get_stage_durations()}, {"check", "unit"})
+        self.assertEqual([row[1:4] for row in database_api.get_test_timings()],
+                         [("test/repo", "unit", "tests/test_unit.py::test_it")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import sys
+import os
+import subprocess
+import tempfile
+sys.path.append('app/lib')
+from app.lib.pytest_pool import PytestPool, PytestUnavailable, run_cold
+
+
+def make_project(directory, module_value=1, test_body=None):
+    with open(os.path.join(directory, "sample.py"), "w") as f:
+        f.write(f"VALUE = {module_value}\n")
+    os.makedirs(os.path.join(directory, "tests"), exist_ok=True)
+    with open(os.path.join(directory, "tests", "test_sample.py"), "w") as f:
+        f.write(test_body or (
+            "import sample\n"
+            "def test_value():\n"
+            f"    assert sample.VALUE == {module_value}\n"
+        ))
+
+
+class TestPytestPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pool = PytestPool(size=1, max_runs=2, preload=[])
+
+    def tearDown(self):
+        self.pool.shutdown()
+        self.tmp.cleanup()
+
+    def run_in(self, directory, timeout=60):
+        lines = []
+        returncode, stderr = self.pool.run(directory, ["tests/test_sample.py", "-v"], lines.append, timeout)
+        return returncode, "".join(lines)
+
+    def test_runs_and_streams_output(self):
+        make_project(self.tmp.name)
+        returncode, output = self.run_in(self.tmp.name)
+        self.assertEqual(returncode, 0)
+        self.assertIn("test_value PASSED", output)
+
+    def test_failure_exit_code(self):
+        make_project(self.tmp.name, test_body="def test_fails():\n    assert False\n")
+        returncode, output = self.run_in(self.tmp.name)
+        self.assertEqual(returncode, 1)
+        self.assertIn("FAILURES", output)
+
+    def test_checkout_modules_are_reimported(self):
+        # a second checkout with the same module names sees its own code
+        first = os.path.join(self.tmp.name, "first")
+        second = os.path.join(self.tmp.name, "second")
+        os.makedirs(first)
+        os.makedirs(second)
+        make_project(first, module_value=1)
+        make_project(second, module_value=2)
+        self.assertEqual(self.run_in(first)[0], 0)
+        self.assertEqual(self.run_in(second)[0], 0)
+
+    def test_recycled_after_max_runs(self):
+        make_project(self.tmp.name)
+        for _ in range(3):
+            self.assertEqual(self.run_in(self.tmp.name)[0], 0)
+        self.assertEqual(self.pool.recycled, 1)
+        self.assertEqual(self.pool.started, 2)
+
+    def test_timeout_kills_worker(self):
+        make_project(self.tmp.name, test_body="import time\ndef test_slow():\n    time.sleep(30)\n")
+        with self.assertRaises(subprocess.TimeoutExpired):
+            self.run_in(self.tmp.name, timeout=3)
+        make_project(self.tmp.name)
+        self.assertEqual(self.run_in(self.tmp.name)[0], 0)
+
+    def test_missing_pytest(self):
+        pool = PytestPool(size=1, python=sys.executable + "-missing", preload=[])
+        with self.assertRaises(PytestUnavailable):
+            pool.run(self.tmp.name, [], lambda line: None, 5)
+
+
+class TestColdRun(unittest.TestCase):
+
+    def test_same_result_as_pool(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            make_project(tmp)
+            lines = []
+            returncode, _ = run_cold(tmp, ["tests/test_sample.py", "-v"], lines.append, 60)
+        self.assertEqual(returncode, 0)
+        self.assertIn("test_value PASSED", "".join(lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import threading
+from unittest.mock import patch
+sys.path.append('app/lib')
+import repo_cache
+
+
+def git(*args, cwd=None):
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+class TestRepoCache(unittest.TestCase):
+
+    def setUp(self):
+        """Create a local origin repository and point the cache at a temp dir"""
+        self.tmp = tempfile.mkdtemp()
+        self.origin = os.path.join(self.tmp, "origin")
+        os.makedirs(self.origin)
+        git("init", "-q", "-b", "main", cwd=self.origin)
+        git("config", "user.email", "ci@example.com", cwd=self.origin)
+        git("config", "user.name", "ci", cwd=self.origin)
+        self.first = self.commit("a.py", "print('first')\n")
+        self.original_dir = repo_cache.MIRROR_DIR
+        repo_cache.MIRROR_DIR = os.path.join(self.tmp, "mirrors")
+
+    def tearDown(self):
+        repo_cache.MIRROR_DIR = self.original_dir
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def commit(self, name, content):
+        with open(os.path.join(self.origin, name), "w") as f:
+            f.write(content)
+        git("add", name, cwd=self.origin)
+        git("commit", "-q", "-m", name, cwd=self.origin)
+        return git("rev-parse", "HEAD", cwd=self.origin)
+
+    def test_worktree_of_exact_commit(self):
+        # the worktree is checked out at the requested SHA, not the branch tip
+        self.commit("b.py", "print('second')\n")
+        dest = os.path.join(self.tmp, "build")
+        repo_cache.add_worktree(self.origin, self.first, dest)
+        self.assertEqual(git("rev-parse", "HEAD", cwd=dest), self.first)
+        self.assertFalse(os.path.exists(os.path.join(dest, "b.py")))
+        self.assertTrue(repo_cache.remove_worktree(dest))
+        self.assertFalse(os.path.exists(dest))
+
+    def test_incremental_fetch(self):
+        # the mirror is reused and picks up commits pushed after it was created
+        mirror = repo_cache.ensure_mirror(self.origin)
+        second = self.commit("b.py", "print('second')\n")
+        self.assertEqual(repo_cache.ensure_mirror(self.origin), mirror)
+        dest = os.path.join(self.tmp, "build")
+        repo_cache.add_worktree(self.origin, second, dest)
+        self.assertTrue(os.path.exists(os.path.join(dest, "b.py")))
+        repo_cache.remove_worktree(dest)
+
+    def test_remove_non_worktree(self):
+        # plain directories are left to the caller
+        self.assertFalse(repo_cache.remove_worktree(self.origin))
+
+    def test_evict_cold_mirrors(self):
+        # unused mirrors are evicted when over the limit, mirrors in use are kept
+        other = os.path.join(self.tmp, "other")
+        git("clone", "-q", self.origin, other)
+        cold = repo_cache.ensure_mirror(other)
+        dest = os.path.join(self.tmp, "build")
+        hot = repo_cache.add_worktree(self.origin, "main", dest)
+        evicted = repo_cache.evict_cold_mirrors(limit=0)
+        self.assertEqual(evicted, [cold])
+        self.assertTrue(os.path.isdir(hot))
+        repo_cache.remove_worktree(dest)
+
+    def test_no_eviction_between_fetch_and_worktree(self):
+        # a mirror that was just fetched for a build is not evicted before its worktree exists
+        repo_cache.ensure_mirror(self.origin)
+        dest = os.path.join(self.tmp, "build")
+        evicted = []
+        update_mirror = repo_cache._update_mirror
+
+        def evict_after_fetch(repo_url, path):
+            update_mirror(repo_url, path)
+            thread = threading.Thread(target=lambda: evicted.extend(repo_cache.evict_cold_mirrors(limit=0)))
+            thread.start()
+            thread.join()
+
+        with patch.object(repo_cache, "_update_mirror", evict_after_fetch):
+            mirror = repo_cache.add_worktree(self.origin, self.first, dest)
+        self.assertEqual(evicted, [])
+        self.assertEqual(git("rev-parse", "HEAD", cwd=dest), self.first)
+        self.assertTrue(os.path.isdir(mirror))
+        repo_cache.remove_worktree(dest)
+
+
+if __name__ == '__main__':
+    unittest.main()
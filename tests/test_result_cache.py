@@ -0,0 +1,169 @@
+import unittest
+import os
+import sys
+import subprocess
+import threading
+from unittest.mock import patch
+sys.path.append('app')
+from app.lib import database_api, result_cache
+from app.lib.cancel import BuildCancelled, CancelToken, cancel_scope
+from database_helpers import use_temp_database, restore_database
+
+
+def git(*args, cwd=None):
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.repo = os.path.join(self.tmp, "repo")
+        os.makedirs(os.path.join(self.repo, "app"))
+        os.makedirs(os.path.join(self.repo, "tests"))
+        git("init", "-q", cwd=self.repo)
+        git("config", "user.email", "ci@example.com", cwd=self.repo)
+        git("config", "user.name", "ci", cwd=self.repo)
+        self.write("app/main.py", "x = 1\n")
+        self.write("tests/test_a.py", "def test_a(): pass\n")
+        self.write("tests/test_b.py", "def test_b(): pass\n")
+        self.paths = ["app", "tests/test_a.py"]
+
+    def tearDown(self):
+        restore_database(self)
+
+    def write(self, path, content):
+        with open(os.path.join(self.repo, path), "w") as f:
+            f.write(content)
+        git("add", path, cwd=self.repo)
+        git("commit", "-q", "-m", path, cwd=self.repo)
+
+    def test_key_depends_only_on_relevant_paths(self):
+        key = result_cache.stage_cache_key("test_a", self.repo, self.paths)
+        self.write("tests/test_b.py", "def test_b(): assert False\n")
+        self.assertEqual(result_cache.stage_cache_key("test_a", self.repo, self.paths), key)
+        self.assertNotEqual(result_cache.stage_cache_key("test_b", self.repo, self.paths), key)
+        self.write("app/main.py", "x = 2\n")
+        self.assertNotEqual(result_cache.stage_cache_key("test_a", self.repo, self.paths), key)
+
+    def test_key_depends_on_environment(self):
+        key = result_cache.stage_cache_key("test_a", self.repo, self.paths)
+        with patch.object(result_cache, "environment_fingerprint", return_value="other-python"):
+            self.assertNotEqual(result_cache.stage_cache_key("test_a", self.repo, self.paths), key)
+
+    def test_no_key_outside_git(self):
+        self.assertIsNone(result_cache.stage_cache_key("test_a", self.tmp, self.paths))
+
+    def test_store_and_lookup(self):
+        # success and failure are reused, infrastructure errors are not
+        result_cache.store("k1", "test_a", "sha1", {"status": "failure", "description": "failed",
+                                                   "output": "1 failed", "error": "Tests failed"})
+        result_cache.store("k2", "test_a", "sha1", {"status": "error", "description": "timeout",
+                                                   "output": "", "error": "timed out"})
+        cached = result_cache.lookup("k1")
+        self.assertEqual((cached["status"], cached["commit_hash"]), ("failure", "sha1"))
+        self.assertEqual(database_api.decompress_log(cached["compressed_log"]), "1 failed\nTests failed")
+        self.assertIsNone(result_cache.lookup("k2"))
+        self.assertIsNone(result_cache.lookup(None))
+
+    def test_lru_bound(self):
+        # the least recently used entries are evicted beyond the limit
+        with patch.dict(os.environ, {"CI_RESULT_CACHE_ENTRIES": "2"}):
+            for key in ("k1", "k2"):
+                result_cache.store(key, "test_a", "sha1", {"status": "success", "description": "passed"})
+            result_cache.lookup("k1")
+            result_cache.store("k3", "test_a", "sha1", {"status": "success", "description": "passed"})
+            self.assertIsNotNone(result_cache.lookup("k1"))
+            self.assertIsNone(result_cache.lookup("k2"))
+            self.assertIsNotNone(result_cache.lookup("k3"))
+        self.assertEqual(database_api.clear_stage_result_cache(), 2)
+
+
+class TestCachedBuild(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        self.origin = os.path.join(self.tmp, "origin")
+        os.makedirs(os.path.join(self.origin, "tests"))
+        for name, body in (("test_syntax", "assert True"), ("test_notifier", "assert True"),
+                           ("test_CI", "assert False")):
+            with open(os.path.join(self.origin, "tests", f"{name}.py"), "w") as f:
+                f.write(f"def test_it():\n    {body}\n")
+        git("init", "-q", cwd=self.origin)
+        git("add", ".", cwd=self.origin)
+        git("-c", "user.email=ci@example.com", "-c", "user.name=ci", "commit", "-q", "-m", "init", cwd=self.origin)
+
+    def tearDown(self):
+        restore_database(self)
+
+    def fake_clone(self, repo_url, identifier, branch, commit_sha=None):
+        git("clone", "-q", self.origin, f"./cloned_repo/repo-{identifier}")
+        return True
+
+    def build(self, commit_sha, rebuild=False):
+        from app.routers.notify import WebhookPayload, run_build
+        payload = WebhookPayload(
+            ref="refs/heads/main",
+            repository={"clone_url": "https://github.com/test/repo.git", "full_name": "test/repo",
+                        "pushed_at": commit_sha},
+            head_commit={"id": commit_sha, "message": "change"}
+        )
+        with patch("app.routers.notify.clone_repo", side_effect=self.fake_clone), \
+             patch("app.routers.notify.get_status_client"):
+            return run_build(payload, f"job-{commit_sha}", not rebuild)
+
+    def test_unchanged_stages_are_reused(self):
+        first = self.build("cachesha1")
+        self.assertEqual(first["steps"]["test_CI"]["status"], "failure")
+        self.assertNotIn("cached", first["steps"]["test_CI"])
+
+        second = self.build("cachesha2")
+        for name, step in second["steps"].items():
+            self.assertTrue(step.get("cached"), name)
+            self.assertEqual(step["status"], first["steps"][name]["status"])
+        self.assertTrue(second["steps"]["test_CI"]["description"].startswith("(cached)"))
+
+        forced = self.build("cachesha3", rebuild=True)
+        self.assertNotIn("cached", forced["steps"]["test_CI"])
+
+
+    def test_infrastructure_errors_are_not_reused(self):
+        # a timeout or a missing tool says nothing about the code, so the next push runs the stage again
+        with open(os.path.join(self.origin, ".ci.yml"), "w") as f:
+            f.write("stages:\n  slow:\n    command: sleep 5\n    timeout: 1\n"
+                    "  missing:\n    command: no-such-ci-tool --check\n")
+        git("add", ".", cwd=self.origin)
+        git("-c", "user.email=ci@example.com", "-c", "user.name=ci", "commit", "-q", "-m", "pipeline", cwd=self.origin)
+        first = self.build("cachesha4")
+        self.assertEqual({name: step["status"] for name, step in first["steps"].items()},
+                         {"slow": "error", "missing": "error"})
+        with database_api.session_scope() as db:
+            self.assertEqual(db.query(database_api.StageResultCache).count(), 0)
+        second = self.build("cachesha5")
+        self.assertFalse(any(step.get("cached") for step in second["steps"].values()))
+
+
+    def test_cancelled_stage_is_not_reused(self):
+        # a superseded build's stage is killed, the push that superseded it must not reuse that
+        with open(os.path.join(self.origin, ".ci.yml"), "w") as f:
+            f.write("stages:\n  slow:\n    command: sleep 5\n")
+        git("add", ".", cwd=self.origin)
+        git("-c", "user.email=ci@example.com", "-c", "user.name=ci", "commit", "-q", "-m", "pipeline", cwd=self.origin)
+        token = CancelToken()
+        threading.Timer(1, token.cancel, args=("Superseded by a newer push",)).start()
+        with cancel_scope(token), self.assertRaises(BuildCancelled):
+            self.build("cachesha6")
+        # nor when the stage ends with a verdict just as the build is cancelled
+        def finish_after_cancel(*args, **kwargs):
+            token.cancel("Superseded by a newer push")
+            return {"success": False, "outcome": "failed", "error": "Command exited with 1",
+                    "output": "", "compressed_log": database_api.compress_log("")}
+        token = CancelToken()
+        with patch("app.routers.notify.run_stage_command", side_effect=finish_after_cancel), \
+             cancel_scope(token), self.assertRaises(BuildCancelled):
+            self.build("cachesha7")
+        with database_api.session_scope() as db:
+            self.assertEqual(db.query(database_api.StageResultCache).count(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import sys
+import os
+sys.path.append('app/lib')
+from app.lib import database_api
+from app.lib.sharding import balance, collect_node_ids, parse_durations, run_sharded, split_args
+from database_helpers import use_temp_database, restore_database
+
+TESTS = '''
+import time
+
+def test_slow():
+    time.sleep(0.6)
+
+def test_fast_one():
+    pass
+
+def test_fast_two():
+    pass
+
+def test_fails():
+    assert False
+'''
+
+
+class TestBalance(unittest.TestCase):
+
+    def test_longest_first(self):
+        # one long test gets a shard to itself
+        durations = {"a": 10.0, "b": 4.0, "c": 3.0, "d": 3.0}
+        groups = balance(["a", "b", "c", "d"], durations, 2)
+        self.assertEqual(groups, [["a"], ["b", "c", "d"]])
+
+    def test_unknown_tests_count_as_average(self):
+        # c and d are expected to take 2 s each, pairing them against a and b
+        groups = balance(["a", "b", "c", "d"], {"a": 3.0, "b": 1.0}, 2)
+        self.assertEqual(sorted(groups), [["a", "b"], ["c", "d"]])
+
+    def test_no_more_shards_than_tests(self):
+        self.assertEqual(balance(["a"], {}, 4), [["a"]])
+
+    def test_parse_durations(self):
+        lines = [
+            "============ slowest durations ============\n",
+            "0.60s call     tests/test_a.py::test_slow\n",
+            "0.10s setup    tests/test_a.py::test_slow\n",
+            "0.00s teardown tests/test_a.py::test_fast[x y]\n",
+        ]
+        self.assertEqual(parse_durations(lines), {"tests/test_a.py::test_slow": 0.7,
+                                                  "tests/test_a.py::test_fast[x y]": 0.0})
+
+
+class TestRunSharded(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_database(self)
+        os.makedirs(os.path.join(self.tmp, "tests"))
+        with open(os.path.join(self.tmp, "tests", "test_many.py"), "w") as f:
+            f.write(TESTS)
+
+    def tearDown(self):
+        restore_database(self)
+
+    def test_split_args(self):
+        self.assertEqual(split_args(self.tmp, ["tests/test_many.py::test_slow", "-k", "slow", "-v"]),
+                         (["-k", "slow", "-v"], ["tests/test_many.py::test_slow"]))
+
+    def test_collect(self):
+        self.assertEqual(collect_node_ids(self.tmp, ["tests/test_many.py", "-v"], 60), [
+            "tests/test_many.py::test_slow",
+            "tests/test_many.py::test_fast_one",
+            "tests/test_many.py::test_fast_two",
+            "tests/test_many.py::test_fails",
+        ])
+
+    def test_shards_merge_and_use_recorded_timings(self):
+        lines = []
+        returncode, _ = run_sharded(self.tmp, ["tests/test_many.py", "-v"], 2, lines.append, 60,
+                                    history_key="test/repo")
+        output = "".join(lines)
+        # the failure in one shard fails the merged run
+        self.assertEqual(returncode, 1)
+        self.assertIn("[shard 1/2]", output)
+        self.assertIn("[shard 2/2]", output)
+        self.assertIn("FAILURES", output)
+        tests = parse_durations(lines)
+        self.assertGreater(tests["tests/test_many.py::test_slow"], 0.5)
+
+        # the build stores the timings, and the next run balances by them
+        database_api.create_new_entry("sha1", "main", [{"stage": "tests", "status": "failure", "log": output,
+                                                        "tests": tests}], repository="test/repo")
+        lines = []
+        run_sharded(self.tmp, ["tests/test_many.py", "-v"], 2, lines.append, 60, history_key="test/repo")
+        slow_shard = [line for line in lines if "test_slow PASSED" in line][0][:12]
+        self.assertEqual(len([line for line in lines if line.startswith(slow_shard) and " PASSED" in line]), 1)
+
+    def test_single_shard_falls_back(self):
+        lines = []
+        returncode, _ = run_sharded(self.tmp, ["tests/test_many.py::test_fast_one"], 4, lines.append, 60)
+        self.assertEqual(returncode, 0)
+        self.assertNotIn("[shard", "".join(lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
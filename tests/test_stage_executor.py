@@ -0,0 +1,95 @@
+import unittest
+import sys
+import threading
+import time
+sys.path.append('app/lib')
+from stage_executor import run_stages
+
+
+class TestRunStages(unittest.TestCase):
+
+    def test_stages_run_in_parallel(self):
+        # three 0.3 s stages should take about 0.3 s, not 0.9 s
+        stages = [(name, lambda: time.sleep(0.3) or {"status": "success"}) for name in ("a", "b", "c")]
+        start = time.monotonic()
+        results = run_stages(stages, max_parallel=3)
+        self.assertLess(time.monotonic() - start, 0.8)
+        self.assertEqual(list(results), ["a", "b", "c"])
+
+    def test_concurrency_cap(self):
+        # no more than max_parallel stages may be running at once
+        lock = threading.Lock()
+        running = [0, 0]
+        def stage():
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            time.sleep(0.1)
+            with lock:
+                running[0] -= 1
+            return {"status": "success"}
+        run_stages([(str(i), stage) for i in range(5)], max_parallel=2)
+        self.assertEqual(running[1], 2)
+
+    def test_callback_in_completion_order(self):
+        # the fast stage is reported before the slow one finishes
+        order = []
+        stages = [
+            ("slow", lambda: time.sleep(0.3) or {"status": "success"}),
+            ("fast", lambda: {"status": "failure"}),
+        ]
+        results = run_stages(stages, on_complete=lambda name, result: order.append(name), max_parallel=2)
+        self.assertEqual(order, ["fast", "slow"])
+        self.assertEqual(results["fast"]["status"], "failure")
+
+    def test_stage_exception(self):
+        # an exception inside a stage becomes an error result
+        def broken():
+            raise RuntimeError("boom")
+        results = run_stages([("broken", broken)])
+        self.assertEqual(results["broken"]["status"], "error")
+        self.assertEqual(results["broken"]["error"], "boom")
+
+
+class TestStageGraph(unittest.TestCase):
+
+    def test_needs_run_first(self):
+        # b and c both wait for a, then run side by side
+        started = {}
+        def stage(name):
+            def run():
+                started[name] = time.monotonic()
+                time.sleep(0.2)
+                return {"status": "success"}
+            return run
+        start = time.monotonic()
+        run_stages([(name, stage(name)) for name in ("a", "b", "c")], max_parallel=3,
+                   needs={"b": ["a"], "c": ["a"]})
+        self.assertGreaterEqual(started["b"] - started["a"], 0.2)
+        self.assertLess(abs(started["b"] - started["c"]), 0.1)
+        self.assertLess(time.monotonic() - start, 0.6)
+
+    def test_failed_need_skips_dependents(self):
+        # everything downstream of a failure is skipped and still reported
+        ran, reported = [], []
+        def stage(name, status):
+            return lambda: ran.append(name) or {"status": status}
+        results = run_stages(
+            [("a", stage("a", "failure")), ("b", stage("b", "success")),
+             ("c", stage("c", "success")), ("d", stage("d", "success"))],
+            on_complete=lambda name, result: reported.append(name),
+            needs={"b": ["a"], "c": ["b"]}
+        )
+        self.assertEqual(sorted(ran), ["a", "d"])
+        self.assertEqual(results["b"]["status"], "skipped")
+        self.assertEqual(results["c"]["status"], "skipped")
+        self.assertEqual(sorted(reported), ["a", "b", "c", "d"])
+
+    def test_unmet_needs(self):
+        # a stage needing a stage that does not exist is an error, not a hang
+        results = run_stages([("a", lambda: {"status": "success"})], needs={"a": ["missing"]})
+        self.assertEqual(results["a"]["status"], "error")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import sys
+sys.path.append('app/lib')
+from status_client import StatusClient
+from fake_github import FakeGitHub
+
+
+class TestStatusClient(unittest.TestCase):
+
+    def setUp(self):
+        self.github = FakeGitHub().start()
+        self.client = StatusClient("dummy_token", base_url=self.github.url)
+
+    def tearDown(self):
+        self.client.close(timeout=5)
+        self.github.stop()
+
+    def test_send(self):
+        # a status is created on the fake endpoint and its raw data returned
+        result = self.client.send("owner/repo", "abc123", "success", "Build passed", "CI/test_CI")
+        self.assertEqual(result["state"], "success")
+        self.assertEqual(self.github.latest("abc123")["CI/test_CI"]["description"], "Build passed")
+
+    def test_cached_handles(self):
+        # repository and commit lookups happen once, not once per status
+        for context in ("CI/a", "CI/b", "CI/c"):
+            self.client.send("owner/repo", "abc123", "pending", "Waiting", context)
+        self.assertEqual(self.github.count("GET", "/repos/owner/repo/commits/abc123"), 1)
+        self.assertEqual(self.github.count("GET", "/repos/owner/repo"), 1)
+        self.assertEqual(self.github.count("POST"), 3)
+
+    def test_enqueue_coalesces(self):
+        # only the newest pending transition for a context is sent
+        self.github.latency = 0.2
+        self.client.enqueue("owner/repo", "abc123", "pending", "Warm up", "CI/warmup")
+        for state in ("pending", "failure", "success"):
+            self.client.enqueue("owner/repo", "abc123", state, state, "CI/test_CI")
+        self.assertTrue(self.client.flush(timeout=10))
+        sent = [s for s in self.github.statuses if s["context"] == "CI/test_CI"]
+        self.assertEqual([s["state"] for s in sent], ["success"])
+        self.assertEqual(self.client.coalesced, 2)
+
+    def test_invalid_state(self):
+        # invalid states are rejected before anything is queued
+        with self.assertRaises(ValueError):
+            self.client.enqueue("owner/repo", "abc123", "not_a_state", "desc")
+        self.assertEqual(self.github.count("POST"), 0)
+
+    def test_api_error(self):
+        # errors from GitHub come back as a dummy response
+        self.github.stop()
+        result = self.client.send("owner/repo", "abc123", "success", "desc")
+        self.assertIn("error", result)
+        self.assertEqual(result["state"], "success")
+        self.github = FakeGitHub().start()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import sys
+import os
+import tempfile
+sys.path.append('app/lib')
+from app.lib.syntax_check import SyntaxChecker, blob_hash
+from app.lib.util import check_syntax, changed_python_files
+
+
+def write(directory, name, content):
+    path = os.path.join(directory, name)
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+class TestSyntaxChecker(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.checker = SyntaxChecker(workers=1)
+
+    def tearDown(self):
+        self.checker.shutdown()
+        self.tmp.cleanup()
+
+    def test_blob_hash_matches_git(self):
+        # same id as `git hash-object` for "hello\n"
+        self.assertEqual(blob_hash(b"hello\n"), "ce013625030ba8dba906f756967f9e9ca394464a")
+
+    def test_reports_errors(self):
+        good = write(self.tmp.name, "good.py", "x = 1\n")
+        bad = write(self.tmp.name, "bad.py", "def broken(:\n    pass\n")
+        results = self.checker.check_files([good, bad])
+        self.assertIsNone(results[good])
+        self.assertTrue(results[bad].startswith(f"{bad}: line 1:"))
+
+    def test_cache_by_content(self):
+        # a second file with identical content is not compiled again
+        first = write(self.tmp.name, "a.py", "def broken(:\n")
+        second = write(self.tmp.name, "b.py", "def broken(:\n")
+        self.checker.check_files([first])
+        results = self.checker.check_files([second])
+        self.assertEqual((self.checker.hits, self.checker.misses), (1, 1))
+        self.assertTrue(results[second].startswith(f"{second}:"))
+
+    def test_cache_is_bounded(self):
+        checker = SyntaxChecker(cache_size=2, workers=1)
+        paths = [write(self.tmp.name, f"f{i}.py", f"x = {i}\n") for i in range(5)]
+        checker.check_files(paths)
+        self.assertEqual(len(checker._cache), 2)
+
+    def test_parallel_batch(self):
+        checker = SyntaxChecker(workers=2, parallel_threshold=4)
+        try:
+            paths = [write(self.tmp.name, f"p{i}.py", f"x = {i}\n" if i != 7 else "x = (\n") for i in range(20)]
+            results = checker.check_files(paths)
+        finally:
+            checker.shutdown()
+        self.assertEqual([path for path, error in results.items() if error], [paths[7]])
+
+
+class TestIncrementalCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        write(self.tmp.name, "ok.py", "x = 1\n")
+        write(self.tmp.name, "broken.py", "if True\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_only_changed_files(self):
+        self.assertTrue(check_syntax(self.tmp.name, changed_files=["ok.py", "README.md", "gone.py"]))
+        self.assertFalse(check_syntax(self.tmp.name, changed_files=["broken.py"]))
+
+    def test_whole_repository(self):
+        self.assertFalse(check_syntax(self.tmp.name))
+
+    def test_changed_python_files(self):
+        commits = [
+            {"added": ["a.py", "notes.txt"], "modified": ["b.py"], "removed": []},
+            {"added": [], "modified": ["c.py"], "removed": ["a.py"]}
+        ]
+        self.assertEqual(changed_python_files(commits), ["b.py", "c.py"])
+        self.assertEqual(changed_python_files(None), [])
+
+
+if __name__ == '__main__':
+    unittest.main()